@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""Reproducible performance benchmarks for the audio pipeline.
+
+For every frames_per_buffer x sample_rate combination this runs
+
+- a stage benchmark: blocks pushed through ConversionStage as fast as
+  possible, timing each block and probing allocations per block;
+- a pipeline benchmark: the threaded AudioEngine on the simulated WAV source
+  and null sink (real-time paced), recording end-to-end latency
+  percentiles, drops and process CPU%.
+
+Input is a synthetic test signal or recorded WAV files (``--wav``). Results
+are written as JSON; ``--compare`` prints the change against an earlier run.
+
+    python3 benchmark.py --frames 256 512 1024 --rates 16000 -o bench.json
+"""
+import os
+import sys
+import copy
+import json
+import time
+import wave
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from conversion import ConversionStage
+from ringbuffer import AudioRingBuffer
+from telemetry import STAGE_INDEX
+
+
+def synthetic_signal(rate, seconds, seed=0):
+    """Deterministic speech-like test signal: 2 s talk spurts and pauses over a noise floor."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(rate * seconds)) / rate
+    f0 = 120.0 + 80.0 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    gate = (np.sin(2 * np.pi * 0.25 * t) > 0.0).astype(np.float64)
+    x = 0.3 * voice * gate + 0.01 * rng.standard_normal(len(t))
+    return (np.clip(x, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def load_wav(path, rate):
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2 or wav.getframerate() != rate:
+            raise ValueError(f"{path}: need 16-bit PCM at {rate} Hz")
+        data = np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2")
+        return data.reshape(-1, wav.getnchannels())[:, 0].astype(np.int16)
+
+
+def write_wav(path, samples, rate):
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+
+
+def percentiles_ms(values_ns):
+    if len(values_ns) == 0:
+        return {}
+    ms = np.asarray(values_ns, dtype=np.float64) / 1e6
+    return {
+        "mean": float(ms.mean()),
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+    }
+
+
+def bench_stage(cfg, signal, mode, language, blocks, warmup=10):
+    """Time ConversionStage.process_next per block, then probe allocations."""
+    frames = cfg["audio"]["frames_per_buffer"]
+    stage = ConversionStage(cfg)
+    stage.scheduler = None  # time the full model, not the degraded chains
+    if mode == "convert" and stage.cleaner is None:
+        stage.sessions.load(language)
+    ring_in = AudioRingBuffer(2, frames)
+    ring_out = AudioRingBuffer(2, frames)
+    snap = {"mode": mode, "language": language, "ptt": True}
+    n_src = len(signal) // frames
+
+    def run_block(i):
+        ring_in.push(signal[(i % n_src) * frames:(i % n_src + 1) * frames], time.perf_counter_ns())
+        count = stage.process_next(ring_in, ring_out, snap)
+        ring_in.release_read(count)
+        ring_out.release_read(ring_out.readable())
+
+    for i in range(warmup):
+        run_block(i)
+    times = np.zeros(blocks, dtype=np.int64)
+    for i in range(blocks):
+        t0 = time.perf_counter_ns()
+        run_block(i)
+        times[i] = time.perf_counter_ns() - t0
+
+    # Allocation probe (separate pass, tracing slows everything down)
+    probe = min(blocks, 50)
+    live_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    peaks = []
+    for i in range(probe):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        run_block(i)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    live_after = sys.getallocatedblocks()
+
+    budget_ms = frames / cfg["audio"]["sample_rate"] * 1000.0
+    block_ms = percentiles_ms(times)
+    return {
+        "blocks": blocks,
+        "budget_ms": budget_ms,
+        "block_ms": block_ms,
+        "load": block_ms["mean"] / budget_ms,
+        "alloc_peak_bytes_per_block": float(np.mean(peaks)),
+        "live_objects_per_block": (live_after - live_before) / probe,
+        "gated_fraction": stage.gate.gated_fraction if stage.gate is not None else 0.0,
+    }
+
+
+def bench_pipeline(cfg, wav_path, seconds):
+    """Run the threaded AudioEngine on simulated devices in real time."""
+    from main import StateManager, AudioEngine
+
+    cfg = copy.deepcopy(cfg)
+    cfg["audio"].update({"pipeline": "threaded", "source": "wav", "sink": "null"})
+    cfg["simulation"] = {"wav_path": wav_path, "realtime": True, "loop": True}
+    state = StateManager(cfg)
+    engine = AudioEngine(cfg, state)
+    engine.start()
+    usage0 = resource.getrusage(resource.RUSAGE_SELF)
+    wall0 = time.perf_counter()
+    time.sleep(seconds)
+    usage1 = resource.getrusage(resource.RUSAGE_SELF)
+    wall = time.perf_counter() - wall0
+    engine.stop()
+
+    cpu = (usage1.ru_utime - usage0.ru_utime) + (usage1.ru_stime - usage0.ru_stime)
+    sink = engine.stream_out
+    block_s = cfg["audio"]["frames_per_buffer"] / cfg["audio"]["sample_rate"]
+    intervals = sink.intervals_ms()
+    tracer = state.tracer
+    return {
+        "seconds": wall,
+        "blocks_out": sink.blocks,
+        "latency_ms": {name: tracer.percentiles(STAGE_INDEX[name])
+                       for name in ("total", "inference", "queue_in", "queue_out")},
+        "drops": {
+            "capture_overruns": engine.ring_in.overruns,
+            "processing_overruns": engine.ring_out.overruns,
+            "output_gaps": int(np.count_nonzero(intervals > 1.5 * block_s * 1000.0)),
+            "playout_underruns": engine.playout.underruns if engine.playout is not None else 0,
+        },
+        "playout": engine.playout.stats() if engine.playout is not None else None,
+        "degradation": engine.converter.scheduler.stats() if engine.converter.scheduler is not None else None,
+        "cpu_percent": 100.0 * cpu / wall,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def metadata(args):
+    try:
+        import onnxruntime
+        ort_version = onnxruntime.__version__
+    except Exception:
+        ort_version = None
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "onnxruntime": ort_version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }
+
+
+# Metrics compared by --compare: (path into a result, higher is worse)
+COMPARE = [
+    (("stage", "block_ms", "p50"), True),
+    (("stage", "block_ms", "p99"), True),
+    (("stage", "alloc_peak_bytes_per_block"), True),
+    (("pipeline", "latency_ms", "total", "p95"), True),
+    (("pipeline", "cpu_percent"), True),
+]
+
+
+def _lookup(result, path):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def compare(report, baseline, threshold=0.10):
+    """Print metric changes against a baseline report; returns the regression count."""
+    key = lambda r: (r["input"], r["mode"], r.get("engine", "model"), r["frames_per_buffer"], r["sample_rate"])
+    old = {key(r): r for r in baseline.get("results", [])}
+    regressions = 0
+    for result in report["results"]:
+        before = old.get(key(result))
+        if before is None:
+            continue
+        for path, higher_is_worse in COMPARE:
+            a, b = _lookup(before, path), _lookup(result, path)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            worse = change > threshold if higher_is_worse else change < -threshold
+            regressions += worse
+            print(f"{'REGRESSION' if worse else 'ok':10} {'/'.join(map(str, key(result)))} "
+                  f"{'.'.join(path)}: {a:.3f} -> {b:.3f} ({change:+.1%})")
+    return regressions
+
+
+def main(argv=None):
+    from main import load_config
+
+    parser = argparse.ArgumentParser(description="Benchmark the IntelliVoice audio pipeline")
+    parser.add_argument("-c", "--config", help="Config file (default: config.json)")
+    parser.add_argument("--frames", type=int, nargs="+", default=[256, 512, 1024], help="frames_per_buffer values")
+    parser.add_argument("--rates", type=int, nargs="+", default=[16000], help="sample_rate values")
+    parser.add_argument("--wav", nargs="*", default=[], help="Recorded WAV files to benchmark as well")
+    parser.add_argument("--mode", choices=("convert", "bypass"), default="convert")
+    parser.add_argument("--engine", choices=("model", "dsp"), help="Conversion engine (default: inference.engine)")
+    parser.add_argument("-l", "--language", help="Language model (default: first configured language)")
+    parser.add_argument("--blocks", type=int, default=500, help="Blocks per stage benchmark")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duration of each pipeline run (0 to skip)")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change reported as a regression")
+    args = parser.parse_args(argv)
+
+    base = load_config(args.config)
+    if args.engine:
+        base.setdefault("inference", {})["engine"] = args.engine
+    language = args.language or base["modes"].get("languages", ["EN"])[0]
+    report = {"meta": metadata(args), "results": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for rate in args.rates:
+            inputs = [("synthetic", synthetic_signal(rate, 10.0))]
+            inputs += [(path, load_wav(path, rate)) for path in args.wav]
+            for name, signal in inputs:
+                wav_path = os.path.join(tmp, f"input_{rate}.wav")
+                write_wav(wav_path, signal, rate)
+                for frames in args.frames:
+                    cfg = copy.deepcopy(base)
+                    cfg["audio"].update({"sample_rate": rate, "frames_per_buffer": frames, "channels": 1})
+                    result = {"input": name, "mode": args.mode, "engine": base.get("inference", {}).get("engine", "model"),
+                              "frames_per_buffer": frames, "sample_rate": rate}
+                    print(f"{name} @ {rate} Hz, {frames} frames...", flush=True)
+                    result["stage"] = bench_stage(cfg, signal, args.mode, language, args.blocks)
+                    if args.seconds > 0:
+                        result["pipeline"] = bench_pipeline(cfg, wav_path, args.seconds)
+                    stage = result["stage"]
+                    print(f"  block p50 {stage['block_ms']['p50']:.3f} ms / p99 {stage['block_ms']['p99']:.3f} ms "
+                          f"(budget {stage['budget_ms']:.1f} ms), {stage['alloc_peak_bytes_per_block']:.0f} B/block")
+                    if "pipeline" in result:
+                        pipe = result["pipeline"]
+                        print(f"  latency p95 {pipe['latency_ms']['total']['p95']:.2f} ms, "
+                              f"drops {pipe['drops']}, CPU {pipe['cpu_percent']:.0f}%")
+                    report["results"].append(result)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if compare(report, json.load(f), args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
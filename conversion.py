@@ -0,0 +1,584 @@
+"""Voice conversion stage, shared by the in-process and process-isolated pipelines."""
+import os
+import time
+import signal
+import multiprocessing as mp
+
+import numpy as np
+
+from dsp import DelayLine, ModelRateBridge, SpeechGate, StreamingSTFT, pcm16_to_float, float_to_pcm16
+from inference import SessionManager
+from normalizer import DynamicsProcessor, SpectralCleaner
+from ringbuffer import SharedAudioRing
+from scheduler import BYPASS, FULL, LEVELS, LIGHT, DegradationScheduler
+from telemetry import LatencyTracer, STAGE_INDEX
+
+QUEUE_IN = STAGE_INDEX["queue_in"]
+PRE = STAGE_INDEX["pre"]
+INFERENCE = STAGE_INDEX["inference"]
+POST = STAGE_INDEX["post"]
+
+
+class ConversionStage:
+    """Everything between the input and output rings: gating, STFT, model and batching.
+
+    ``inference.engine`` picks what CONVERT mode does inside the STFT: the
+    ONNX ``model`` or the ``dsp`` voice normalization chain (normalizer.py),
+    which needs no model at all.
+
+    With ``scheduler.enabled`` a DegradationScheduler picks the level of
+    every converted block: the full model, a light chain (the
+    ``light_model_pattern`` model, or the running average of the full
+    model's mask applied as a fixed spectral gain) or bypass. Bypass is the
+    dry input delayed by ``latency_samples`` and is crossfaded against the
+    converted signal, so switching levels never leaves a gap.
+
+    Streaming models (with state inputs, see ModelStream) are run through
+    IOBinding on just the block's new frames, without lookahead context or
+    micro-batching; their state is cleared whenever the STFT restarts or
+    blocks skip the model.
+    """
+
+    ENGINES = ("model", "dsp")
+
+    def __init__(self, cfg, sessions=None, tracer=None):
+        self.cfg = cfg
+        self.sessions = sessions if sessions is not None else SessionManager(cfg)
+        self.session = None
+        self._stream = None  # ModelStream of _stream_session (None: stateless)
+        self._stream_session = None
+        self.tracer = tracer
+        self._t_pre = 0  # perf_counter_ns() around the last model call
+        self._t_post = 0
+        frames = cfg["audio"]["frames_per_buffer"]
+        channels = cfg["audio"]["channels"]
+        slots = cfg["audio"].get("ring_slots", 8)
+        self.stft = None
+        self.bridge = None
+        stft_cfg = cfg.get("stft", {})
+        if stft_cfg.get("enabled", False):
+            if channels == 1:
+                # The model may run at a lower rate than the ADC/DAC; blocks
+                # are then resampled and re-chunked to a multiple of the hop
+                device_rate = cfg["audio"]["sample_rate"]
+                model_rate = cfg["audio"].get("model_rate", device_rate)
+                hop = stft_cfg.get("hop_size", 128)
+                model_frames = frames
+                if model_rate != device_rate:
+                    model_frames = -(-frames * model_rate // (device_rate * hop)) * hop
+                    self.bridge = ModelRateBridge(frames, device_rate, model_rate, model_frames,
+                                                  cfg["audio"].get("resampler_taps", 32))
+                self.stft = StreamingSTFT(
+                    model_frames,
+                    fft_size=stft_cfg.get("fft_size", 512),
+                    hop_size=stft_cfg.get("hop_size", 128),
+                    window=stft_cfg.get("window", "hann"),
+                    lookahead=stft_cfg.get("lookahead", 0),
+                )
+            else:
+                print("Warning: STFT conversion stage requires mono audio; disabled")
+        # DSP engine: spectral cleanup in the STFT, dynamics on its output
+        self.cleaner = None
+        self.dynamics = None
+        self.engine = cfg.get("inference", {}).get("engine", "model")
+        if self.engine == "dsp" and self.stft is not None:
+            norm = cfg.get("normalizer", {})
+            self.cleaner = SpectralCleaner(
+                self.stft.n_frames, self.stft.fft_size, self.stft.hop_size,
+                cfg["audio"].get("model_rate", cfg["audio"]["sample_rate"]),
+                hpf_hz=norm.get("hpf_hz", 100.0),
+                hpf_order=norm.get("hpf_order", 4),
+                noise_reduction_db=norm.get("noise_reduction_db", 12.0),
+                noise_over=norm.get("noise_over", 1.5),
+                noise_rise_db_s=norm.get("noise_rise_db_s", 10.0),
+                deess_low_hz=norm.get("deess_low_hz", 4000.0),
+                deess_high_hz=norm.get("deess_high_hz", 8000.0),
+                deess_threshold=norm.get("deess_threshold", 0.3),
+                deess_max_db=norm.get("deess_max_db", 8.0),
+            )
+            self.dynamics = DynamicsProcessor(
+                frames, cfg["audio"]["sample_rate"],
+                gate_threshold_dbfs=norm.get("gate_threshold_dbfs", -50.0),
+                gate_floor_db=norm.get("gate_floor_db", -20.0),
+                gate_hold_ms=norm.get("gate_hold_ms", 150.0),
+                agc_target_dbfs=norm.get("agc_target_dbfs", -20.0),
+                agc_max_gain_db=norm.get("agc_max_gain_db", 12.0),
+                agc_max_cut_db=norm.get("agc_max_cut_db", 6.0),
+                agc_time_ms=norm.get("agc_time_ms", 2000.0),
+                comp_threshold_dbfs=norm.get("comp_threshold_dbfs", -18.0),
+                comp_ratio=norm.get("comp_ratio", 3.0),
+                limiter_ceiling_dbfs=norm.get("limiter_ceiling_dbfs", -1.0),
+            )
+        # Speech gate: skip the model on silence / while PTT is released
+        self.gate = None
+        self._gated_next = False  # gate already closed on the next queued block
+        gate_cfg = cfg.get("gating", {})
+        if gate_cfg.get("enabled", False):
+            self.gate = SpeechGate(
+                frames, cfg["audio"]["sample_rate"], channels,
+                use_ptt=gate_cfg.get("use_ptt", False),
+                vad=gate_cfg.get("vad", True),
+                threshold_dbfs=gate_cfg.get("threshold_dbfs", -45.0),
+                zcr_max=gate_cfg.get("zcr_max", 0.35),
+                loud_margin_db=gate_cfg.get("loud_margin_db", 20.0),
+                hangover_ms=gate_cfg.get("hangover_ms", 300.0),
+                fill=gate_cfg.get("fill", "comfort_noise"),
+                comfort_noise_dbfs=gate_cfg.get("comfort_noise_dbfs", -66.0),
+            )
+        # Deadline-aware degradation
+        self.scheduler = None
+        self.light_sessions = None
+        self.level = FULL
+        sched_cfg = cfg.get("scheduler", {})
+        if self.stft is not None and sched_cfg.get("enabled", False):
+            rate = cfg["audio"]["sample_rate"]
+            block_ns = frames * 1e9 / rate
+            self.scheduler = DegradationScheduler(
+                block_ns, block_ns * sched_cfg.get("deadline_blocks", 2.0),
+                headroom=sched_cfg.get("headroom", 0.8),
+                recover_load=sched_cfg.get("recover_load", 0.5),
+                recover_blocks=int(sched_cfg.get("recover_ms", 2000.0) * 1e6 / block_ns),
+                max_backoff=sched_cfg.get("max_backoff", 16),
+            )
+            if cfg.get("inference", {}).get("light_model_pattern"):
+                self.light_sessions = SessionManager(cfg, light=True)
+            self.dry = DelayLine(self.latency_samples, frames)
+            self._dry = np.zeros(frames, dtype=np.int16)
+            self._fade_step = 1.0 / max(1.0, sched_cfg.get("crossfade_ms", 20.0) * rate / 1000.0)
+            self._steps = np.arange(1, frames + 1, dtype=np.float32)
+            self._gain = np.zeros(frames, dtype=np.float32)
+            self._mix = np.zeros(frames, dtype=np.float32)
+            self._pcm_mix = np.zeros(frames, dtype=np.int16)
+            self._wet_gain = 1.0  # 0 = dry (bypass), 1 = converted
+            self._stale = False  # wet chain stopped while fully bypassed
+            self._prime = 0  # samples until a restarted wet chain is valid
+            self._held_mask = np.ones(self.stft.n_bins, dtype=np.float32)
+            self._mask_mean = np.zeros(self.stft.n_bins, dtype=np.float32)
+            self._held_language = None
+            self._hold_alpha = np.float32(sched_cfg.get("mask_alpha", 0.05))
+        self._x = np.zeros(frames, dtype=np.float32)
+        self._model_block_fn = self.convert_model_block  # bound once, called per model block
+        self._scratch = np.zeros(frames, dtype=np.float32)
+        self._pcm_out = np.zeros(frames, dtype=np.int16)
+
+        # Micro-batching (threaded pipeline): up to batch_max_blocks queued
+        # blocks share one inference call (not when resampling to model_rate)
+        inf_cfg = cfg.get("inference", {})
+        self.batch_max_blocks = max(1, min(inf_cfg.get("batch_max_blocks", 1), slots))
+        self.batch_max_latency_ns = int(inf_cfg.get("batch_max_latency_ms", 0.0) * 1e6)
+        self.batch_sizes = [0] * (self.batch_max_blocks + 1)  # histogram of batch sizes used
+        if self.stft is not None:
+            ctx = self.stft.lookahead + self.stft.n_frames
+            self._spec_batch = np.zeros((self.batch_max_blocks, ctx, self.stft.n_bins), dtype=np.complex64)
+            self._mag_batch = np.zeros((self.batch_max_blocks, ctx, self.stft.n_bins), dtype=np.float32)
+            self._spec_out = np.zeros((self.stft.n_frames, self.stft.n_bins), dtype=np.complex64)
+
+    def process_block(self, pcm, snap):
+        # `pcm` is an int16 view; the result may be the same array
+        self._t_pre = 0
+        if snap["mode"] == "bypass":
+            return pcm
+        if self.gate is not None and not self.gate_open(pcm, snap):
+            return self.gate.fill(pcm)
+        if self.scheduler is not None:
+            # Not queued: the deadline is one block from now
+            self.scheduler.begin(time.perf_counter_ns())
+            out = self.convert_level(pcm, snap["language"], self.scheduler.level)
+            self.scheduler.end(time.perf_counter_ns())
+            return out
+        return self.convert(pcm, self.model_session(snap["language"]))
+
+    def model_session(self, language):
+        """The language's model session, or None when the DSP engine runs instead."""
+        return self.sessions.get(language) if self.cleaner is None else None
+
+    def gate_open(self, pcm, snap):
+        """Run the speech gate on one block; False means skip the model."""
+        was_open = self.gate.is_open
+        is_open = self.gate.update(pcm, snap.get("ptt", False))
+        if is_open and not was_open:
+            # Drop overlap left over from before the pause
+            self.reset()
+        return is_open
+
+    def reset(self, adaptive=False):
+        """Clear the streaming state (STFT overlap, resampler history).
+
+        With ``adaptive`` the DSP engine also forgets its noise estimate and
+        AGC gain (for a new recording rather than a new utterance).
+        """
+        if self.stft is not None:
+            self.stft.reset()
+        if self.bridge is not None:
+            self.bridge.reset()
+        if adaptive and self.cleaner is not None:
+            self.cleaner.reset()
+            self.dynamics.reset()
+        if self._stream is not None:
+            self._stream.reset()
+        if self.scheduler is not None:
+            self.dry.reset()
+            self._stale = False
+            # A partly faded-in wet chain restarts from silence
+            self._prime = self.latency_samples if self._wet_gain < 1.0 else 0
+
+    def preload(self):
+        """Load and warm up the models of every level before audio starts."""
+        if self.cleaner is not None:
+            return  # the DSP engine has no models
+        self.sessions.preload()
+        if self.light_sessions is not None:
+            self.light_sessions.preload()
+
+    @property
+    def degradation(self):
+        """Name of the current degradation level ('full' without a scheduler)."""
+        return LEVELS[self.scheduler.level] if self.scheduler is not None else "full"
+
+    @property
+    def latency_samples(self):
+        """Algorithmic delay of CONVERT mode, in device-rate samples."""
+        if self.stft is None:
+            return 0
+        if self.bridge is None:
+            return self.stft.latency_samples
+        ratio = self.bridge.device_rate / self.bridge.model_rate
+        return round(self.bridge.latency_samples + self.stft.latency_samples * ratio)
+
+    def process_next(self, ring_in, ring_out, snap):
+        """Convert the next block(s) from ring_in into ring_out.
+
+        Returns how many input blocks were consumed; the caller releases them.
+        """
+        t_deq = time.perf_counter_ns()
+        self._t_pre = 0
+        session = None
+        gated = False
+        scheduled = False
+        level = FULL
+        gated_next, self._gated_next = self._gated_next, False
+        if snap["mode"] == "convert":
+            # A batch that stopped at a closed block already ran the gate on it
+            gated = gated_next or (self.gate is not None and not self.gate_open(ring_in.read_view()[1], snap))
+            if not gated:
+                if self.scheduler is not None:
+                    # The oldest queued block sets the deadline
+                    scheduled = True
+                    level = self.scheduler.begin(t_deq, ring_in.read_view()[0])
+                    self.level = level
+                session = self.model_session(snap["language"])
+        if (session is not None and level == FULL and self.batch_max_blocks > 1 and self.stft is not None
+                and self.bridge is None and (not scheduled or self._wet_gain == 1.0)
+                and self.model_stream(session) is None):
+            count = self.batch_size(ring_in)
+            if self.gate is not None:
+                # Keep the VAD and hangover in step with the batched blocks;
+                # the batch ends before the first block the gate closes on
+                for i in range(1, count):
+                    if not self.gate.update(ring_in.read_view(i)[1], snap.get("ptt", False)):
+                        count = i
+                        self._gated_next = True
+                        break
+            self.process_batch(ring_in, ring_out, count, session, t_deq, snap["language"])
+        else:
+            count = 1
+            t0, pcm = ring_in.read_view()
+            slot = ring_out.write_slot()
+            if slot is not None:
+                if snap["mode"] == "bypass":
+                    out = pcm
+                elif gated:
+                    out = self.gate.fill(pcm)
+                elif scheduled:
+                    out = self.convert_level(pcm, snap["language"], level)
+                else:
+                    out = self.convert(pcm, session)
+                np.copyto(slot, out, casting="unsafe")
+                ring_out.commit_write(t0)
+                self.trace_block(t0, t_deq, time.perf_counter_ns())
+        if scheduled:
+            self.scheduler.end(time.perf_counter_ns(), count)
+        self.batch_sizes[count] += 1
+        return count
+
+    def trace_block(self, t0, t_deq, t_enq):
+        """Record queue/pre/inference/post stage times for one block.
+
+        `t0` is the capture stamp (None when the block was not queued).
+        """
+        tracer = self.tracer
+        if tracer is None:
+            return
+        if t0 is not None:
+            tracer.record(QUEUE_IN, t_deq - t0)
+        if self._t_pre:
+            tracer.record(PRE, self._t_pre - t_deq)
+            tracer.record(INFERENCE, self._t_post - self._t_pre)
+            tracer.record(POST, t_enq - self._t_post)
+        else:
+            tracer.record(PRE, t_enq - t_deq)
+
+    def convert_level(self, pcm, language, level):
+        """Convert one block at a degradation level, crossfading to/from bypass."""
+        dry = self.dry.process(pcm, self._dry)
+        self.level = level
+        if level == BYPASS and self._wet_gain == 0.0:
+            self._stale = True
+            return dry
+        if self._stale:
+            # Restart the wet chain; it outputs silence until its history refills
+            self.stft.reset()
+            if self.bridge is not None:
+                self.bridge.reset()
+            self._prime = self.latency_samples
+            self._stale = False
+            self._stream_session = None
+        self.hold_language(language)
+        session = None
+        if level == FULL:
+            session = self.model_session(language)
+        elif level == LIGHT and self.light_sessions is not None and self.cleaner is None:
+            session = self.light_sessions.get(language)
+        wet = self.convert(pcm, session)
+        if self._prime > 0:
+            self._prime -= len(pcm)
+            return dry
+        return self.crossfade(wet, dry, 0.0 if level == BYPASS else 1.0)
+
+    def hold_language(self, language):
+        # The light chain's held mask is learned from one language's model
+        if language != self._held_language:
+            self._held_mask.fill(1.0)
+            self._held_language = language
+
+    def crossfade(self, wet, dry, target):
+        """Move the wet gain towards `target` (linear, crossfade_ms per full swing)."""
+        g0 = self._wet_gain
+        if g0 == target:
+            return wet if target == 1.0 else dry
+        n = len(wet)
+        gain = np.multiply(self._steps[:n], self._fade_step if target > g0 else -self._fade_step,
+                           out=self._gain[:n])
+        gain += g0
+        np.clip(gain, 0.0, 1.0, out=gain)
+        mix = np.subtract(wet, dry, out=self._mix[:n], dtype=np.float32)
+        mix *= gain
+        mix += dry
+        np.copyto(self._pcm_mix[:n], mix, casting="unsafe")
+        self._wet_gain = float(gain[-1])
+        return self._pcm_mix[:n]
+
+    def convert(self, pcm, session):
+        self.session = session
+        if self.stft is None:
+            return pcm
+        x = pcm16_to_float(pcm, self._x)
+        if self.bridge is not None:
+            y = self.bridge.process(x, self._model_block_fn)
+        else:
+            y = self.stft.process(x, self.convert_spectra)
+        if self.dynamics is not None:
+            self.dynamics.process(y)
+        return float_to_pcm16(y, self._pcm_out, self._scratch)
+
+    def convert_model_block(self, x):
+        # One model-rate block (resampled path)
+        return self.stft.process(x, self.convert_spectra)
+
+    def convert_spectra(self, spectra, n_out):
+        # `spectra` holds n_out frames plus `stft.lookahead` frames of right
+        # context
+        if self.cleaner is not None:
+            if self.level != FULL:
+                return spectra[:n_out]  # light dsp chain: dynamics only
+            return self.cleaner.process(spectra, n_out, self._spec_out)
+        if self.session is None:
+            self._stream_session = None  # a streaming model's state goes stale
+            if self.level != FULL:
+                # Light chain without a light model: the average mask
+                return np.multiply(spectra[:n_out], self._held_mask, out=self._spec_out)
+            return spectra[:n_out]
+        self._spec_batch[0] = spectra
+        mask = self.run_model(1)
+        return np.multiply(spectra[:n_out], mask[0, :n_out], out=self._spec_out)
+
+    def run_model(self, count):
+        # Model contract: magnitude (batch, frames, bins) -> gain mask of the
+        # same shape, applied to the complex spectra (phase is preserved)
+        np.abs(self._spec_batch[:count], out=self._mag_batch[:count])
+        stream = self.model_stream(self.session)
+        self._t_pre = time.perf_counter_ns()
+        if stream is not None:
+            result = stream.run()
+        else:
+            result = self.sessions.run(self.session, self._mag_batch[:count])
+        self._t_post = time.perf_counter_ns()
+        if self.scheduler is not None and self.level == FULL:
+            self.learn_mask(result[:count, :self.stft.n_frames])
+        return result
+
+    def model_stream(self, session):
+        """The ModelStream of a streaming session (bound to the first block's new frames).
+
+        Built afresh, from zero state, whenever the session changes.
+        """
+        if session is not self._stream_session:
+            self._stream = self.sessions.stream(session, self._mag_batch[:1, :self.stft.n_frames])
+            self._stream_session = session
+        return self._stream
+
+    def learn_mask(self, masks):
+        """Track the full model's average gain per bin for the light chain."""
+        mean = np.mean(masks, axis=(0, 1), out=self._mask_mean)
+        mean -= self._held_mask
+        mean *= self._hold_alpha
+        self._held_mask += mean
+
+    def batch_size(self, ring_in):
+        """Pick how many queued blocks to convert in the next inference call."""
+        depth = ring_in.readable()
+        if depth < self.batch_max_blocks and self.batch_max_latency_ns > 0:
+            # Wait for more blocks, but never past the oldest block's budget
+            t0, _ = ring_in.read_view()
+            deadline = t0 + self.batch_max_latency_ns
+            while depth < self.batch_max_blocks and time.perf_counter_ns() < deadline:
+                time.sleep(0.0005)
+                depth = ring_in.readable()
+        return max(1, min(depth, self.batch_max_blocks))
+
+    def process_batch(self, ring_in, ring_out, count, session, t_deq=None, language=None):
+        """Convert the oldest `count` queued blocks with a single inference call.
+        The caller releases them from the input ring (and, with a scheduler,
+        times the batch as `count` blocks at the full level)."""
+        if t_deq is None:
+            t_deq = time.perf_counter_ns()
+        self.session = session
+        if self.scheduler is not None:
+            # As convert_level at the full level: the mask learned from this
+            # batch belongs to `language`
+            self.level = FULL
+            self.hold_language(language)
+        stft = self.stft
+        n = stft.n_frames
+        for i in range(count):
+            _, pcm = ring_in.read_view(i)
+            if self.scheduler is not None:
+                # Keep the bypass delay line in step
+                self.dry.process(pcm, self._dry)
+            self._spec_batch[i] = stft.analyze(pcm16_to_float(pcm, self._x))
+        masks = self.run_model(count)
+        for i in range(count):
+            t0, _ = ring_in.read_view(i)
+            np.multiply(self._spec_batch[i, :n], masks[i, :n], out=self._spec_out)
+            y = stft.synthesize(self._spec_out)
+            slot = ring_out.write_slot()
+            if slot is not None:
+                float_to_pcm16(y, slot, self._scratch)
+                ring_out.commit_write(t0)
+                self.trace_block(t0, t_deq, time.perf_counter_ns())
+
+
+# Indices into ConversionWorker.control
+CTRL_RUNNING = 0
+CTRL_CONVERT = 1
+CTRL_LANGUAGE = 2
+CTRL_PTT = 3
+CTRL_DEGRADATION = 4  # written by the worker
+
+
+def _worker_main(cfg, ring_in, ring_out, control, trace_buffer, cpus, ready):
+    # Ctrl-C reaches the whole process group; the parent shuts the worker
+    # down through CTRL_RUNNING
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            print(f"Warning: cannot pin conversion worker to CPUs {cpus}: {e}")
+    stage = ConversionStage(cfg, tracer=LatencyTracer(buffer=trace_buffer))
+    stage.preload()
+    languages = stage.sessions.languages
+    ready.set()
+
+    while control[CTRL_RUNNING]:
+        if not ring_in.wait_readable(timeout=0.1):
+            continue
+        snap = {
+            "mode": "convert" if control[CTRL_CONVERT] else "bypass",
+            "language": languages[control[CTRL_LANGUAGE]],
+            "ptt": bool(control[CTRL_PTT]),
+        }
+        count = 1
+        try:
+            count = stage.process_next(ring_in, ring_out, snap)
+        except Exception as e:
+            print(f"Error in conversion worker: {e}")
+            time.sleep(0.1)
+        ring_in.release_read(count)
+        if stage.scheduler is not None:
+            control[CTRL_DEGRADATION] = stage.scheduler.level
+
+
+class ConversionWorker:
+    """Runs the ConversionStage in its own process.
+
+    Audio crosses the process boundary through two shared-memory rings whose
+    semaphores act as doorbells, so the capture and playback threads never
+    share a GIL with the model. Mode and language are mirrored into a small
+    shared control array by the parent, along with the PTT line; the worker
+    reports its degradation level back through the same array.
+    """
+
+    def __init__(self, cfg):
+        ctx = mp.get_context("spawn")
+        frames = cfg["audio"]["frames_per_buffer"]
+        channels = cfg["audio"]["channels"]
+        slots = cfg["audio"].get("ring_slots", 8)
+        self.ring_in = SharedAudioRing(slots, frames, channels, ctx=ctx)
+        self.ring_out = SharedAudioRing(slots, frames, channels, ctx=ctx)
+        self.control = ctx.RawArray("q", 5)
+        self.control[CTRL_RUNNING] = 1
+        # Stage histograms are shared so the parent can report the worker's timings
+        self.trace_buffer = ctx.RawArray("q", LatencyTracer.storage_size())
+        self.tracer = LatencyTracer(buffer=self.trace_buffer)
+        self.language_index = {lang: i for i, lang in enumerate(cfg["modes"].get("languages", ["EN"]))}
+        self.ready = ctx.Event()
+        cpus = cfg.get("inference", {}).get("worker_cpus")
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(cfg, self.ring_in, self.ring_out, self.control, self.trace_buffer, cpus, self.ready),
+            name="intellivoice-conversion",
+            daemon=True,
+        )
+
+    def start(self, timeout=120.0):
+        """Start the worker and wait until its models are warmed up."""
+        self.process.start()
+        if not self.ready.wait(timeout):
+            print("Warning: conversion worker did not report ready in time")
+
+    def update(self, snap):
+        self.control[CTRL_CONVERT] = 1 if snap["mode"] == "convert" else 0
+        self.control[CTRL_LANGUAGE] = self.language_index.get(snap["language"], 0)
+        self.control[CTRL_PTT] = 1 if snap.get("ptt", False) else 0
+
+    def degradation(self):
+        return LEVELS[self.control[CTRL_DEGRADATION]]
+
+    def stop(self, close=True):
+        """Stop the worker and remove the shared rings.
+
+        Call it once no thread of the caller uses the rings any more; with
+        ``close`` False the segments are unlinked but stay mapped, for when a
+        thread may still be inside a ring call.
+        """
+        self.control[CTRL_RUNNING] = 0
+        if self.process.pid is not None:
+            self.process.join(timeout=1.0)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join(timeout=1.0)
+        for ring in (self.ring_in, self.ring_out):
+            if close:
+                ring.close()
+            ring.unlink()
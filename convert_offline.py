@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Offline voice conversion of WAV files, as fast as the CPU allows.
+
+Runs the same ConversionStage / ring buffer path as the device's processor
+thread (including micro-batching), without real-time pacing. Input files are
+memory-mapped and streamed block by block; the STFT latency is trimmed so
+the output lines up with the input. Prints the real-time factor per file.
+
+    python3 convert_offline.py recordings/ -o converted/ --language ES --jobs 4
+"""
+import os
+import sys
+import json
+import time
+import wave
+import struct
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from conversion import ConversionStage
+from ringbuffer import AudioRingBuffer
+
+
+def wav_memmap(path):
+    """Memory-map the samples of a 16-bit PCM WAV file.
+
+    Returns (sample_rate, (frames, channels) int16 memmap).
+    """
+    with open(path, "rb") as f:
+        riff, _, form = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or form != b"WAVE":
+            raise ValueError(f"{path}: not a RIFF/WAVE file")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path}: no data chunk")
+            chunk_id, size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = struct.unpack("<HHIIHH", f.read(16))
+                f.seek(size - 16 + (size & 1), os.SEEK_CUR)
+            elif chunk_id == b"data":
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+    if fmt is None:
+        raise ValueError(f"{path}: no fmt chunk")
+    audio_format, channels, rate, _, _, bits = fmt
+    if audio_format not in (1, 0xFFFE) or bits != 16:
+        raise ValueError(f"{path}: only 16-bit PCM WAV files are supported")
+    available = os.path.getsize(path) - offset
+    frames = min(size, available) // (2 * channels)
+    if frames == 0:
+        return rate, np.zeros((0, channels), dtype=np.int16)
+    data = np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=(frames, channels))
+    return rate, data
+
+
+def find_wavs(paths):
+    """Expand files and directories (recursively) into (source, relative name) pairs."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(".wav"):
+                        full = os.path.join(root, name)
+                        found.append((full, os.path.relpath(full, path)))
+        else:
+            found.append((path, os.path.basename(path)))
+    return found
+
+
+class OfflineConverter:
+    """Feeds WAV files through a ConversionStage via the input/output rings."""
+
+    def __init__(self, cfg, language, mode="convert", sessions=None):
+        self.cfg = cfg
+        self.rate = cfg["audio"]["sample_rate"]
+        self.frames = cfg["audio"]["frames_per_buffer"]
+        self.stage = ConversionStage(cfg, sessions)
+        self.stage.scheduler = None  # no deadlines offline: always the full model
+        slots = max(cfg["audio"].get("ring_slots", 8), self.stage.batch_max_blocks, 2)
+        self.ring_in = AudioRingBuffer(slots, self.frames)
+        self.ring_out = AudioRingBuffer(slots, self.frames)
+        # Files are treated as keyed transmissions; the VAD still gates silence
+        self.snap = {"mode": mode, "language": language, "ptt": True}
+        if mode == "convert" and self.stage.cleaner is None:
+            # Load synchronously; the device's get() would skip blocks until ready
+            self.stage.sessions.load(language)
+
+    def convert_file(self, src, dst, channel=0):
+        rate, data = wav_memmap(src)
+        if rate != self.rate:
+            raise ValueError(f"{src}: sample rate {rate} does not match audio.sample_rate {self.rate}")
+        x = data[:, min(channel, data.shape[1] - 1)]
+        total = len(x)
+        self.stage.reset(adaptive=True)
+        # Bypass passes blocks straight through; conversion adds the STFT
+        # (and resampling) delay
+        skip = self.stage.latency_samples if self.snap["mode"] == "convert" else 0
+        n_blocks = -(-(total + skip) // self.frames)
+
+        os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+        start = time.perf_counter()
+        with wave.open(dst, "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(rate)
+            fed = 0
+            written = 0
+            while fed < n_blocks:
+                # Fill the input ring straight from the memory map
+                while fed < n_blocks and self.ring_in.writable():
+                    slot = self.ring_in.write_slot()
+                    chunk = x[fed * self.frames:(fed + 1) * self.frames]
+                    slot[:len(chunk)] = chunk
+                    slot[len(chunk):] = 0
+                    self.ring_in.commit_write(time.perf_counter_ns())
+                    fed += 1
+                while self.ring_in.readable():
+                    count = self.stage.process_next(self.ring_in, self.ring_out, self.snap)
+                    self.ring_in.release_read(count)
+                    written = self._drain(out, skip, total, written)
+        elapsed = time.perf_counter() - start
+        duration = total / rate
+        return {
+            "source": src,
+            "output": dst,
+            "duration_s": duration,
+            "elapsed_s": elapsed,
+            "rtf": elapsed / duration if duration else 0.0,
+        }
+
+    def _drain(self, out, skip, total, written):
+        # `written` counts output samples including the trimmed latency
+        while self.ring_out.readable():
+            _, pcm = self.ring_out.read_view()
+            lo = max(0, skip - written)
+            hi = min(len(pcm), skip + total - written)
+            if hi > lo:
+                out.writeframes(pcm[lo:hi].tobytes())
+            written += len(pcm)
+            self.ring_out.release_read()
+        return written
+
+
+_converter = None
+
+
+def _init_worker(cfg, language, mode):
+    global _converter
+    _converter = OfflineConverter(cfg, language, mode)
+
+
+def _convert_in_worker(job):
+    src, dst, channel = job
+    try:
+        return _converter.convert_file(src, dst, channel)
+    except Exception as e:
+        return {"source": src, "error": str(e)}
+
+
+def output_path(src, rel, output_dir):
+    if output_dir:
+        return os.path.join(output_dir, rel)
+    stem, ext = os.path.splitext(src)
+    return f"{stem}_converted{ext or '.wav'}"
+
+
+def main(argv=None):
+    from main import load_config, validate_config
+
+    parser = argparse.ArgumentParser(description="Convert WAV files offline with the IntelliVoice pipeline")
+    parser.add_argument("inputs", nargs="+", help="WAV files or directories")
+    parser.add_argument("-o", "--output-dir", help="Output directory (default: <name>_converted.wav next to each input)")
+    parser.add_argument("-c", "--config", help="Config file (default: config.json)")
+    parser.add_argument("-l", "--language", help="Language model to use (default: first configured language)")
+    parser.add_argument("--mode", choices=("convert", "bypass"), default="convert")
+    parser.add_argument("--engine", choices=("model", "dsp"), help="Conversion engine (default: inference.engine)")
+    parser.add_argument("--channel", type=int, default=0, help="Input channel for multi-channel files")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Worker processes (files are spread across them)")
+    parser.add_argument("--threads", type=int, help="ONNX Runtime intra-op threads per process")
+    parser.add_argument("--json", help="Write per-file results to this JSON file")
+    args = parser.parse_args(argv)
+
+    cfg = load_config(args.config)
+    errors, _ = validate_config(cfg)
+    if errors:
+        for error in errors:
+            print(f"  ERROR: {error}")
+        return 1
+    inference = cfg.setdefault("inference", {})
+    if args.engine:
+        inference["engine"] = args.engine
+    if args.threads is not None:
+        inference["intra_op_threads"] = args.threads
+    elif args.jobs > 1:
+        inference["intra_op_threads"] = max(1, (os.cpu_count() or 1) // args.jobs)
+    language = args.language or cfg["modes"].get("languages", ["EN"])[0]
+
+    jobs = [(src, output_path(src, rel, args.output_dir), args.channel)
+            for src, rel in find_wavs(args.inputs)]
+    if not jobs:
+        print("No WAV files found")
+        return 1
+
+    start = time.perf_counter()
+    if args.jobs > 1:
+        with ProcessPoolExecutor(args.jobs, mp_context=mp.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(cfg, language, args.mode)) as pool:
+            results = list(pool.map(_convert_in_worker, jobs))
+    else:
+        _init_worker(cfg, language, args.mode)
+        results = [_convert_in_worker(job) for job in jobs]
+    wall = time.perf_counter() - start
+
+    audio = 0.0
+    failed = 0
+    for result in results:
+        if "error" in result:
+            failed += 1
+            print(f"✗ {result['source']}: {result['error']}")
+            continue
+        audio += result["duration_s"]
+        speed = 1.0 / result["rtf"] if result["rtf"] else float("inf")
+        print(f"✓ {result['source']} -> {result['output']}: {result['duration_s']:.1f}s audio "
+              f"in {result['elapsed_s']:.2f}s (RTF {result['rtf']:.3f}, {speed:.1f}x real time)")
+    if wall > 0:
+        print(f"{len(results) - failed} file(s), {audio:.1f}s audio in {wall:.2f}s "
+              f"({audio / wall:.1f}x real time overall)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"language": language, "mode": args.mode, "wall_s": wall, "files": results}, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,451 @@
+"""Block-streaming DSP building blocks for the audio pipeline."""
+import math
+import functools
+from collections import namedtuple
+
+import numpy as np
+
+# numpy >= 2.0 runs float32 FFTs natively and accepts out= on the fft functions
+# (the result lands in place; the FFT still allocates its own work buffers)
+_FFT_HAS_OUT = np.lib.NumpyVersion(np.__version__) >= "2.0.0"
+
+PCM16_SCALE = 32768.0
+
+
+def pcm16_to_float(pcm, out):
+    """Scale int16 samples to float32 in [-1, 1) into a preallocated array."""
+    np.multiply(pcm, np.float32(1.0 / PCM16_SCALE), out=out, casting="unsafe")
+    return out
+
+
+def float_to_pcm16(x, out, scratch):
+    """Clip float samples back to int16 using a float32 scratch buffer."""
+    np.multiply(x, np.float32(PCM16_SCALE), out=scratch)
+    np.clip(scratch, -PCM16_SCALE, PCM16_SCALE - 1.0, out=scratch)
+    np.copyto(out, scratch, casting="unsafe")
+    return out
+
+
+LevelReading = namedtuple("LevelReading", ["rms", "peak", "dbfs", "clips", "vu"])
+
+SILENCE_DBFS = -120.0
+
+
+class LevelMeter:
+    """Allocation-free level metering for int16 blocks.
+
+    Computes RMS, peak, RMS in dBFS, the number of clipped samples and a VU
+    ballistic (one-pole smoothing of RMS with a ``vu_time_ms`` time constant)
+    using preallocated scratch buffers only. ``clip_count`` accumulates over
+    the meter's lifetime.
+    """
+
+    def __init__(self, frames, sample_rate, vu_time_ms=300.0, clip_level=32767):
+        self._buf = np.zeros(frames, dtype=np.float32)
+        self._mask = np.zeros(frames, dtype=np.bool_)
+        self.sample_rate = sample_rate
+        self.vu_time = vu_time_ms / 1000.0
+        self.clip_level = clip_level
+        self.clip_count = 0
+        self.vu = 0.0
+
+    def process(self, pcm):
+        n = len(pcm)
+        buf = self._buf[:n]
+        mask = self._mask[:n]
+        pcm16_to_float(pcm, buf)
+
+        rms = math.sqrt(float(np.dot(buf, buf)) / n) if n else 0.0
+        peak = max(float(buf.max()), -float(buf.min())) if n else 0.0
+        dbfs = 20.0 * math.log10(rms) if rms > 0.0 else SILENCE_DBFS
+
+        np.greater_equal(pcm, self.clip_level, out=mask)
+        clips = int(np.count_nonzero(mask))
+        np.less_equal(pcm, -self.clip_level, out=mask)
+        clips += int(np.count_nonzero(mask))
+        self.clip_count += clips
+
+        # VU ballistic: one-pole low-pass of RMS, coefficient per block length
+        coef = math.exp(-n / (self.sample_rate * self.vu_time)) if self.vu_time > 0 else 0.0
+        self.vu = coef * self.vu + (1.0 - coef) * rms
+        return LevelReading(rms, peak, dbfs, self.clip_count, self.vu)
+
+
+class SpeechGate:
+    """Per-block decision whether the voice model has to run at all.
+
+    A block counts as speech when the PTT line is keyed (only checked with
+    ``use_ptt``) and the energy / zero-crossing VAD fires: RMS at or above
+    ``threshold_dbfs`` with a zero-crossing rate of at most ``zcr_max``
+    (broadband hiss crosses zero far more often than voiced speech), or RMS
+    ``loud_margin_db`` above the threshold whatever the ZCR, so loud
+    fricatives pass. The gate stays open for ``hangover_ms`` after the last
+    speech block so word endings and short pauses are converted too.
+
+    While the gate is closed the caller emits ``fill(pcm)`` instead of
+    running the model: ``silence``, ``comfort_noise`` (a fixed table of
+    low-level noise at ``comfort_noise_dbfs``, cycled) or ``passthrough``
+    (the unprocessed input). Everything works on preallocated buffers.
+    """
+
+    FILLS = ("silence", "comfort_noise", "passthrough")
+
+    def __init__(self, frames, sample_rate, channels=1, use_ptt=False, vad=True,
+                 threshold_dbfs=-45.0, zcr_max=0.35, loud_margin_db=20.0,
+                 hangover_ms=300.0, fill="comfort_noise", comfort_noise_dbfs=-66.0):
+        if fill not in self.FILLS:
+            raise ValueError(f"Unknown gate fill: {fill}")
+        self.channels = channels
+        self.use_ptt = use_ptt
+        self.vad = vad
+        self.threshold_dbfs = threshold_dbfs
+        self.zcr_max = zcr_max
+        self.loud_dbfs = threshold_dbfs + loud_margin_db
+        self.hangover_frames = int(hangover_ms * sample_rate / 1000.0)
+        self.fill_mode = fill
+        n = frames * channels
+        self._buf = np.zeros(n, dtype=np.float32)
+        self._signs = np.zeros(frames, dtype=np.bool_)
+        self._cross = np.zeros(frames, dtype=np.bool_)
+        self._silence = np.zeros(n, dtype=np.int16)
+        amplitude = PCM16_SCALE * 10.0 ** (comfort_noise_dbfs / 20.0)
+        noise = np.random.default_rng(0).standard_normal(n * 16) * amplitude
+        self._noise = np.clip(np.round(noise), -PCM16_SCALE, PCM16_SCALE - 1).astype(np.int16)
+        self._noise_pos = 0
+        self._hold = 0  # frames of hangover left
+        self.is_open = False
+        self.level_dbfs = SILENCE_DBFS
+        self.zcr = 0.0
+        self.blocks_open = 0
+        self.blocks_gated = 0
+
+    def detect(self, pcm):
+        """Energy / zero-crossing voice activity decision for one block."""
+        n = len(pcm)
+        if n == 0:
+            return False
+        buf = pcm16_to_float(pcm, self._buf[:n])
+        mean_square = float(np.dot(buf, buf)) / n
+        self.level_dbfs = 10.0 * math.log10(mean_square) if mean_square > 0.0 else SILENCE_DBFS
+        if self.level_dbfs < self.threshold_dbfs:
+            return False
+        if self.level_dbfs >= self.loud_dbfs:
+            return True
+        x = buf[::self.channels]  # first channel
+        m = len(x)
+        if m < 2:
+            return True
+        np.signbit(x, out=self._signs[:m])
+        np.not_equal(self._signs[1:m], self._signs[:m - 1], out=self._cross[:m - 1])
+        self.zcr = np.count_nonzero(self._cross[:m - 1]) / (m - 1)
+        return self.zcr <= self.zcr_max
+
+    def update(self, pcm, ptt=False):
+        """Feed one block; returns True while the model should run."""
+        if self.use_ptt and not ptt:
+            speech = False
+        else:
+            speech = self.detect(pcm) if self.vad else True
+        if speech:
+            self._hold = self.hangover_frames
+            self.is_open = True
+        else:
+            self.is_open = self._hold > 0
+            self._hold = max(0, self._hold - len(pcm) // self.channels)
+        if self.is_open:
+            self.blocks_open += 1
+        else:
+            self.blocks_gated += 1
+        return self.is_open
+
+    @property
+    def gated_fraction(self):
+        total = self.blocks_open + self.blocks_gated
+        return self.blocks_gated / total if total else 0.0
+
+    def fill(self, pcm):
+        """Output for a gated block (may be a view of an internal buffer)."""
+        n = len(pcm)
+        if self.fill_mode == "passthrough":
+            return pcm
+        if self.fill_mode == "silence":
+            return self._silence[:n]
+        if self._noise_pos + n > len(self._noise):
+            self._noise_pos = 0
+        out = self._noise[self._noise_pos:self._noise_pos + n]
+        self._noise_pos += n
+        return out
+
+
+def make_window(name, size):
+    n = np.arange(size, dtype=np.float64)
+    if name == "hann":
+        w = 0.5 - 0.5 * np.cos(2.0 * np.pi * n / size)
+    elif name == "sqrt_hann":
+        w = np.sqrt(0.5 - 0.5 * np.cos(2.0 * np.pi * n / size))
+    elif name == "hamming":
+        w = 0.54 - 0.46 * np.cos(2.0 * np.pi * n / size)
+    elif name == "rect":
+        w = np.ones(size)
+    else:
+        raise ValueError(f"Unknown window: {name}")
+    return w.astype(np.float32)
+
+
+class StreamingSTFT:
+    """Streaming STFT analysis / overlap-add synthesis across block boundaries.
+
+    Each call to ``process`` takes one block of ``block_size`` samples and
+    returns one block of the same size, delayed by ``latency_samples``. All
+    frames that complete inside the block are analysed in a single vectorized
+    ``rfft`` over a strided view of the persistent history buffer, passed to
+    ``spectral_fn`` and resynthesised with weighted overlap-add.
+
+    The history, frames, spectra and overlap-add buffers are allocated once
+    and the FFTs write into them, but numpy's FFT allocates and frees its
+    working buffers on every call (a few tens of KB per block at 16 kHz, see
+    ``benchmark.py``), so a block is not allocation-free.
+
+    With ``lookahead > 0`` the spectra handed to ``spectral_fn`` include that
+    many future frames after the frames being synthesised, so a model can use
+    right context at the cost of ``lookahead * hop_size`` extra samples of
+    latency. ``spectral_fn(spectra, n_out)`` must return ``n_out`` frames.
+    """
+
+    def __init__(self, block_size, fft_size=512, hop_size=128, window="hann", lookahead=0):
+        if block_size % hop_size or fft_size % hop_size:
+            raise ValueError("block_size and fft_size must be multiples of hop_size")
+        if lookahead < 0:
+            raise ValueError("lookahead must be >= 0")
+        self.block_size = block_size
+        self.fft_size = fft_size
+        self.hop_size = hop_size
+        self.lookahead = lookahead
+        self.n_frames = block_size // hop_size
+        self.n_bins = fft_size // 2 + 1
+        self.latency_samples = fft_size - hop_size + lookahead * hop_size
+
+        self.window = make_window(window, fft_size)
+        # Synthesis window normalised so analysis*synthesis overlap-adds to 1
+        overlaps = fft_size // hop_size
+        denom = (self.window ** 2).reshape(overlaps, hop_size).sum(axis=0)
+        if np.any(denom <= 1e-8):
+            raise ValueError(f"Window '{window}' cannot be inverted at hop {hop_size}")
+        self.synth_window = (self.window / np.tile(denom, overlaps)).astype(np.float32)
+
+        tail = fft_size - hop_size
+        self._history = np.zeros(tail + block_size, dtype=np.float32)
+        self._frames_view = np.lib.stride_tricks.sliding_window_view(
+            self._history, fft_size)[::hop_size]
+        self._frames = np.zeros((self.n_frames, fft_size), dtype=np.float32)
+        self._spectra = np.zeros((lookahead + self.n_frames, self.n_bins), dtype=np.complex64)
+        self._synth = np.zeros((self.n_frames, fft_size), dtype=np.float32)
+        self._acc = np.zeros(tail + block_size, dtype=np.float32)
+        self._acc_hops = self._acc.reshape(-1, hop_size)
+        self._out = np.zeros(block_size, dtype=np.float32)
+
+    def reset(self):
+        self._history.fill(0.0)
+        self._spectra.fill(0.0)
+        self._acc.fill(0.0)
+
+    def analyze(self, block):
+        """Push one block and return the spectra window (history + new frames)."""
+        tail = self.fft_size - self.hop_size
+        self._history[:tail] = self._history[self.block_size:]
+        self._history[tail:] = block
+        np.multiply(self._frames_view, self.window, out=self._frames)
+
+        # Keep `lookahead` frames of spectral context from the previous call
+        n, la = self.n_frames, self.lookahead
+        if la:
+            np.copyto(self._spectra[:la], self._spectra[n:])
+        new = self._spectra[la:]
+        if _FFT_HAS_OUT:
+            np.fft.rfft(self._frames, axis=1, out=new)
+        else:
+            new[:] = np.fft.rfft(self._frames, axis=1)
+        return self._spectra
+
+    def synthesize(self, spectra):
+        """Overlap-add ``n_frames`` spectra and return one finished block."""
+        if _FFT_HAS_OUT:
+            np.fft.irfft(spectra, n=self.fft_size, axis=1, out=self._synth)
+        else:
+            self._synth[:] = np.fft.irfft(spectra, n=self.fft_size, axis=1)
+        self._synth *= self.synth_window
+
+        n, hop = self.n_frames, self.hop_size
+        segments = self._synth.reshape(n, -1, hop)
+        for r in range(segments.shape[1]):
+            self._acc_hops[r:r + n] += segments[:, r, :]
+
+        self._out[:] = self._acc[:self.block_size]
+        tail = self.fft_size - hop
+        self._acc[:tail] = self._acc[self.block_size:]
+        self._acc[tail:] = 0.0
+        return self._out
+
+    def process(self, block, spectral_fn=None):
+        spectra = self.analyze(block)
+        if spectral_fn is None:
+            current = spectra[:self.n_frames]
+        else:
+            current = spectral_fn(spectra, self.n_frames)
+        return self.synthesize(current)
+
+
+@functools.lru_cache(maxsize=None)
+def polyphase_bank(up, down, taps_per_phase=32, rolloff=0.9, beta=8.0):
+    """Kaiser-windowed sinc low-pass for resampling by up/down, split into phases.
+
+    Returns a read-only (up, taps_per_phase) float32 array whose rows hold the
+    taps of each phase in reverse order, ready to be multiplied with a window
+    of ascending input samples. Banks are cached per rate pair.
+    """
+    length = up * taps_per_phase
+    cutoff = rolloff * 0.5 / max(up, down)  # cycles per sample at the upsampled rate
+    n = np.arange(length) - (length - 1) / 2.0
+    h = 2.0 * cutoff * np.sinc(2.0 * cutoff * n) * np.kaiser(length, beta)
+    h *= up / h.sum()  # unity DC gain after zero-stuffing
+    bank = h.reshape(taps_per_phase, up).T[:, ::-1]
+    bank = np.ascontiguousarray(bank, dtype=np.float32)
+    bank.flags.writeable = False
+    return bank
+
+
+class StreamResampler:
+    """Stateful rational resampler for float32 blocks of varying length.
+
+    Output sample ``n`` sits at input position ``n * down / up``; its phase
+    row of the cached polyphase bank is applied to the ``taps_per_phase``
+    input samples before it. The last inputs are kept as history so the
+    filter runs seamlessly across block boundaries, and the fractional
+    position carries over, so a block yields ``len(x) * up / down`` outputs
+    on average (one more or less from call to call). All outputs of a block
+    are computed at once from a strided window view, without allocating.
+    """
+
+    def __init__(self, rate_in, rate_out, max_block, taps_per_phase=32):
+        g = math.gcd(rate_in, rate_out)
+        self.up = rate_out // g
+        self.down = rate_in // g
+        self.taps = taps_per_phase
+        self.max_block = max_block
+        self.max_out = -(-max_block * self.up // self.down) + 1
+        self.bank = polyphase_bank(self.up, self.down, taps_per_phase)
+        self.delay = (taps_per_phase * self.up - 1) / (2.0 * self.up)  # in input samples
+        self._buf = np.zeros(taps_per_phase - 1 + max_block, dtype=np.float32)
+        self._windows = np.lib.stride_tricks.sliding_window_view(self._buf, taps_per_phase)
+        self._ramp = np.arange(self.max_out, dtype=np.int64) * self.down
+        self._times = np.zeros(self.max_out, dtype=np.int64)
+        self._base = np.zeros(self.max_out, dtype=np.int64)
+        self._phase = np.zeros(self.max_out, dtype=np.int64)
+        self._frames = np.zeros((self.max_out, taps_per_phase), dtype=np.float32)
+        self._coefs = np.zeros((self.max_out, taps_per_phase), dtype=np.float32)
+        self._out = np.zeros(self.max_out, dtype=np.float32)
+        self._t = 0  # next output position, in 1/up input samples from the block start
+
+    def reset(self):
+        self._buf.fill(0.0)
+        self._t = 0
+
+    def process(self, x, out=None):
+        """Resample one block; returns the outputs (a view of ``out`` if given)."""
+        n_in = len(x)
+        if n_in > self.max_block:
+            raise ValueError(f"block of {n_in} samples exceeds max_block {self.max_block}")
+        hist = self.taps - 1
+        self._buf[hist:hist + n_in] = x
+        span = n_in * self.up
+        count = (span - self._t + self.down - 1) // self.down if span > self._t else 0
+        times = np.add(self._ramp[:count], self._t, out=self._times[:count])
+        base = np.floor_divide(times, self.up, out=self._base[:count])
+        phase = np.remainder(times, self.up, out=self._phase[:count])
+        frames = np.take(self._windows, base, axis=0, out=self._frames[:count])
+        coefs = np.take(self.bank, phase, axis=0, out=self._coefs[:count])
+        np.multiply(frames, coefs, out=frames)
+        y = self._out[:count] if out is None else out[:count]
+        np.sum(frames, axis=1, out=y)
+        self._t += count * self.down - span
+        self._buf[:hist] = self._buf[n_in:n_in + hist]
+        return y
+
+
+class ModelRateBridge:
+    """Runs a fixed-size block function at the model rate inside device-rate blocks.
+
+    Each device block is resampled down into a FIFO; every time it holds
+    ``model_frames`` samples, ``fn`` converts them and the result is
+    resampled up into an output FIFO, from which exactly one device block is
+    returned. The output FIFO starts primed with ``prefill`` samples of
+    silence, enough to cover one model block plus resampler rounding, so it
+    never runs dry; ``latency_samples`` is the resulting delay at the device
+    rate, excluding whatever ``fn`` itself adds.
+    """
+
+    def __init__(self, device_frames, device_rate, model_rate, model_frames, taps_per_phase=32):
+        self.device_frames = device_frames
+        self.device_rate = device_rate
+        self.model_rate = model_rate
+        self.model_frames = model_frames
+        self.down = StreamResampler(device_rate, model_rate, device_frames, taps_per_phase)
+        self.up = StreamResampler(model_rate, device_rate, model_frames, taps_per_phase)
+        ratio = device_rate / model_rate
+        self.prefill = math.ceil(model_frames * ratio) + 2
+        self.latency_samples = self.prefill + self.down.delay + self.up.delay * ratio
+        max_calls = -(-(self.down.max_out + model_frames) // model_frames)
+        self._in = np.zeros(model_frames + self.down.max_out, dtype=np.float32)
+        self._out = np.zeros(self.prefill + device_frames + max_calls * self.up.max_out, dtype=np.float32)
+        self._block = np.zeros(device_frames, dtype=np.float32)
+        self.underruns = 0
+        self.reset()
+
+    def reset(self):
+        self.down.reset()
+        self.up.reset()
+        self._in.fill(0.0)
+        self._out.fill(0.0)
+        self._n_in = 0
+        self._n_out = self.prefill
+
+    def process(self, x, fn):
+        m = self.model_frames
+        self._n_in += len(self.down.process(x, self._in[self._n_in:]))
+        while self._n_in >= m:
+            y = fn(self._in[:m])
+            self._n_out += len(self.up.process(y, self._out[self._n_out:]))
+            rest = self._n_in - m
+            self._in[:rest] = self._in[m:self._n_in]
+            self._n_in = rest
+        n = len(x)
+        block = self._block[:n]
+        take = min(n, self._n_out)
+        block[:take] = self._out[:take]
+        if take < n:
+            block[take:] = 0.0
+            self.underruns += 1
+        rest = self._n_out - take
+        self._out[:rest] = self._out[take:self._n_out]
+        self._n_out = rest
+        return block
+
+
+class DelayLine:
+    """Delays a block stream by a fixed number of samples."""
+
+    def __init__(self, delay, max_block, dtype=np.int16):
+        self.delay = delay
+        self._buf = np.zeros(delay + max_block, dtype=dtype)
+
+    def reset(self):
+        self._buf.fill(0)
+
+    def process(self, x, out):
+        """Write ``x`` into the line and the block from ``delay`` samples ago into ``out``."""
+        n, d = len(x), self.delay
+        buf = self._buf
+        buf[d:d + n] = x
+        out[:n] = buf[:n]
+        buf[:d] = buf[n:n + d]
+        return out[:n]
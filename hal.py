@@ -0,0 +1,406 @@
+"""Hardware abstraction: registry of audio, display and GPIO backends.
+
+Every backend is a factory registered under a kind and a name. Hardware
+libraries (pyaudio, spidev, gpiozero, luma) are imported only inside their
+factories, so the simulated backends - a paced WAV source, a null sink, a
+virtual OLED and scripted buttons - run on any Linux box.
+"""
+import time
+import wave
+import threading
+
+import numpy as np
+
+# PortAudio callback return codes (paContinue / paComplete)
+PA_CONTINUE = 0
+PA_COMPLETE = 1
+
+BACKENDS = {"source": {}, "sink": {}, "display": {}, "gpio": {}}
+
+
+def register(kind, name):
+    """Decorator registering `factory` as the `name` backend of `kind`."""
+    def decorator(factory):
+        BACKENDS[kind][name] = factory
+        return factory
+    return decorator
+
+
+def create(kind, name, *args):
+    try:
+        factory = BACKENDS[kind][name]
+    except KeyError:
+        raise ValueError(f"Unknown {kind} backend: {name}") from None
+    return factory(*args)
+
+
+def names(kind):
+    return tuple(BACKENDS[kind])
+
+
+# Audio. Sources and sinks follow the PyAudio blocking stream interface:
+# read()/write(), start_stream(), stop_stream(), close(), is_active() and
+# get_input_latency()/get_output_latency(). Factories take (cfg, engine); the
+# engine owns shared resources such as the PortAudio instance. Streams carry
+# the device's native channel count (audio.device_channels); the engine
+# picks the input channel and fans its output back out.
+
+def device_channels(cfg):
+    return cfg["audio"].get("device_channels", cfg["audio"]["channels"])
+
+
+def _card_device(pa, card):
+    """PortAudio index of ALSA card `card` (hw:N), or None for the default device."""
+    if card is None:
+        return None
+    for i in range(pa.get_device_count()):
+        if f"(hw:{card}," in pa.get_device_info_by_index(i).get("name", ""):
+            return i
+    print(f"Warning: ALSA card {card} not found; using the default device")
+    return None
+
+
+def _pyaudio_stream(cfg, engine, **kwargs):
+    import pyaudio
+
+    if engine.pa is None:
+        engine.pa = pyaudio.PyAudio()
+    device = _card_device(engine.pa, cfg["audio"].get("hifiberry_card"))
+    if kwargs.get("input"):
+        kwargs["input_device_index"] = device
+    if kwargs.get("output"):
+        kwargs["output_device_index"] = device
+    return engine.pa.open(
+        format=pyaudio.paInt16,
+        channels=device_channels(cfg),
+        rate=cfg["audio"]["sample_rate"],
+        frames_per_buffer=cfg["audio"]["frames_per_buffer"],
+        **kwargs,
+    )
+
+
+@register("source", "pyaudio")
+def pyaudio_source(cfg, engine):
+    return _pyaudio_stream(cfg, engine, input=True)
+
+
+@register("sink", "pyaudio")
+def pyaudio_sink(cfg, engine):
+    return _pyaudio_stream(cfg, engine, output=True)
+
+
+def pyaudio_duplex(cfg, engine, callback):
+    """One full-duplex PortAudio stream driven by `callback` (not started)."""
+    return _pyaudio_stream(cfg, engine, input=True, output=True,
+                           stream_callback=callback, start=False)
+
+
+@register("source", "spi")
+def spi_source(cfg, engine):
+    from spi_audio import ADS1256Input
+    return ADS1256Input(cfg)
+
+
+@register("sink", "spi")
+def spi_sink(cfg, engine):
+    from spi_audio import DAC8532Output
+    return DAC8532Output(cfg)
+
+
+@register("source", "wav")
+def wav_source(cfg, engine):
+    sim = cfg.get("simulation", {})
+    return WavSource(cfg, sim["wav_path"], realtime=sim.get("realtime", True), loop=sim.get("loop", False))
+
+
+@register("sink", "null")
+def null_sink(cfg, engine):
+    return NullSink(cfg, realtime=cfg.get("simulation", {}).get("realtime", True))
+
+
+class WavSource:
+    """Input stream reading a 16-bit WAV file, paced like a sound card.
+
+    The whole file is loaded once. ``read()`` returns the next block, and with
+    ``realtime`` sleeps until the block would have finished arriving from a
+    device running at the configured sample rate; without it blocks are
+    returned as fast as they are asked for. After the end of the file it
+    loops or returns silence (``finished`` is then True).
+    """
+
+    def __init__(self, cfg, path, realtime=True, loop=False):
+        self.rate = cfg["audio"]["sample_rate"]
+        self.frames = cfg["audio"]["frames_per_buffer"]
+        self.channels = device_channels(cfg)
+        with wave.open(path, "rb") as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError(f"{path}: only 16-bit PCM WAV files are supported")
+            if wav.getframerate() != self.rate:
+                raise ValueError(f"{path}: sample rate {wav.getframerate()} does not match "
+                                 f"audio.sample_rate {self.rate}")
+            file_channels = wav.getnchannels()
+            data = np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2")
+        data = data.reshape(-1, file_channels)
+        if file_channels != self.channels:
+            # Take the first channel and fan it out to the configured count
+            data = np.repeat(data[:, :1], self.channels, axis=1)
+        self.samples = np.ascontiguousarray(data, dtype=np.int16).reshape(-1)
+        self.realtime = realtime
+        self.loop = loop
+        self.position = 0  # in frames
+        self.blocks_read = 0
+        self.finished = False
+        self._block = np.zeros(self.frames * self.channels, dtype=np.int16)
+        self._start_ns = None
+        self.running = False
+
+    def start_stream(self):
+        self.running = True
+
+    def is_active(self):
+        return self.running
+
+    def read(self, num_frames, exception_on_overflow=False):
+        if self._start_ns is None:
+            self._start_ns = time.perf_counter_ns()
+        n = num_frames * self.channels
+        block = self._block[:n]
+        total = len(self.samples)
+        start = self.position * self.channels
+        filled = 0
+        while filled < n:
+            if start >= total:
+                if not self.loop or total == 0:
+                    self.finished = True
+                    block[filled:] = 0
+                    break
+                start = 0
+            take = min(n - filled, total - start)
+            block[filled:filled + take] = self.samples[start:start + take]
+            filled += take
+            start += take
+        self.position = start // self.channels
+        self.blocks_read += 1
+        if self.realtime:
+            due_ns = self._start_ns + int(self.blocks_read * num_frames * 1e9 / self.rate)
+            delay = (due_ns - time.perf_counter_ns()) / 1e9
+            if delay > 0:
+                time.sleep(delay)
+        return block
+
+    def get_input_latency(self):
+        return 0.0
+
+    def stop_stream(self):
+        self.running = False
+
+    def close(self):
+        self.running = False
+
+
+class NullSink:
+    """Output stream that discards audio and records when each block arrived.
+
+    With ``realtime`` it consumes blocks at the configured sample rate (like
+    a DAC draining its buffer), so the pipeline sees normal back-pressure.
+    Arrival times are kept in a preallocated array of ``capacity`` blocks.
+    """
+
+    def __init__(self, cfg, realtime=True, capacity=100000):
+        self.rate = cfg["audio"]["sample_rate"]
+        self.channels = device_channels(cfg)
+        self.realtime = realtime
+        self.arrivals_ns = np.zeros(capacity, dtype=np.int64)
+        self.blocks = 0
+        self.samples = 0
+        self._clock_ns = None
+        self.running = False
+
+    def start_stream(self):
+        self.running = True
+
+    def is_active(self):
+        return self.running
+
+    def write(self, data, num_frames=None, exception_on_underflow=False):
+        now = time.perf_counter_ns()
+        if self.blocks < len(self.arrivals_ns):
+            self.arrivals_ns[self.blocks] = now
+        frames = memoryview(data).nbytes // (2 * self.channels)
+        self.blocks += 1
+        self.samples += frames
+        if self.realtime:
+            # One block of device buffer: return once the previous block has
+            # finished playing
+            duration_ns = int(frames * 1e9 / self.rate)
+            if self._clock_ns is None or self._clock_ns < now:
+                self._clock_ns = now  # underrun: the device clock restarts
+            self._clock_ns += duration_ns
+            delay = (self._clock_ns - duration_ns - time.perf_counter_ns()) / 1e9
+            if delay > 0:
+                time.sleep(delay)
+
+    def intervals_ms(self):
+        """Time between consecutive block arrivals, in milliseconds."""
+        n = min(self.blocks, len(self.arrivals_ns))
+        return np.diff(self.arrivals_ns[:n]) / 1e6
+
+    def get_output_latency(self):
+        return 0.0
+
+    def stop_stream(self):
+        self.running = False
+
+    def close(self):
+        self.running = False
+
+
+# Display. Factories take cfg and return a luma-compatible device.
+
+@register("display", "ssd1306")
+def ssd1306_display(cfg):
+    from luma.core.interface.serial import i2c
+    from luma.oled.device import ssd1306
+
+    port = cfg["display"].get("i2c_port", 13)
+    # Address is specified in decimal in config (60 = 0x3C)
+    address = cfg["display"].get("i2c_address", 60)
+    serial = i2c(port=port, address=address)
+    return ssd1306(serial, width=cfg["display"].get("width", 128), height=cfg["display"].get("height", 64))
+
+
+@register("display", "virtual")
+def virtual_display(cfg):
+    return VirtualOLED(cfg["display"].get("width", 128), cfg["display"].get("height", 64))
+
+
+class VirtualOLED:
+    """SSD1306 stand-in that counts the command and data bytes it is sent."""
+
+    def __init__(self, width=128, height=64):
+        self.width = width
+        self.height = height
+        self.rotate = 0
+        self.mode = "1"
+        self.command_bytes = 0
+        self.data_bytes = 0
+        self.frames = 0
+        self.last_image = None
+
+    def command(self, *cmd):
+        self.command_bytes += len(cmd)
+
+    def data(self, data):
+        self.data_bytes += len(data)
+
+    def display(self, image):
+        # Full-frame push, as luma's ssd1306 would send it
+        self.last_image = image.copy()
+        self.command(0x21, 0, self.width - 1, 0x22, 0, self.height // 8 - 1)
+        self.data_bytes += self.width * self.height // 8
+        self.frames += 1
+
+    def cleanup(self):
+        pass
+
+
+# GPIO. Factories take cfg and return an object with button(pin, pull_up),
+# led(pin) and start().
+
+@register("gpio", "gpiozero")
+class GpiozeroPins:
+    def __init__(self, cfg):
+        import gpiozero
+        self._gpiozero = gpiozero
+
+    def button(self, pin, pull_up=False):
+        return self._gpiozero.Button(pin, pull_up=pull_up)
+
+    def led(self, pin):
+        return self._gpiozero.LED(pin)
+
+    def start(self):
+        pass
+
+
+class SimButton:
+    def __init__(self, pin):
+        self.pin = pin
+        self.is_pressed = False
+        self.when_pressed = None
+        self.when_released = None
+        self.presses = 0
+
+    def press(self):
+        self.is_pressed = True
+        self.presses += 1
+        if self.when_pressed is not None:
+            self.when_pressed()
+
+    def release(self):
+        self.is_pressed = False
+        if self.when_released is not None:
+            self.when_released()
+
+
+class SimLED:
+    def __init__(self, pin):
+        self.pin = pin
+        self._value = 0
+        self.changes = 0
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if value != self._value:
+            self.changes += 1
+        self._value = value
+
+    def on(self):
+        self.value = 1
+
+    def off(self):
+        self.value = 0
+
+
+@register("gpio", "scripted")
+class ScriptedPins:
+    """Simulated buttons pressed on a fixed schedule.
+
+    ``simulation.gpio_script`` is a list of ``{"at_s": 1.5, "button":
+    "bypass_button", "hold_s": 0.1}`` entries, where ``button`` names a key
+    of the ``gpio`` section. ``start()`` replays the script on a daemon
+    thread; times are relative to the call.
+    """
+
+    def __init__(self, cfg):
+        self.gpio_cfg = cfg["gpio"]
+        self.script = sorted(cfg.get("simulation", {}).get("gpio_script", []), key=lambda e: e["at_s"])
+        self.buttons = {}
+        self.leds = {}
+        self._thread = None
+
+    def button(self, pin, pull_up=False):
+        return self.buttons.setdefault(pin, SimButton(pin))
+
+    def led(self, pin):
+        return self.leds.setdefault(pin, SimLED(pin))
+
+    def start(self):
+        if self.script and self._thread is None:
+            self._thread = threading.Thread(target=self._replay, name="gpio-script", daemon=True)
+            self._thread.start()
+
+    def _replay(self):
+        t0 = time.monotonic()
+        for entry in self.script:
+            delay = t0 + entry["at_s"] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            button = self.button(self.gpio_cfg[entry["button"]])
+            button.press()
+            time.sleep(entry.get("hold_s", 0.05))
+            button.release()
@@ -0,0 +1,415 @@
+"""ONNX Runtime session management for the voice conversion models."""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import onnxruntime as ort
+except Exception:
+    ort = None
+
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+ONNX_DTYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+    "tensor(int64)": np.int64,
+    "tensor(int32)": np.int32,
+    "tensor(int16)": np.int16,
+    "tensor(int8)": np.int8,
+    "tensor(uint8)": np.uint8,
+    "tensor(bool)": np.bool_,
+}
+
+
+# Quantized variants of a model, stored next to it as <stem>.<suffix>.onnx
+QUANTIZED_SUFFIXES = {
+    "int8_static": "int8",
+    "int8_dynamic": "int8dyn",
+}
+
+
+def onnx_dtype(type_str):
+    return ONNX_DTYPES.get(type_str, np.float32)
+
+
+def variant_path(path, variant):
+    """File of a quantized variant of a model (``variant`` None: the model itself)."""
+    if variant is None:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{QUANTIZED_SUFFIXES[variant]}{ext}"
+
+
+def probe_path(path):
+    """Calibration features saved next to a model for the load-time accuracy check."""
+    return f"{os.path.splitext(path)[0]}.calib.npy"
+
+
+def error_db(output, reference):
+    """Energy of the difference to ``reference`` relative to its own, in dB."""
+    diff = np.asarray(output, dtype=np.float64) - reference
+    return float(10.0 * np.log10((np.sum(diff * diff) + 1e-20) / (np.sum(np.square(reference, dtype=np.float64)) + 1e-20)))
+
+
+class ModelStream:
+    """Carries a streaming model's state from one call to the next via IOBinding.
+
+    A model is streaming when it takes state tensors (recurrent hidden
+    state, convolution caches) besides the magnitudes: every input after
+    the first is a state input, and the output at the same position is its
+    updated value. State shapes must be fixed apart from a leading batch
+    axis. Each call then sees only the new frames.
+
+    Both copies of every state tensor, the caller's feature buffer and the
+    mask live in preallocated arrays. Two IOBindings bind the state copies
+    crosswise (A in / B out and B in / A out) and calls alternate between
+    them, so nothing is copied or allocated per call.
+    """
+
+    def __init__(self, session, features):
+        inputs = session.get_inputs()
+        outputs = session.get_outputs()
+        if len(outputs) != len(inputs):
+            raise ValueError(f"streaming model needs one state output per state input "
+                             f"({len(inputs) - 1} in, {len(outputs) - 1} out)")
+        if not features.flags.c_contiguous:
+            raise ValueError("the feature buffer of a streaming model must be contiguous")
+        self.session = session
+        self.features = features
+        self.mask = np.zeros(features.shape, dtype=onnx_dtype(outputs[0].type))
+        self.states = []
+        for inp in inputs[1:]:
+            shape = []
+            for axis, dim in enumerate(inp.shape):
+                if isinstance(dim, int) and dim > 0:
+                    shape.append(dim)
+                elif axis == 0:
+                    shape.append(features.shape[0])
+                else:
+                    raise ValueError(f"state input {inp.name} needs a fixed shape, got {inp.shape}")
+            dtype = onnx_dtype(inp.type)
+            self.states.append((np.zeros(shape, dtype=dtype), np.zeros(shape, dtype=dtype)))
+        self.bindings = []
+        for turn in (0, 1):
+            binding = session.io_binding()
+            binding.bind_cpu_input(inputs[0].name, features)
+            self._bind_output(binding, outputs[0].name, self.mask)
+            for inp, out, pair in zip(inputs[1:], outputs[1:], self.states):
+                binding.bind_cpu_input(inp.name, pair[turn])
+                self._bind_output(binding, out.name, pair[1 - turn])
+            self.bindings.append(binding)
+        self.turn = 0
+
+    @staticmethod
+    def _bind_output(binding, name, array):
+        binding.bind_output(name, "cpu", 0, array.dtype, array.shape, array.ctypes.data)
+
+    def reset(self):
+        """Start over from zero state (a new utterance or a gap in the stream)."""
+        for a, b in self.states:
+            a.fill(0)
+            b.fill(0)
+        self.turn = 0
+
+    def run(self):
+        """Run the model on the feature buffer's current contents; returns the mask buffer."""
+        self.session.run_with_iobinding(self.bindings[self.turn])
+        self.turn ^= 1
+        return self.mask
+
+
+class SessionManager:
+    """Per-language ONNX sessions kept in an LRU cache with a memory cap.
+
+    Sessions are created with the thread counts and graph optimization level
+    from the ``inference`` config section. The optimized graph is saved next
+    to the source model (in ``optimized_dir``) so later startups load it with
+    optimization disabled. ``preload()`` builds and warms up every language
+    before audio starts; ``get()`` is the per-block lookup used by the audio
+    thread and never loads a model itself - a cache miss schedules a
+    background load and returns None until it is ready.
+
+    Quantized variants of a model (see quantize_model.py) are candidates
+    too: at load time each one listed in ``quantized_variants`` is run on the
+    calibration features saved with the model, and the fastest candidate
+    whose mask stays within ``quant_max_error_db`` of the fp32 model's is
+    kept. Without saved features only the fp32 model is used.
+    """
+
+    def __init__(self, cfg, light=False):
+        inf = cfg.get("inference", {})
+        self.languages = cfg["modes"].get("languages", ["EN"])
+        self.model_dir = inf.get("model_dir", ".")
+        if light:
+            # Smaller fallback models for the degradation scheduler
+            self.model_pattern = inf["light_model_pattern"]
+            self.default_model = inf.get("light_default_model")
+        else:
+            self.model_pattern = inf.get("model_pattern", "voice_converter_{language}.onnx")
+            self.default_model = inf.get("default_model", "voice_converter.onnx")
+        self.optimized_dir = inf.get("optimized_dir", "optimized_models")
+        self.intra_op_threads = inf.get("intra_op_threads", 0)
+        self.inter_op_threads = inf.get("inter_op_threads", 0)
+        self.graph_optimization = inf.get("graph_optimization", "all")
+        self.cache_max_bytes = int(inf.get("cache_max_mb", 1024) * 1024 * 1024)
+        self.warmup_runs = inf.get("warmup_runs", 3)
+        self.warmup_dim = inf.get("warmup_dim", 128)
+        self.providers = inf.get("providers", ["CPUExecutionProvider"])
+        self.quantized_variants = inf.get("quantized_variants", [])
+        self.quant_max_error_db = inf.get("quant_max_error_db", -30.0)
+        self.quant_probe_runs = max(1, inf.get("quant_probe_runs", 5))
+
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()  # model path -> (session, size in bytes)
+        self.io = {}  # id(session) -> (input name, output name)
+        self.loading = set()
+        self.selected = {}  # model path -> evaluation of the variant in use
+        self.paths = {language: self.model_path(language) for language in self.languages}
+
+    def model_path(self, language):
+        """Resolve the model file for a language, falling back to the default model."""
+        path = os.path.join(self.model_dir, self.model_pattern.format(language=language))
+        if os.path.exists(path):
+            return path
+        if self.default_model:
+            path = os.path.join(self.model_dir, self.default_model)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def optimized_path(self, path):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.optimized_dir, f"{stem}.{self.graph_optimization}.opt.onnx")
+
+    def session_options(self, optimize=True, optimized_out=None):
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = self.intra_op_threads
+        opts.inter_op_num_threads = self.inter_op_threads
+        level = GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization] if optimize else "ORT_DISABLE_ALL"
+        opts.graph_optimization_level = getattr(ort.GraphOptimizationLevel, level)
+        if optimized_out:
+            opts.optimized_model_filepath = optimized_out
+        return opts
+
+    def _create_session(self, path):
+        """Build a session, reusing a previously saved optimized graph when it is current."""
+        cached = self.optimized_path(path)
+        if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(path):
+            try:
+                opts = self.session_options(optimize=False)
+                return ort.InferenceSession(cached, sess_options=opts, providers=self.providers), cached
+            except Exception as e:
+                logging.warning(f"Ignoring stale optimized model {cached}: {e}")
+        optimized_out = None
+        if self.graph_optimization != "disable":
+            try:
+                os.makedirs(self.optimized_dir, exist_ok=True)
+                optimized_out = cached
+            except OSError as e:
+                logging.warning(f"Cannot write optimized models to {self.optimized_dir}: {e}")
+        opts = self.session_options(optimize=True, optimized_out=optimized_out)
+        return ort.InferenceSession(path, sess_options=opts, providers=self.providers), path
+
+    def warm_up(self, session):
+        """Run dummy inferences so the first real block doesn't pay one-time costs."""
+        feeds = {}
+        for inp in session.get_inputs():
+            shape = []
+            for axis, dim in enumerate(inp.shape):
+                if isinstance(dim, int) and dim > 0:
+                    shape.append(dim)
+                else:
+                    shape.append(1 if axis == 0 else self.warmup_dim)
+            feeds[inp.name] = np.zeros(shape, dtype=onnx_dtype(inp.type))
+        for _ in range(self.warmup_runs):
+            session.run(None, feeds)
+
+    def candidates(self, path):
+        """The model and those of its quantized variants that are at least as new."""
+        found = [(None, path)]
+        for variant in self.quantized_variants:
+            candidate = variant_path(path, variant)
+            if os.path.exists(candidate) and os.path.getmtime(candidate) >= os.path.getmtime(path):
+                found.append((variant, candidate))
+        return found
+
+    def probe(self, session, features):
+        """Run every block of ``features`` through a session, in order.
+
+        Streaming models carry their state from block to block, starting
+        from zero state on every pass, so for them ``features`` must be one
+        contiguous run of blocks (as quantize_model.py saves them). Returns the
+        stacked outputs and the fastest of ``quant_probe_runs`` passes, in
+        seconds.
+        """
+        input_name, output_name = self._io_names(session)
+        buffer = np.zeros((1,) + features.shape[1:], dtype=np.float32)
+        stream = self.stream(session, buffer)
+        best = float("inf")
+        outputs = np.zeros(features.shape, dtype=np.float32)
+        for _ in range(self.quant_probe_runs):
+            if stream is not None:
+                stream.reset()
+            start = time.perf_counter()
+            for block, out in zip(features, outputs):
+                buffer[0] = block
+                if stream is not None:
+                    out[:] = stream.run()[0]
+                else:
+                    out[:] = session.run([output_name], {input_name: buffer})[0][0]
+            best = min(best, time.perf_counter() - start)
+        return outputs, best
+
+    def evaluate(self, path, features):
+        """A/B every candidate of a model against fp32 on calibration features.
+
+        Returns ``(results, sessions)``: one dict per candidate that loaded
+        (``variant``, ``path``, ``ms`` per block, ``error_db``, ``ok``) and the
+        matching warmed-up ``(session, source)`` pairs. Quantized variants
+        are only checked when the fp32 model itself loads.
+        """
+        results = []
+        sessions = []
+        reference = None
+        for variant, candidate in self.candidates(path):
+            if variant is not None and reference is None:
+                break
+            try:
+                session, source = self._create_session(candidate)
+                self.warm_up(session)
+                output, seconds = self.probe(session, features)
+            except Exception as e:
+                logging.warning(f"Failed to evaluate model {candidate}: {e}")
+                continue
+            if variant is None:
+                reference = output
+            error = error_db(output, reference)
+            results.append({
+                "variant": variant or "fp32",
+                "path": candidate,
+                "ms": seconds * 1000.0 / max(1, len(features)),
+                "error_db": error,
+                "ok": variant is None or error <= self.quant_max_error_db,
+            })
+            sessions.append((session, source))
+        return results, sessions
+
+    def _select_session(self, path):
+        """Create the session for a model, preferring the fastest accurate variant."""
+        probe = probe_path(path)
+        if len(self.candidates(path)) > 1:
+            if os.path.exists(probe):
+                results, sessions = self.evaluate(path, np.load(probe))
+                for result in results:
+                    logging.info(f"Model {result['path']}: {result['ms']:.3f} ms/block, "
+                                 f"error {result['error_db']:.1f} dB{'' if result['ok'] else ' (rejected)'}")
+                passed = [i for i, result in enumerate(results) if result["ok"]]
+                if passed:
+                    best = min(passed, key=lambda i: results[i]["ms"])
+                    self.selected[path] = results[best]
+                    return sessions[best]
+            else:
+                logging.warning(f"No calibration features ({probe}); using the fp32 model {path}")
+        session, source = self._create_session(path)
+        self.warm_up(session)
+        self.selected[path] = {"variant": "fp32", "path": path}
+        return session, source
+
+    def load(self, language):
+        """Load (and warm up) the session for a language synchronously."""
+        if ort is None:
+            return None
+        path = self.model_path(language)
+        self.paths[language] = path
+        if path is None:
+            return None
+        with self.lock:
+            if path in self.cache:
+                self.cache.move_to_end(path)
+                return self.cache[path][0]
+        try:
+            session, source = self._select_session(path)
+        except Exception as e:
+            logging.warning(f"Failed to load model {path} for {language}: {e}")
+            return None
+        size = os.path.getsize(source)
+        with self.lock:
+            self.io[id(session)] = self._io_names(session)
+            self.cache[path] = (session, size)
+            self.cache.move_to_end(path)
+            self._evict(keep=path)
+        variant = self.selected.get(path, {}).get("variant", "fp32")
+        logging.info(f"Loaded model {path} for {language} ({variant}, {size / 1e6:.1f} MB)")
+        return session
+
+    def _evict(self, keep):
+        # Caller holds self.lock
+        while self.memory_bytes() > self.cache_max_bytes and len(self.cache) > 1:
+            path = next(iter(self.cache))
+            if path == keep:
+                break
+            session, _ = self.cache.pop(path)
+            self.io.pop(id(session), None)
+            logging.info(f"Evicted model {path} from session cache")
+
+    def _io_names(self, session):
+        return session.get_inputs()[0].name, session.get_outputs()[0].name
+
+    def stream(self, session, features):
+        """A ModelStream over ``features`` for a streaming model, None for a stateless one."""
+        if len(session.get_inputs()) < 2:
+            return None
+        return ModelStream(session, features)
+
+    def run(self, session, features):
+        """Run one (possibly batched) inference: (batch, frames, bins) -> same shape."""
+        io = self.io.get(id(session))
+        if io is None:
+            io = self._io_names(session)
+        input_name, output_name = io
+        return session.run([output_name], {input_name: features})[0]
+
+    def memory_bytes(self):
+        return sum(size for _, size in self.cache.values())
+
+    def preload(self):
+        """Load and warm up one session per configured language."""
+        for language in self.languages:
+            self.load(language)
+
+    def get(self, language):
+        """Return the cached session for a language without blocking on a load."""
+        if ort is None:
+            return None
+        path = self.paths.get(language)
+        if path is None:
+            return None
+        with self.lock:
+            entry = self.cache.get(path)
+            if entry is not None:
+                self.cache.move_to_end(path)
+                return entry[0]
+            if path in self.loading:
+                return None
+            self.loading.add(path)
+        threading.Thread(target=self._background_load, args=(language, path), daemon=True).start()
+        return None
+
+    def _background_load(self, language, path):
+        try:
+            self.load(language)
+        finally:
+            with self.lock:
+                self.loading.discard(path)
@@ -3,109 +3,304 @@ import os
 import sys
 import time
 import json
-import queue
 import threading
 import logging
+import logging.handlers
 import signal
 from datetime import datetime
 
 import numpy as np
 
-# GPIO / Display
-from gpiozero import Button, LED
-from luma.core.interface.serial import i2c
-from luma.oled.device import ssd1306
+from conversion import ConversionStage, ConversionWorker
+from dsp import LevelMeter, LevelReading, SpeechGate, SILENCE_DBFS
+from playout import AdaptivePlayout
+from ringbuffer import AudioRingBuffer
+from spi_audio import ADS1256_DATA_RATES, ADS1256_GAINS, DAC8532_COMMANDS
+from telemetry import LatencyTracer, MetricsWriter, STAGE_INDEX
 
-# Audio
-import pyaudio
+# GPIO, display and audio devices are created through the backend registry,
+# which imports gpiozero / luma / pyaudio / spidev only when they are used
+import hal
 
-# Optional AI (placeholder)
-try:
-    import onnxruntime as ort
-except Exception:
-    ort = None
+# Optional AI (ONNX Runtime is imported lazily by inference.py)
+from inference import GRAPH_OPTIMIZATION_LEVELS, QUANTIZED_SUFFIXES
+
+
+class StateSnapshot:
+    """Immutable, versioned view of the device state.
+
+    StateManager never modifies a published snapshot; every change builds a
+    new one and swaps it in with a single reference assignment, so readers
+    (including the audio threads) just load ``state.snapshot`` without taking
+    a lock or allocating. ``seq`` increases with every publish. Fields can
+    also be read dict-style (``snap["mode"]``, ``snap.get(...)``).
+    ``latency_stages`` is read live from the state's tracer.
+    """
+
+    __slots__ = ("seq", "mode", "language", "ptt", "degradation", "levels", "latency_ms", "_state")
+
+    FIELDS = ("mode", "language", "ptt", "degradation", "level_rms", "level_peak", "level_dbfs",
+              "level_vu", "clip_count", "latency_ms", "latency_stages")
+
+    def __init__(self, seq, mode, language, ptt, degradation, levels, latency_ms, state):
+        self.seq = seq
+        self.mode = mode
+        self.language = language
+        self.ptt = ptt
+        self.degradation = degradation
+        self.levels = levels
+        self.latency_ms = latency_ms
+        self._state = state
+
+    level_rms = property(lambda self: self.levels.rms)
+    level_peak = property(lambda self: self.levels.peak)
+    level_dbfs = property(lambda self: self.levels.dbfs)
+    level_vu = property(lambda self: self.levels.vu)
+    clip_count = property(lambda self: self.levels.clips)
+
+    @property
+    def latency_stages(self):
+        return self._state.tracer.summary()
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def __repr__(self):
+        return (f"StateSnapshot(seq={self.seq}, mode={self.mode!r}, language={self.language!r}, "
+                f"ptt={self.ptt}, degradation={self.degradation!r}, levels={self.levels}, "
+                f"latency_ms={self.latency_ms:.2f})")
 
 
 class StateManager:
     def __init__(self, config):
-        self.lock = threading.Lock()
+        # Serialises writers only; readers use the published snapshot.
+        # Reentrant: the signal handler may call stop() while the main thread
+        # holds the lock
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.version = 0  # bumped on every change consumers should redraw for
+        self.control_version = 0  # bumped on mode / language changes only
         self.mode = config["modes"].get("default_mode", "convert")
         self.languages = config["modes"].get("languages", ["EN"])
         self.language_index = 0
+        self.ptt = False
+        self.degradation = "full"  # conversion level picked by the degradation scheduler
         self.running = True
-        self.level_rms = 0.0
-        self.latency_ms = 0.0
+        self.device_latency_ms = 0.0
+        self.tracer = LatencyTracer()
         self.last_switch = time.time()
+        self.snapshot = StateSnapshot(
+            0, self.mode, self.languages[0], self.ptt, self.degradation,
+            LevelReading(0.0, 0.0, SILENCE_DBFS, 0, 0.0), 0.0, self)
+
+        # Metric changes smaller than these are not visible on the display
+        display_cfg = config.get("display", {})
+        self.vu_step = display_cfg.get("vu_step", 0.005)
+        self.dbfs_step = display_cfg.get("dbfs_step", 1.0)
+        self.latency_step_ms = display_cfg.get("latency_step_ms", 0.5)
+        self._shown_levels = self.snapshot.levels
+        self._shown_latency_ms = 0.0
+
+    levels = property(lambda self: self.snapshot.levels)
+    level_rms = property(lambda self: self.snapshot.levels.rms)
+    latency_ms = property(lambda self: self.snapshot.latency_ms)
+
+    def _publish(self, levels=None, latency_ms=None):
+        # Caller holds self.lock
+        old = self.snapshot
+        self.snapshot = StateSnapshot(
+            old.seq + 1, self.mode, self.languages[self.language_index], self.ptt, self.degradation,
+            old.levels if levels is None else levels,
+            old.latency_ms if latency_ms is None else latency_ms, self)
+
+    def _notify(self, control=False):
+        # Caller holds self.lock
+        self.version += 1
+        if control:
+            self.control_version += 1
+        self.changed.notify_all()
 
     def toggle_mode(self):
         with self.lock:
             self.mode = "bypass" if self.mode == "convert" else "convert"
             self.last_switch = time.time()
+            self._publish()
+            self._notify(control=True)
 
     def next_language(self):
         with self.lock:
             self.language_index = (self.language_index + 1) % len(self.languages)
+            self._publish()
+            self._notify(control=True)
 
-    def get_snapshot(self):
+    def set_ptt(self, active):
+        with self.lock:
+            if active == self.ptt:
+                return
+            self.ptt = active
+            self._publish()
+            self._notify()
+
+    def set_degradation(self, level):
+        """Report the conversion level ('full', 'light' or 'bypass')."""
+        if level == self.degradation:
+            return  # called per block by the audio threads
         with self.lock:
-            return {
-                "mode": self.mode,
-                "language": self.languages[self.language_index],
-                "level_rms": self.level_rms,
-                "latency_ms": self.latency_ms,
-            }
+            self.degradation = level
+            self._publish()
+            self._notify()
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self._notify(control=True)
+
+    def publish_levels(self, levels: LevelReading):
+        with self.lock:
+            self._publish(levels=levels)
+            shown = self._shown_levels
+            if (abs(levels.vu - shown.vu) >= self.vu_step
+                    or abs(levels.dbfs - shown.dbfs) >= self.dbfs_step
+                    or levels.clips != shown.clips):
+                self._shown_levels = levels
+                self._notify()
+
+    def publish_latency(self, latency_ms):
+        with self.lock:
+            self._publish(latency_ms=latency_ms)
+            if abs(latency_ms - self._shown_latency_ms) >= self.latency_step_ms:
+                self._shown_latency_ms = latency_ms
+                self._notify()
+
+    def wait_for_change(self, version, timeout=None):
+        """Block until the state version differs from `version` (or the
+        timeout expires, or the state stops running) and return the current
+        version. Only changes visible to the UI bump the version."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version or not self.running, timeout)
+            return self.version
+
+    def get_snapshot(self):
+        """Return the current StateSnapshot (lock-free, no allocation)."""
+        return self.snapshot
 
 
 class OLEDDisplay:
-    def __init__(self, cfg):
+    # SSD1306 addressing commands (horizontal addressing mode)
+    COLUMNADDR = 0x21
+    PAGEADDR = 0x22
+
+    def __init__(self, cfg, device=None):
         self.enabled = cfg["display"].get("enabled", True)
-        if not self.enabled:
+        self.frames_pushed = 0
+        self.frames_skipped = 0
+        self.bytes_sent = 0
+        self._lines = None
+        self._pages = None  # last page buffer pushed to the panel
+        if device is not None:
+            self.device = device
+        elif not self.enabled:
             self.device = None
             return
+        else:
+            try:
+                self.device = hal.create("display", cfg["display"].get("backend", "ssd1306"), cfg)
+            except Exception as e:
+                print(f"Warning: OLED display initialization failed: {e}")
+                self.device = None
+                return
+
+        # One framebuffer, drawing context and font, reused for every frame
+        from PIL import Image, ImageDraw, ImageFont
+        self.image = Image.new("1", (self.device.width, self.device.height))
+        self.draw = ImageDraw.Draw(self.image)
         try:
-            # Try different i2c ports to find the OLED
-            port = cfg["display"].get("i2c_port", 13)
-            address = cfg["display"].get("i2c_address", 60)
-            # Address is specified in decimal in config (60 = 0x3C)
-            serial = i2c(port=port, address=address)
-            self.device = ssd1306(serial, width=cfg["display"].get("width", 128), height=cfg["display"].get("height", 64))
-        except Exception as e:
-            print(f"Warning: OLED display initialization failed: {e}")
-            self.device = None
+            self.font = ImageFont.load_default()
+        except Exception:
+            self.font = None
+        # Partial updates need direct page/column addressing (no rotation)
+        self.partial = (
+            getattr(self.device, "rotate", 0) == 0
+            and self.device.height % 8 == 0
+            and hasattr(self.device, "command")
+            and hasattr(self.device, "data")
+        )
 
     def draw_text(self, lines):
         if not self.device:
             return
+        if lines == self._lines:
+            self.frames_skipped += 1
+            return
+        self._lines = list(lines)
         # Minimal text renderer
-        from PIL import Image, ImageDraw, ImageFont
-        image = Image.new("1", (self.device.width, self.device.height))
-        draw = ImageDraw.Draw(image)
-        try:
-            font = ImageFont.load_default()
-        except Exception:
-            font = None
+        self.draw.rectangle((0, 0, self.device.width - 1, self.device.height - 1), fill=0)
         y = 0
         for line in lines:
-            draw.text((0, y), line, fill=255, font=font)
+            self.draw.text((0, y), line, fill=255, font=self.font)
             y += 12
-        self.device.display(image)
+        self.push()
+
+    def push(self):
+        """Send the framebuffer, writing only the page/column windows that changed."""
+        if not self.partial:
+            self.device.display(self.image)
+            self.frames_pushed += 1
+            self.bytes_sent += self.device.width * self.device.height // 8
+            return
+        width = self.device.width
+        pixels = np.asarray(self.image, dtype=np.uint8).reshape(-1, 8, width)
+        # SSD1306 page layout: one byte per column, LSB is the top row
+        pages = np.packbits(pixels, axis=1, bitorder="little").reshape(-1, width)
+        if self._pages is None:
+            dirty = np.ones(pages.shape, dtype=bool)
+        else:
+            dirty = pages != self._pages
+        dirty_pages = np.flatnonzero(dirty.any(axis=1))
+        if len(dirty_pages) == 0:
+            self.frames_skipped += 1
+            return
+        colstart = getattr(self.device, "_colstart", 0)
+        for page in dirty_pages:
+            cols = np.flatnonzero(dirty[page])
+            c0, c1 = int(cols[0]), int(cols[-1])
+            self.device.command(self.COLUMNADDR, colstart + c0, colstart + c1,
+                                self.PAGEADDR, int(page), int(page))
+            self.device.data(pages[page, c0:c1 + 1].tolist())
+            self.bytes_sent += c1 - c0 + 1
+        self._pages = pages
+        self.frames_pushed += 1
 
 
 class GPIOController:
     def __init__(self, cfg, state: StateManager):
         self.state = state
         try:
-            pull = None  # gpiozero handles pulls internally if needed
-            self.btn_bypass = Button(cfg["gpio"]["bypass_button"], pull_up=cfg["gpio"].get("pullups", False))
-            self.btn_lang = Button(cfg["gpio"]["language_button"], pull_up=cfg["gpio"].get("pullups", False))
-            self.led_bypass = LED(cfg["gpio"]["led_bypass"])
-            self.led_convert = LED(cfg["gpio"]["led_convert"])
-            self.ptt = Button(cfg["gpio"]["ptt_input"], pull_up=cfg["gpio"].get("pullups", False))
+            self.pins = hal.create("gpio", cfg["gpio"].get("backend", "gpiozero"), cfg)
+            pull_up = cfg["gpio"].get("pullups", False)
+            self.btn_bypass = self.pins.button(cfg["gpio"]["bypass_button"], pull_up=pull_up)
+            self.btn_lang = self.pins.button(cfg["gpio"]["language_button"], pull_up=pull_up)
+            self.led_bypass = self.pins.led(cfg["gpio"]["led_bypass"])
+            self.led_convert = self.pins.led(cfg["gpio"]["led_convert"])
+            self.ptt = self.pins.button(cfg["gpio"]["ptt_input"], pull_up=pull_up)
 
             self.btn_bypass.when_pressed = self._on_bypass
             self.btn_lang.when_pressed = self._on_language
+            self.ptt.when_pressed = self._on_ptt
+            self.ptt.when_released = self._on_ptt
+            state.set_ptt(bool(self.ptt.is_pressed))
+            self.pins.start()
         except Exception as e:
             print(f"Warning: GPIO initialization failed: {e}")
+            self.pins = None
             self.btn_bypass = None
             self.btn_lang = None
             self.led_bypass = None
@@ -118,6 +313,9 @@ class GPIOController:
     def _on_language(self):
         self.state.next_language()
 
+    def _on_ptt(self):
+        self.state.set_ptt(self.ptt_active())
+
     def update_leds(self):
         if self.led_bypass is None or self.led_convert is None:
             return
@@ -133,47 +331,176 @@ class GPIOController:
 
 
 class AudioEngine:
-    def __init__(self, cfg, state: StateManager):
+    PIPELINES = ("threaded", "duplex")
+
+    ISOLATION = ("thread", "process")
+
+    # audio.input_channel names for the two channels of a stereo card
+    CHANNEL_NAMES = {"left": 0, "right": 1}
+
+    def __init__(self, cfg, state: StateManager, sessions=None):
         self.cfg = cfg
         self.state = state
-        self.q_in = queue.Queue(maxsize=8)
-        self.q_out = queue.Queue(maxsize=8)
+        self.pipeline = cfg["audio"].get("pipeline", "threaded")
+        self.backend = cfg["audio"].get("backend", "pyaudio")
+        # Capture and playback devices, each defaulting to the backend
+        self.source = cfg["audio"].get("source", self.backend)
+        self.sink = cfg["audio"].get("sink", self.backend)
+        frames = cfg["audio"]["frames_per_buffer"]
+        channels = cfg["audio"]["channels"]
+        slots = cfg["audio"].get("ring_slots", 8)
+        # The card runs in its native format (e.g. stereo); the pipeline only
+        # sees the configured input channel, as a strided view, and its
+        # output is fanned back out to every device channel
+        self.device_channels = hal.device_channels(cfg)
+        self.input_channel = 0
+        self._fan = None
+        if self.device_channels != channels:
+            selected = cfg["audio"].get("input_channel", "left")
+            self.input_channel = self.CHANNEL_NAMES.get(selected, selected)
+            self._fan = np.zeros((frames, self.device_channels), dtype=np.int16)
+            # PyAudio accepts read-only byte buffers, so no bytes copy is needed
+            self._fan_bytes = memoryview(self._fan).cast("B").toreadonly()
+        else:
+            self._mono = np.zeros(frames * channels, dtype=np.int16)
+            self._mono_bytes = memoryview(self._mono).cast("B").toreadonly()
+        self.meter = LevelMeter(
+            frames * channels,
+            cfg["audio"]["sample_rate"],
+            vu_time_ms=cfg["audio"].get("vu_time_ms", 300.0),
+        )
+        self.converter = ConversionStage(cfg, sessions, tracer=state.tracer)
+        self.sessions = self.converter.sessions
+        self.worker = None
+        self.threads = []  # reader/processor/writer, joined on stop()
+        if self.pipeline == "threaded" and cfg.get("inference", {}).get("isolation", "thread") == "process":
+            # Conversion runs in its own process; the rings live in shared memory
+            self.worker = ConversionWorker(cfg)
+            state.tracer = self.worker.tracer
+            self.ring_in = self.worker.ring_in
+            self.ring_out = self.worker.ring_out
+        else:
+            self.ring_in = AudioRingBuffer(slots, frames, channels)
+            self.ring_out = AudioRingBuffer(slots, frames, channels)
+        self.playout = None
+        playout_cfg = cfg.get("playout", {})
+        if self.pipeline == "threaded" and playout_cfg.get("enabled", False):
+            self.playout = AdaptivePlayout(
+                frames * channels, cfg["audio"]["sample_rate"],
+                jitter_k=playout_cfg.get("jitter_k", 3.0),
+                margin_ms=playout_cfg.get("margin_ms", 2.0),
+                initial_ms=playout_cfg.get("initial_ms", 10.0),
+                max_ms=playout_cfg.get("max_ms", 200.0),
+                max_adjust_ms=playout_cfg.get("max_adjust_ms", 10.0),
+            )
         self.pa = None
+        self.stream = None
         self.stream_in = None
         self.stream_out = None
         
         try:
-            self.pa = pyaudio.PyAudio()
-            self.stream_in = self.pa.open(
-                format=pyaudio.paInt16,
-                channels=cfg["audio"]["channels"],
-                rate=cfg["audio"]["sample_rate"],
-                input=True,
-                frames_per_buffer=cfg["audio"]["frames_per_buffer"],
-                input_device_index=None,  # adjust if necessary
-            )
-            self.stream_out = self.pa.open(
-                format=pyaudio.paInt16,
-                channels=cfg["audio"]["channels"],
-                rate=cfg["audio"]["sample_rate"],
-                output=True,
-                frames_per_buffer=cfg["audio"]["frames_per_buffer"],
-                output_device_index=None,  # adjust if necessary
-            )
+            if self.pipeline == "duplex":
+                # One full-duplex stream; capture, processing and playback
+                # all happen inside the PortAudio callback.
+                self.stream = hal.pyaudio_duplex(cfg, self, self._duplex_callback)
+            else:
+                self.stream_in = hal.create("source", self.source, cfg, self)
+                self.stream_out = hal.create("sink", self.sink, cfg, self)
+            # ADC/DAC buffering on top of what the pipeline itself adds
+            device_latency = 0.0
+            for stream in (self.stream, self.stream_in):
+                if stream is not None:
+                    device_latency += stream.get_input_latency()
+            for stream in (self.stream, self.stream_out):
+                if stream is not None:
+                    device_latency += stream.get_output_latency()
+            self.state.device_latency_ms = device_latency * 1000.0
         except Exception as e:
             print(f"Warning: Audio initialization failed: {e}")
             self.pa = None
+            self.stream = None
             self.stream_in = None
             self.stream_out = None
 
     def start(self):
+        # Build and warm up every language's model before audio flows
+        if self.worker is not None:
+            self.worker.update(self.state.get_snapshot())
+            self.worker.start()
+        else:
+            self.converter.preload()
+        if self.pipeline == "duplex":
+            if self.stream is not None:
+                self.stream.start_stream()
+            return
+        for stream in (self.stream_in, self.stream_out):
+            if stream is not None and not stream.is_active():
+                stream.start_stream()
         self.t_in = threading.Thread(target=self._reader, daemon=True)
-        self.t_proc = threading.Thread(target=self._processor, daemon=True)
         self.t_out = threading.Thread(target=self._writer, daemon=True)
         self.t_in.start()
-        self.t_proc.start()
+        self.threads = [self.t_in, self.t_out]
+        if self.worker is None:
+            self.t_proc = threading.Thread(target=self._processor, daemon=True)
+            self.t_proc.start()
+            self.threads.append(self.t_proc)
         self.t_out.start()
 
+    def _update_level(self, pcm):
+        self.state.publish_levels(self.meter.process(pcm))
+
+    def _process_block(self, pcm):
+        return self.converter.process_block(pcm, self.state.get_snapshot())
+
+    def _select_input(self, data):
+        """The configured input channel of a device block, as a view (no copy)."""
+        pcm = np.frombuffer(data, dtype=np.int16)
+        if self._fan is None:
+            return pcm
+        return pcm[self.input_channel::self.device_channels]
+
+    def _device_bytes(self, pcm):
+        """One output block in the device's channel layout, as a read-only view of a preallocated buffer."""
+        if self._fan is not None:
+            return self._fan_out(pcm)
+        n = len(pcm)
+        np.copyto(self._mono[:n], pcm, casting="unsafe")
+        return self._mono_bytes[:n * 2]
+
+    def _fan_out(self, pcm):
+        """Copy a mono block to every device channel of the preallocated output."""
+        n = len(pcm)
+        self._fan[:n] = pcm[:, np.newaxis]
+        return self._fan_bytes[:n * self.device_channels * 2]
+
+    def _duplex_callback(self, in_data, frame_count, time_info, status):
+        if not self.state.running:
+            return (None, hal.PA_COMPLETE)
+        t_deq = time.perf_counter_ns()
+        if in_data is None:
+            in_data = bytes(frame_count * self.device_channels * 2)
+        try:
+            pcm = self._select_input(in_data)
+            self._update_level(pcm)
+            out = self._process_block(pcm)
+            self.state.set_degradation(self.converter.degradation)
+            if self._fan is not None or out is not pcm:
+                out = self._device_bytes(out)
+            else:
+                out = in_data
+            self.converter.trace_block(None, t_deq, time.perf_counter_ns())
+        except Exception as e:
+            print(f"Error in audio callback: {e}")
+            out = in_data
+        # PortAudio reports when this input was captured and when the
+        # output will hit the DAC, which includes the device buffers.
+        adc_time = time_info.get("input_buffer_adc_time", 0.0) if time_info else 0.0
+        dac_time = time_info.get("output_buffer_dac_time", 0.0) if time_info else 0.0
+        if adc_time > 0.0 and dac_time > adc_time:
+            self.state.publish_latency((dac_time - adc_time) * 1000.0)
+            self.state.tracer.record(STAGE_INDEX["total"], int((dac_time - adc_time) * 1e9))
+        return (out, hal.PA_CONTINUE)
+
     def _reader(self):
         if self.stream_in is None:
             return
@@ -182,83 +509,118 @@ class AudioEngine:
                 break
             try:
                 data = self.stream_in.read(self.cfg["audio"]["frames_per_buffer"], exception_on_overflow=False)
-                # RMS level for VU
-                pcm = np.frombuffer(data, dtype=np.int16).astype(np.float32)
-                rms = float(np.sqrt(np.mean(np.square(pcm))) / 32768.0)
-                self.state.level_rms = rms
-                try:
-                    self.q_in.put_nowait((time.time(), data))
-                except queue.Full:
-                    pass  # drop if full
+                t_capture = time.perf_counter_ns()
+                slot = self.ring_in.write_slot()
+                if slot is None:
+                    continue  # drop if full (counted as overrun)
+                slot[:] = self._select_input(data)
+                self._update_level(slot)
+                if self.worker is not None:
+                    self.worker.update(self.state.get_snapshot())
+                    self.state.set_degradation(self.worker.degradation())
+                self.ring_in.commit_write(t_capture)
             except Exception as e:
                 print(f"Error in audio reader: {e}")
                 time.sleep(0.1)
 
     def _processor(self):
-        # Optional: initialize ONNX session
-        session = None
-        if ort is not None:
-            try:
-                session = ort.InferenceSession("voice_converter.onnx", providers=['CPUExecutionProvider'])
-            except Exception:
-                session = None
-
         while True:
             if not self.state.running:
                 break
-            try:
-                t0, data = self.q_in.get(timeout=0.1)
-            except queue.Empty:
+            if not self.ring_in.wait_readable(timeout=0.1):
                 continue
 
-            snap = self.state.get_snapshot()
-            if snap["mode"] == "bypass":
-                out = data
-            else:
-                # Placeholder conversion (identity); integrate your model here
-                out = self._convert_identity(data, session)
-
+            count = 1
             try:
-                self.q_out.put_nowait((t0, out))
-            except queue.Full:
-                pass
-
-    def _convert_identity(self, data, session):
-        # TODO: Replace with mel/vocoder pipeline using `session`
-        return data
+                count = self.converter.process_next(self.ring_in, self.ring_out, self.state.get_snapshot())
+            except Exception as e:
+                print(f"Error in audio processor: {e}")
+                time.sleep(0.1)
+            self.ring_in.release_read(count)
+            self.state.set_degradation(self.converter.degradation)
 
     def _writer(self):
         if self.stream_out is None:
             return
+        if self.playout is not None:
+            self._playout_writer()
+            return
+        # Once a blocking write returns, the device holds at least that block:
+        # it starves only if the next one is not here a block period later
+        period_ns = int(1e9 * self.cfg["audio"]["frames_per_buffer"] / self.cfg["audio"]["sample_rate"])
+        deadline = None  # not playing yet, or already counted as starved
         while True:
             if not self.state.running:
                 break
+            if not self.ring_out.wait_readable(timeout=0.1, deadline=deadline):
+                if deadline is not None and time.perf_counter_ns() > deadline:
+                    deadline = None  # counted once per starvation
+                continue
+            t0, pcm = self.ring_out.read_view()
             try:
-                t0, data = self.q_out.get(timeout=0.1)
-            except queue.Empty:
+                t_start = time.perf_counter_ns()
+                self.stream_out.write(self._device_bytes(pcm))
+                t_end = time.perf_counter_ns()
+                deadline = t_end + period_ns
+                tracer = self.state.tracer
+                tracer.record(STAGE_INDEX["queue_out"], t_start - self.ring_out.commit_time())
+                tracer.record(STAGE_INDEX["write"], t_end - t_start)
+                tracer.record(STAGE_INDEX["total"], t_end - t0)
+                self.state.publish_latency((t_end - t0) / 1e6 + self.state.device_latency_ms)
+            except Exception as e:
+                print(f"Error in audio writer: {e}")
+                time.sleep(0.1)
+            self.ring_out.release_read()
+
+    def _playout_writer(self):
+        # Processed blocks go through the adaptive playout buffer, which
+        # hands the device exactly one block per write
+        playout = self.playout
+        frames = self.cfg["audio"]["frames_per_buffer"]
+        tracer = self.state.tracer
+        while True:
+            if not self.state.running:
+                break
+            while self.ring_out.readable() and playout.space() >= frames:
+                t0, pcm = self.ring_out.read_view()
+                playout.push(pcm, t0, self.ring_out.commit_time())
+                self.ring_out.release_read()
+            block = playout.next_block()
+            if block is None:
+                self.ring_out.wait_readable(timeout=0.1)
                 continue
+            pcm, t0, t_commit = block
             try:
-                self.stream_out.write(data)
-                self.state.latency_ms = (time.time() - t0) * 1000.0
+                t_start = time.perf_counter_ns()
+                self.stream_out.write(self._device_bytes(pcm))
+                t_end = time.perf_counter_ns()
+                tracer.record(STAGE_INDEX["queue_out"], t_start - t_commit)
+                tracer.record(STAGE_INDEX["write"], t_end - t_start)
+                tracer.record(STAGE_INDEX["total"], t_end - t0)
+                self.state.publish_latency((t_end - t0) / 1e6 + self.state.device_latency_ms)
             except Exception as e:
                 print(f"Error in audio writer: {e}")
                 time.sleep(0.1)
 
     def stop(self):
-        self.state.running = False
+        self.state.stop()
         time.sleep(0.2)
-        if self.stream_in:
-            try:
-                self.stream_in.stop_stream()
-                self.stream_in.close()
-            except Exception:
-                pass
-        if self.stream_out:
-            try:
-                self.stream_out.stop_stream()
-                self.stream_out.close()
-            except Exception:
-                pass
+        # The threads may still be inside a read or write on the worker's
+        # shared rings; those can only be unmapped once every thread is out
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        stuck = [t.name for t in self.threads if t.is_alive()]
+        if stuck:
+            print(f"Warning: audio threads still running at shutdown: {', '.join(stuck)}")
+        if self.worker is not None:
+            self.worker.stop(close=not stuck)
+        for stream in (self.stream, self.stream_in, self.stream_out):
+            if stream:
+                try:
+                    stream.stop_stream()
+                    stream.close()
+                except Exception:
+                    pass
         if self.pa:
             try:
                 self.pa.terminate()
@@ -266,8 +628,9 @@ class AudioEngine:
                 pass
 
 
-def load_config():
-    with open("config.json") as f:
+def load_config(path=None):
+    path = path or os.environ.get("INTELLIVOICE_CONFIG", "config.json")
+    with open(path) as f:
         return json.load(f)
 
 
@@ -299,6 +662,125 @@ def validate_config(cfg):
             errors.append("Missing audio.frames_per_buffer")
         elif not isinstance(audio_cfg["frames_per_buffer"], int):
             errors.append("audio.frames_per_buffer must be an integer")
+        
+        if "device_channels" in audio_cfg:
+            dev_channels = audio_cfg["device_channels"]
+            if not isinstance(dev_channels, int) or dev_channels < 1:
+                errors.append("audio.device_channels must be a positive integer")
+            elif dev_channels != audio_cfg.get("channels") and audio_cfg.get("channels") != 1:
+                errors.append("audio.device_channels differing from audio.channels requires mono processing (channels 1)")
+            elif dev_channels != audio_cfg.get("channels"):
+                selected = audio_cfg.get("input_channel", "left")
+                index = AudioEngine.CHANNEL_NAMES.get(selected, selected)
+                if not isinstance(index, int) or not 0 <= index < dev_channels:
+                    errors.append(f"audio.input_channel must be 'left', 'right' or a channel index "
+                                  f"below {dev_channels}")
+        
+        if "model_rate" in audio_cfg:
+            model_rate = audio_cfg["model_rate"]
+            if not isinstance(model_rate, int) or model_rate <= 0:
+                errors.append("audio.model_rate must be a positive integer")
+            elif model_rate != audio_cfg.get("sample_rate") and not cfg.get("stft", {}).get("enabled", False):
+                warnings.append("audio.model_rate is ignored without the STFT stage")
+        
+        if "pipeline" in audio_cfg and audio_cfg["pipeline"] not in AudioEngine.PIPELINES:
+            errors.append("audio.pipeline must be 'threaded' or 'duplex'")
+        backend = audio_cfg.get("backend", "pyaudio")
+        source = audio_cfg.get("source", backend)
+        sink = audio_cfg.get("sink", backend)
+        if source not in hal.names("source"):
+            errors.append(f"audio.source must be one of {list(hal.names('source'))}")
+        if sink not in hal.names("sink"):
+            errors.append(f"audio.sink must be one of {list(hal.names('sink'))}")
+        if audio_cfg.get("pipeline", "threaded") == "duplex" and (source, sink) != ("pyaudio", "pyaudio"):
+            errors.append("audio.pipeline 'duplex' requires the pyaudio source and sink")
+        if source == "wav" and not cfg.get("simulation", {}).get("wav_path"):
+            errors.append("audio.source 'wav' requires simulation.wav_path")
+        if "spi" in (source, sink):
+            if audio_cfg.get("pipeline", "threaded") != "threaded":
+                errors.append("the spi audio backend requires audio.pipeline 'threaded'")
+            if audio_cfg.get("channels", 1) != 1 or audio_cfg.get("device_channels", 1) != 1:
+                errors.append("the spi audio backend requires audio.channels and audio.device_channels 1")
+            if audio_cfg.get("sample_rate") not in ADS1256_DATA_RATES:
+                errors.append("audio.sample_rate must be an ADS1256 data rate "
+                              f"{sorted(ADS1256_DATA_RATES, reverse=True)} with the spi audio backend")
+            spi_cfg = cfg.get("spi", {})
+            if spi_cfg.get("pga_gain", 1) not in ADS1256_GAINS:
+                errors.append(f"spi.pga_gain must be one of {sorted(ADS1256_GAINS)}")
+            if spi_cfg.get("dac_channel", "A") not in DAC8532_COMMANDS:
+                errors.append("spi.dac_channel must be 'A' or 'B'")
+            if spi_cfg.get("adc_channel", 0) not in range(8):
+                errors.append("spi.adc_channel must be 0-7")
+        
+        if "ring_slots" in audio_cfg and (not isinstance(audio_cfg["ring_slots"], int) or audio_cfg["ring_slots"] < 2):
+            errors.append("audio.ring_slots must be an integer >= 2")
+    
+    # STFT conversion stage
+    if "stft" in cfg and cfg["stft"].get("enabled", False):
+        stft_cfg = cfg["stft"]
+        fft_size = stft_cfg.get("fft_size", 512)
+        hop_size = stft_cfg.get("hop_size", 128)
+        if not all(isinstance(v, int) and v > 0 for v in (fft_size, hop_size)):
+            errors.append("stft.fft_size and stft.hop_size must be positive integers")
+        else:
+            if fft_size % hop_size:
+                errors.append("stft.fft_size must be a multiple of stft.hop_size")
+            frames = cfg.get("audio", {}).get("frames_per_buffer")
+            if isinstance(frames, int) and frames % hop_size:
+                errors.append("audio.frames_per_buffer must be a multiple of stft.hop_size")
+        if stft_cfg.get("window", "hann") not in ("hann", "sqrt_hann", "hamming", "rect"):
+            errors.append("stft.window must be one of hann, sqrt_hann, hamming, rect")
+        lookahead = stft_cfg.get("lookahead", 0)
+        if not isinstance(lookahead, int) or lookahead < 0:
+            errors.append("stft.lookahead must be a non-negative integer")
+    
+    # Inference configuration
+    if "inference" in cfg:
+        inf_cfg = cfg["inference"]
+        if inf_cfg.get("graph_optimization", "all") not in GRAPH_OPTIMIZATION_LEVELS:
+            errors.append("inference.graph_optimization must be one of disable, basic, extended, all")
+        for key in ("intra_op_threads", "inter_op_threads", "warmup_runs"):
+            if key in inf_cfg and (not isinstance(inf_cfg[key], int) or inf_cfg[key] < 0):
+                errors.append(f"inference.{key} must be a non-negative integer")
+        if "cache_max_mb" in inf_cfg and not isinstance(inf_cfg["cache_max_mb"], (int, float)):
+            errors.append("inference.cache_max_mb must be a number")
+        if "batch_max_blocks" in inf_cfg and (not isinstance(inf_cfg["batch_max_blocks"], int) or inf_cfg["batch_max_blocks"] < 1):
+            errors.append("inference.batch_max_blocks must be a positive integer")
+        elif inf_cfg.get("batch_max_blocks", 1) > 1 and cfg.get("audio", {}).get("pipeline", "threaded") == "duplex":
+            warnings.append("inference.batch_max_blocks only applies to the threaded pipeline; "
+                            "the duplex callback converts one block at a time")
+        if inf_cfg.get("isolation", "thread") not in AudioEngine.ISOLATION:
+            errors.append("inference.isolation must be 'thread' or 'process'")
+        elif inf_cfg.get("isolation") == "process" and cfg.get("audio", {}).get("pipeline", "threaded") != "threaded":
+            errors.append("inference.isolation 'process' requires audio.pipeline 'threaded'")
+        if "worker_cpus" in inf_cfg and not (isinstance(inf_cfg["worker_cpus"], list) and all(isinstance(c, int) for c in inf_cfg["worker_cpus"])):
+            errors.append("inference.worker_cpus must be a list of CPU numbers")
+        if "batch_max_latency_ms" in inf_cfg and not isinstance(inf_cfg["batch_max_latency_ms"], (int, float)):
+            errors.append("inference.batch_max_latency_ms must be a number")
+        variants = inf_cfg.get("quantized_variants", [])
+        if not isinstance(variants, list) or any(v not in QUANTIZED_SUFFIXES for v in variants):
+            errors.append(f"inference.quantized_variants must be a list of {', '.join(QUANTIZED_SUFFIXES)}")
+        if "quant_max_error_db" in inf_cfg and not isinstance(inf_cfg["quant_max_error_db"], (int, float)):
+            errors.append("inference.quant_max_error_db must be a number")
+        if "quant_probe_runs" in inf_cfg and (not isinstance(inf_cfg["quant_probe_runs"], int) or inf_cfg["quant_probe_runs"] < 1):
+            errors.append("inference.quant_probe_runs must be a positive integer")
+        if inf_cfg.get("engine", "model") not in ConversionStage.ENGINES:
+            errors.append("inference.engine must be 'model' or 'dsp'")
+        elif inf_cfg.get("engine") == "dsp" and not cfg.get("stft", {}).get("enabled", False):
+            errors.append("inference.engine 'dsp' requires the STFT stage (stft.enabled)")
+    
+    # DSP voice normalization engine
+    if "normalizer" in cfg:
+        norm_cfg = cfg["normalizer"]
+        for key, value in norm_cfg.items():
+            if not isinstance(value, (int, float)):
+                errors.append(f"normalizer.{key} must be a number")
+        for key in ("hpf_order", "comp_ratio"):
+            if isinstance(norm_cfg.get(key, 1), (int, float)) and norm_cfg.get(key, 1) < 1:
+                errors.append(f"normalizer.{key} must be at least 1")
+        threshold = norm_cfg.get("deess_threshold", 0.3)
+        if isinstance(threshold, (int, float)) and not 0 < threshold <= 1:
+            errors.append("normalizer.deess_threshold must be in (0, 1]")
     
     # GPIO configuration
     if "gpio" in cfg:
@@ -309,6 +791,12 @@ def validate_config(cfg):
                 errors.append(f"Missing gpio.{key}")
             elif not isinstance(gpio_cfg[key], int):
                 errors.append(f"gpio.{key} must be an integer")
+        if gpio_cfg.get("backend", "gpiozero") not in hal.names("gpio"):
+            errors.append(f"gpio.backend must be one of {list(hal.names('gpio'))}")
+        for entry in cfg.get("simulation", {}).get("gpio_script", []):
+            if entry.get("button") not in required_gpio_keys or not isinstance(entry.get("at_s"), (int, float)):
+                errors.append("simulation.gpio_script entries need 'at_s' and a gpio 'button' name")
+                break
     
     # Display configuration
     if "display" in cfg:
@@ -317,6 +805,55 @@ def validate_config(cfg):
             errors.append("Missing display.enabled")
         if "i2c_port" not in display_cfg:
             warnings.append("Missing display.i2c_port (using default: 13)")
+        if display_cfg.get("backend", "ssd1306") not in hal.names("display"):
+            errors.append(f"display.backend must be one of {list(hal.names('display'))}")
+        refresh = display_cfg.get("max_refresh_hz", 10.0)
+        if not isinstance(refresh, (int, float)) or refresh <= 0:
+            errors.append("display.max_refresh_hz must be a positive number")
+        for key in ("vu_step", "dbfs_step", "latency_step_ms"):
+            value = display_cfg.get(key, 0)
+            if not isinstance(value, (int, float)) or value < 0:
+                errors.append(f"display.{key} must be a non-negative number")
+    
+    # Speech gating
+    if "gating" in cfg:
+        gate_cfg = cfg["gating"]
+        if gate_cfg.get("fill", "comfort_noise") not in SpeechGate.FILLS:
+            errors.append(f"gating.fill must be one of {list(SpeechGate.FILLS)}")
+        zcr_max = gate_cfg.get("zcr_max", 0.35)
+        if not isinstance(zcr_max, (int, float)) or not 0 < zcr_max <= 1:
+            errors.append("gating.zcr_max must be in (0, 1]")
+        hangover = gate_cfg.get("hangover_ms", 300.0)
+        if not isinstance(hangover, (int, float)) or hangover < 0:
+            errors.append("gating.hangover_ms must be a non-negative number")
+        if gate_cfg.get("enabled", False) and gate_cfg.get("use_ptt", False) and "gpio" in cfg \
+                and "ptt_input" not in cfg["gpio"]:
+            errors.append("gating.use_ptt requires gpio.ptt_input")
+    
+    # Output playout buffer
+    if "playout" in cfg:
+        for key in ("jitter_k", "margin_ms", "initial_ms", "max_ms", "max_adjust_ms"):
+            value = cfg["playout"].get(key, 0)
+            if not isinstance(value, (int, float)) or value < 0:
+                errors.append(f"playout.{key} must be a non-negative number")
+        if cfg["playout"].get("enabled", False) and cfg.get("audio", {}).get("pipeline", "threaded") != "threaded":
+            warnings.append("playout only applies to the threaded pipeline; it is ignored with audio.pipeline 'duplex'")
+    
+    # Degradation scheduler
+    if "scheduler" in cfg:
+        sched_cfg = cfg["scheduler"]
+        for key in ("deadline_blocks", "recover_ms", "crossfade_ms"):
+            value = sched_cfg.get(key, 1)
+            if not isinstance(value, (int, float)) or value <= 0:
+                errors.append(f"scheduler.{key} must be a positive number")
+        for key in ("headroom", "recover_load", "mask_alpha"):
+            value = sched_cfg.get(key, 0.5)
+            if not isinstance(value, (int, float)) or not 0 < value <= 1:
+                errors.append(f"scheduler.{key} must be in (0, 1]")
+        if "max_backoff" in sched_cfg and (not isinstance(sched_cfg["max_backoff"], int) or sched_cfg["max_backoff"] < 1):
+            errors.append("scheduler.max_backoff must be a positive integer")
+        if sched_cfg.get("enabled", False) and not cfg.get("stft", {}).get("enabled", False):
+            warnings.append("scheduler has no effect without the STFT stage")
     
     # Mode configuration
     if "modes" in cfg:
@@ -331,16 +868,32 @@ def validate_config(cfg):
         elif not isinstance(modes_cfg["languages"], list):
             errors.append("modes.languages must be a list")
     
+    # Logging configuration
+    if "logging" in cfg:
+        log_cfg = cfg["logging"]
+        for key in ("metrics_interval_s", "metrics_flush_s", "metrics_max_mb"):
+            if key in log_cfg and (not isinstance(log_cfg[key], (int, float)) or log_cfg[key] <= 0):
+                errors.append(f"logging.{key} must be a positive number")
+    
     return errors, warnings
 
 
 def setup_logging(cfg):
+    handlers = [logging.StreamHandler(sys.stdout)]
+    log_file = cfg["logging"].get("file")
+    if log_file:
+        try:
+            handlers.append(logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=int(cfg["logging"].get("file_max_mb", 10) * 1024 * 1024),
+                backupCount=cfg["logging"].get("file_backups", 3),
+            ))
+        except OSError as e:
+            print(f"Warning: cannot open log file {log_file}: {e}")
     logging.basicConfig(
         level=getattr(logging, cfg["logging"].get("level", "INFO")),
         format="%(asctime)s %(levelname)s %(message)s",
-        handlers=[
-            logging.StreamHandler(sys.stdout),
-        ],
+        handlers=handlers,
     )
 
 
@@ -372,7 +925,7 @@ def main():
     def signal_handler(signum, frame):
         """Handle shutdown signals gracefully."""
         logging.info(f"Received signal {signum}, shutting down gracefully...")
-        state.running = False
+        state.stop()
         if global_audio:
             global_audio.stop()
 
@@ -389,25 +942,40 @@ def main():
     global_audio = audio
     audio.start()
 
+    metrics = MetricsWriter(cfg, state, rings={"in": audio.ring_in, "out": audio.ring_out})
+    metrics.start()
+
     logging.info("System initialized and running")
 
+    # Redraw only when the state changes visibly, at most max_refresh_hz
+    min_interval = 1.0 / cfg["display"].get("max_refresh_hz", 10.0)
+    version = -1
+    control_version = -1
+
     try:
         while state.running:
-            # Periodic status refresh
-            gpioctl.update_leds()
+            new_version = state.wait_for_change(version, timeout=1.0)
+            if new_version == version:
+                continue
+            version = new_version
+            if state.control_version != control_version:
+                control_version = state.control_version
+                gpioctl.update_leds()
             snap = state.get_snapshot()
             lines = [
-                f"Mode: {snap['mode']}",
+                f"Mode: {snap['mode']}{' TX' if snap['ptt'] else ''}"
+                f"{'' if snap['degradation'] == 'full' else ' ' + snap['degradation'][:4].upper()}",
                 f"Lang: {snap['language']}",
-                f"VU: {snap['level_rms']:.3f}",
+                f"VU: {snap['level_vu']:.3f} {snap['level_dbfs']:.0f}dB",
                 f"Lat: {snap['latency_ms']:.1f} ms",
             ]
             display.draw_text(lines)
-            time.sleep(0.05)
+            time.sleep(min_interval)
     except KeyboardInterrupt:
         logging.info("Keyboard interrupt received")
     finally:
         logging.info("Shutting down...")
+        metrics.stop()
         audio.stop()
         logging.info("IntelliVoice Device stopped")
 
@@ -0,0 +1,246 @@
+"""Pure-NumPy voice normalization chain, the ``dsp`` conversion engine.
+
+The chain runs inside the conversion stage's STFT in place of the model:
+``SpectralCleaner`` turns each frame into one gain per bin (high-pass, noise
+suppression, de-esser) and ``DynamicsProcessor`` then shapes the
+resynthesised block (noise gate, AGC / compressor, peak limiter). Both keep
+their state across blocks and work in preallocated buffers.
+"""
+import math
+
+import numpy as np
+
+_EPS = 1e-12
+
+
+class SpectralCleaner:
+    """High-pass, noise suppression and de-essing as a single mask per STFT frame.
+
+    - High-pass: Butterworth magnitude response ``1 / sqrt(1 + (fc / f)^(2 order))``
+      per bin (zero at DC).
+    - Noise suppression: the power of each bin is smoothed over frames and
+      its noise floor tracked as a minimum that may rise by at most
+      ``noise_rise_db_s``; the gain is ``1 - noise_over * noise / power``,
+      floored at ``-noise_reduction_db``.
+    - De-esser: when the ``deess_low_hz``-``deess_high_hz`` band holds more
+      than ``deess_threshold`` of the frame's power, that band is turned
+      down to the threshold, by at most ``deess_max_db``.
+
+    Frames are tracked one after another (a few per block); everything
+    within a frame is vectorized over the bins.
+    """
+
+    # A tracked minimum of the smoothed power sits this far below the noise mean
+    MIN_BIAS = 1.7
+
+    def __init__(self, max_frames, fft_size, hop_size, sample_rate, hpf_hz=100.0, hpf_order=4,
+                 noise_reduction_db=12.0, noise_over=1.5, noise_rise_db_s=10.0, power_smoothing=0.8,
+                 deess_low_hz=4000.0, deess_high_hz=8000.0, deess_threshold=0.3, deess_max_db=8.0):
+        n_bins = fft_size // 2 + 1
+        self.n_bins = n_bins
+        freqs = np.arange(n_bins) * (sample_rate / fft_size)
+        self.hpf = np.zeros(n_bins, dtype=np.float32)
+        if hpf_hz > 0:
+            self.hpf[1:] = 1.0 / np.sqrt(1.0 + (hpf_hz / freqs[1:]) ** (2 * hpf_order))
+        else:
+            self.hpf[:] = 1.0
+        self.noise_over = np.float32(noise_over)
+        self.floor = np.float32(10.0 ** (-noise_reduction_db / 20.0))
+        frame_s = hop_size / sample_rate
+        self.rise = np.float32(10.0 ** (noise_rise_db_s * frame_s / 10.0))
+        self.smoothing = np.float32(power_smoothing)
+
+        # De-esser band with half-cosine edges (a quarter of the band wide)
+        high = min(deess_high_hz, sample_rate / 2.0)
+        edge = max((high - deess_low_hz) / 4.0, freqs[1])
+        w = np.clip((freqs - deess_low_hz) / edge, 0.0, 1.0) * np.clip((high - freqs) / edge + 1.0, 0.0, 1.0)
+        self.band = (0.5 - 0.5 * np.cos(np.pi * w)).astype(np.float32) if deess_low_hz < high \
+            else np.zeros(n_bins, dtype=np.float32)
+        self.deess_threshold = deess_threshold
+        self.deess_floor = 10.0 ** (-deess_max_db / 20.0)
+
+        self._power = np.zeros((max_frames, n_bins), dtype=np.float32)
+        self._mask = np.zeros((max_frames, n_bins), dtype=np.float32)
+        self._smooth = np.zeros(n_bins, dtype=np.float32)
+        self._noise = np.zeros(n_bins, dtype=np.float32)
+        self._tmp = np.zeros(n_bins, dtype=np.float32)
+        self._band_power = np.zeros(max_frames, dtype=np.float32)
+        self._total_power = np.zeros(max_frames, dtype=np.float32)
+        self._deess = np.zeros(max_frames, dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        self._primed = False  # the first frame sets the smoothed power and the floor
+        self._noise.fill(np.inf)
+
+    def process(self, spectra, n_out, out):
+        """Apply the mask to the first ``n_out`` frames of ``spectra``, into ``out``."""
+        power = self._power[:n_out]
+        mask = self._mask[:n_out]
+        np.abs(spectra[:n_out], out=mask)
+        np.multiply(mask, mask, out=power)
+        power *= self.hpf
+        power *= self.hpf
+        if not self._primed:
+            self._smooth[:] = power[0]
+            self._primed = True
+
+        smooth, noise, tmp = self._smooth, self._noise, self._tmp
+        a = self.smoothing
+        for t in range(n_out):
+            # smooth = a * smooth + (1 - a) * power
+            smooth *= a
+            np.multiply(power[t], 1.0 - a, out=tmp)
+            smooth += tmp
+            noise *= self.rise
+            np.minimum(noise, smooth, out=noise)
+            # gain = max(floor, 1 - over * noise / smooth)
+            g = mask[t]
+            np.add(smooth, _EPS, out=tmp)
+            np.divide(noise, tmp, out=g)
+            g *= -self.noise_over * self.MIN_BIAS
+            g += 1.0
+            np.maximum(g, self.floor, out=g)
+
+        if self.deess_threshold < 1.0:
+            # Sibilant share of each frame's (cleaned) power
+            np.multiply(power, mask, out=power)
+            np.multiply(power, mask, out=power)
+            band = np.dot(power, self.band, out=self._band_power[:n_out])
+            total = np.sum(power, axis=1, out=self._total_power[:n_out])
+            total += _EPS
+            ratio = np.divide(band, total, out=band)
+            # gain = sqrt(threshold / ratio) on the band, within [deess_floor, 1]
+            g = self._deess[:n_out]
+            np.add(ratio, _EPS, out=g)
+            np.divide(self.deess_threshold, g, out=g)
+            np.sqrt(g, out=g)
+            np.clip(g, self.deess_floor, 1.0, out=g)
+            # mask *= 1 - band * (1 - g)
+            g -= 1.0
+            np.multiply(g[:, np.newaxis], self.band, out=power)
+            power += 1.0
+            mask *= power
+        mask *= self.hpf
+        return np.multiply(spectra[:n_out], mask, out=out[:n_out])
+
+
+class DynamicsProcessor:
+    """Noise gate, AGC / compressor and peak limiter on one float block, in place.
+
+    Levels are measured per sub-block of about ``sub_ms``: an attack /
+    release power envelope drives the gate (open above
+    ``gate_threshold_dbfs``, held for ``gate_hold_ms``, closed to
+    ``gate_floor_db``), a slow AGC that moves the speech level towards
+    ``agc_target_dbfs`` (only while the gate is open) and a hard-knee
+    compressor above ``comp_threshold_dbfs``. The limiter bounds the gain at
+    every sub-block boundary so the linearly interpolated gain never lifts a
+    sub-block's peak above ``limiter_ceiling_dbfs``; its reduction recovers
+    over ``limiter_release_ms``. Only the per-sub-block control values are
+    computed in Python; the audio itself is processed with array operations.
+    """
+
+    def __init__(self, frames, sample_rate, sub_ms=2.0, attack_ms=5.0, release_ms=80.0,
+                 gate_threshold_dbfs=-50.0, gate_floor_db=-20.0, gate_hold_ms=150.0,
+                 gate_attack_ms=2.0, gate_release_ms=100.0, agc_target_dbfs=-20.0, agc_max_gain_db=12.0,
+                 agc_max_cut_db=6.0, agc_time_ms=2000.0, comp_threshold_dbfs=-18.0, comp_ratio=3.0,
+                 limiter_ceiling_dbfs=-1.0, limiter_release_ms=50.0):
+        n_sub = max(1, round(frames * 1000.0 / (sample_rate * sub_ms)))
+        self.frames = frames
+        self.n_sub = n_sub
+        bounds = np.linspace(0, frames, n_sub + 1).round().astype(np.intp)
+        self._starts = bounds[:-1].copy()
+        self._lengths = np.diff(bounds).astype(np.float32)
+        sub_s = frames / (sample_rate * n_sub)
+        coef = lambda ms: 1.0 - math.exp(-sub_s * 1000.0 / ms) if ms > 0 else 1.0
+        self.attack = coef(attack_ms)
+        self.release = coef(release_ms)
+        self.gate_threshold = gate_threshold_dbfs
+        self.gate_floor = 10.0 ** (gate_floor_db / 20.0)
+        self.gate_hold = max(1, round(gate_hold_ms / (sub_s * 1000.0)))
+        self.gate_attack = coef(gate_attack_ms)
+        self.gate_release = coef(gate_release_ms)
+        self.agc_target = agc_target_dbfs
+        self.agc_max_gain = agc_max_gain_db
+        self.agc_max_cut = agc_max_cut_db
+        self.agc_rate = coef(agc_time_ms)
+        self.comp_threshold = comp_threshold_dbfs
+        self.comp_slope = 1.0 - 1.0 / comp_ratio
+        self.ceiling = 10.0 ** (limiter_ceiling_dbfs / 20.0)
+        self.limiter_release = coef(limiter_release_ms)
+
+        # Per-sample interpolation between the gains at sub-block boundaries
+        index = np.repeat(np.arange(n_sub), np.diff(bounds))
+        self._index = index
+        self._index_next = index + 1
+        self._frac = ((np.arange(frames) - bounds[index] + 1) / np.diff(bounds)[index]).astype(np.float32)
+        self._gains = np.zeros(n_sub + 1, dtype=np.float32)
+        self._peak = np.zeros(n_sub + 1, dtype=np.float32)  # one spare for the look-ahead
+        self._power = np.zeros(n_sub, dtype=np.float32)
+        self._abs = np.zeros(frames, dtype=np.float32)
+        self._g0 = np.zeros(frames, dtype=np.float32)
+        self._g1 = np.zeros(frames, dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        self.env = 0.0
+        self.gate_gain = self.gate_floor
+        self.hold = 0
+        self.agc_db = 0.0
+        self.limit = 1.0
+        self._gains[-1] = self.gate_floor
+
+    @property
+    def gate_open(self):
+        return self.hold > 0
+
+    def process(self, y):
+        """Apply the dynamics to a float32 block of ``frames`` samples in place."""
+        n_sub = self.n_sub
+        a = self._abs
+        np.abs(y, out=a)
+        peak = self._peak
+        np.maximum.reduceat(a, self._starts, out=peak[:n_sub])
+        np.square(y, out=a)
+        power = np.add.reduceat(a, self._starts, out=self._power)
+        power /= self._lengths
+
+        gains = self._gains
+        ceiling = self.ceiling
+        # Start from the last block's final gain, pulled down if a peak starts this block
+        gains[0] = min(gains[-1], ceiling / peak[0]) if peak[0] > 0 else gains[-1]
+        peaks = peak.tolist()
+        env, gate_gain, hold, agc_db, limit = self.env, self.gate_gain, self.hold, self.agc_db, self.limit
+        for k, p in enumerate(power.tolist()):
+            env += (self.attack if p > env else self.release) * (p - env)
+            level_db = 10.0 * math.log10(env + _EPS)
+            if level_db > self.gate_threshold:
+                hold = self.gate_hold
+            elif hold > 0:
+                hold -= 1
+            target = 1.0 if hold > 0 else self.gate_floor
+            gate_gain += (self.gate_attack if target > gate_gain else self.gate_release) * (target - gate_gain)
+            if hold > 0:
+                agc_db += self.agc_rate * (self.agc_target - level_db - agc_db)
+                agc_db = min(self.agc_max_gain, max(-self.agc_max_cut, agc_db))
+            over = level_db + agc_db - self.comp_threshold
+            gain_db = agc_db - over * self.comp_slope if over > 0 else agc_db
+            dyn = gate_gain * 10.0 ** (gain_db / 20.0)
+            # Limiter: the boundary gain ends sub-block k and starts k + 1
+            limit += self.limiter_release * (1.0 - limit)
+            pk = max(peaks[k], peaks[k + 1]) if k + 1 < n_sub else peaks[k]
+            if pk * dyn * limit > ceiling:
+                limit = ceiling / (pk * dyn)
+            gains[k + 1] = dyn * limit
+        self.env, self.gate_gain, self.hold, self.agc_db, self.limit = env, gate_gain, hold, agc_db, limit
+
+        # g = gains[i] + (gains[i + 1] - gains[i]) * frac
+        g0, g1 = self._g0, self._g1
+        np.take(gains, self._index, out=g0, mode="clip")
+        np.take(gains, self._index_next, out=g1, mode="clip")
+        g1 -= g0
+        g1 *= self._frac
+        g0 += g1
+        y *= g0
+        np.clip(y, -ceiling, ceiling, out=y)
+        return y
@@ -0,0 +1,225 @@
+"""Adaptive playout (jitter) buffer between the processing stage and the DAC."""
+import math
+
+import numpy as np
+
+
+class AdaptivePlayout:
+    """Sample FIFO in front of the output stream with an adaptive target depth.
+
+    Processed blocks are pushed with their capture and commit stamps; the
+    transit time (commit - capture) is the processing delay of each block.
+    Its mean and variance are tracked with exponential averages, along with
+    a fast-attack / slow-release peak of the excess over the mean, and the
+    target depth is one output block plus ``max(jitter_k * stddev, peak) +
+    margin_ms`` of audio: just enough that a block delayed by a recent
+    inference spike still arrives before the DAC needs it.
+
+    ``next_block()`` always returns exactly ``frames`` samples. Above the
+    target it drops one waveform period between two rising zero crossings,
+    below it repeats one, at most ``max_adjust_ms`` per block, so the depth
+    converges without clicks (near-silent audio is spliced anywhere). When
+    the FIFO runs dry it returns None and re-buffers up to the target.
+    """
+
+    SILENCE_LEVEL = 64  # peak below which a splice is inaudible
+
+    def __init__(self, frames, sample_rate, jitter_k=3.0, margin_ms=2.0, initial_ms=10.0,
+                 max_ms=200.0, max_adjust_ms=10.0, alpha=0.05, peak_release=0.995):
+        self.frames = frames
+        self.rate = sample_rate
+        self.jitter_k = jitter_k
+        self.margin_ms = margin_ms
+        self.alpha = alpha
+        self.peak_release = peak_release
+        self.max_target = frames + int(max_ms * sample_rate / 1000.0)
+        self.max_adjust = max(2, min(frames // 2, int(max_adjust_ms * sample_rate / 1000.0)))
+        self.min_period = max(2, sample_rate // 500)  # 2 ms, i.e. up to 500 Hz pitch
+        self.capacity = self.max_target + 2 * frames
+        self._fifo = np.zeros(self.capacity, dtype=np.int16)
+        self._n = 0
+        self._out = np.zeros(frames, dtype=np.int16)
+        # Per queued block: end position in the FIFO, capture and commit stamps
+        max_blocks = self.capacity // frames + 2
+        self._ends = np.zeros(max_blocks, dtype=np.int64)
+        self._t0 = np.zeros(max_blocks, dtype=np.int64)
+        self._t_commit = np.zeros(max_blocks, dtype=np.int64)
+        self._blocks = 0
+        window = frames + self.max_adjust
+        self._nonneg = np.zeros(window, dtype=np.bool_)
+        self._rising = np.zeros(window, dtype=np.bool_)
+        # Linear crossfade ramps by length, for smoothing splices
+        self._ramp = [np.arange(1, n + 1, dtype=np.float32) / (n + 1) for n in range(1, self.min_period + 1)]
+        self._mix = np.zeros(self.min_period, dtype=np.float32)
+        self.mean_ms = None
+        self.var_ms2 = 0.0
+        self.peak_ms = initial_ms
+        self.buffering = True
+        self.underruns = 0
+        self.overflows = 0
+        self.dropped = 0  # samples removed to shrink the buffer
+        self.inserted = 0  # samples repeated to grow it
+
+    @property
+    def depth(self):
+        return self._n
+
+    def space(self):
+        return self.capacity - self._n
+
+    @property
+    def jitter_ms(self):
+        return max(self.jitter_k * math.sqrt(self.var_ms2), self.peak_ms)
+
+    @property
+    def target(self):
+        """Target depth in samples."""
+        extra = int(math.ceil((self.jitter_ms + self.margin_ms) * self.rate / 1000.0))
+        return min(self.max_target, self.frames + extra)
+
+    def push(self, pcm, t_capture, t_commit):
+        """Queue one processed block and update the jitter estimate."""
+        n = len(pcm)
+        if self._n + n > self.capacity:
+            self.overflows += 1
+            self._consume(self._n + n - self.capacity)
+        self._fifo[self._n:self._n + n] = pcm
+        self._n += n
+        i = self._blocks
+        self._ends[i] = self._n
+        self._t0[i] = t_capture
+        self._t_commit[i] = t_commit
+        self._blocks += 1
+
+        transit = (t_commit - t_capture) / 1e6
+        if self.mean_ms is None:
+            self.mean_ms = transit
+        else:
+            delta = transit - self.mean_ms
+            self.mean_ms += self.alpha * delta
+            self.var_ms2 = (1.0 - self.alpha) * (self.var_ms2 + self.alpha * delta * delta)
+        self.peak_ms = max(transit - self.mean_ms, self.peak_ms * self.peak_release)
+
+    def next_block(self):
+        """Return (block, capture_ns, commit_ns) for the next output block, or None.
+
+        The stamps belong to the last sample of the block; the block is a
+        view of an internal buffer, valid until the next call.
+        """
+        n = self._n
+        frames = self.frames
+        target = self.target
+        if self.buffering:
+            if n < max(target, frames):
+                return None
+            self.buffering = False
+        if n < frames:
+            self.underruns += 1
+            self.buffering = True
+            return None
+
+        out = self._out
+        consumed = frames
+        error = n - target
+        if error > self.min_period:
+            splice = self._find_period(min(error, self.max_adjust))
+            if splice is not None:
+                # Skip fifo[a:a + p]
+                a, p = splice
+                fade = min(p, self.min_period, frames - a)
+                out[:a] = self._fifo[:a]
+                self._crossfade(out[a:a + fade], a, a + p)
+                out[a + fade:] = self._fifo[a + p + fade:frames + p]
+                consumed = frames + p
+                self.dropped += p
+        elif error < -self.min_period:
+            splice = self._find_period(min(-error, self.max_adjust), repeat=True)
+            if splice is not None:
+                # Play fifo[a:b] twice
+                a, p = splice
+                b = a + p
+                fade = min(p, self.min_period)
+                out[:b] = self._fifo[:b]
+                self._crossfade(out[b:b + fade], b, a)
+                out[b + fade:b + p] = self._fifo[a + fade:b]
+                out[b + p:] = self._fifo[b:frames - p]
+                consumed = frames - p
+                self.inserted += p
+        if consumed == frames:
+            out[:] = self._fifo[:frames]
+
+        # Stamps of the block holding the last consumed sample
+        last = consumed - 1
+        j = int(np.searchsorted(self._ends[:self._blocks], last, side="right"))
+        lag_ns = int((self._ends[j] - 1 - last) * 1e9 / self.rate)
+        t_capture = int(self._t0[j]) - lag_ns
+        t_commit = int(self._t_commit[j])
+        self._consume(consumed)
+        return out, t_capture, t_commit
+
+    def _find_period(self, wanted, repeat=False):
+        """Find (start, length) of a splice of at most `wanted` samples.
+
+        The span runs between two rising zero crossings inside the next
+        output block (a repeated span must leave room for itself); near-silent
+        audio can be spliced at the start.
+        """
+        window = min(self._n, self.frames + self.max_adjust)
+        x = self._fifo[:window]
+        if wanted >= 1 and max(int(x.max()), -int(x.min())) < self.SILENCE_LEVEL:
+            return 0, wanted
+        if wanted < self.min_period:
+            return None
+        nonneg = np.greater_equal(x, 0, out=self._nonneg[:window])
+        rising = np.greater(nonneg[1:], nonneg[:-1], out=self._rising[:window - 1])
+        crossings = np.flatnonzero(rising) + 1
+        best = None
+        for i, a in enumerate(crossings[:64]):
+            room = min(wanted, (self.frames - a) // 2) if repeat else wanted
+            if a >= self.frames or room < self.min_period:
+                break
+            # Longest span that fits within `room`
+            k = int(np.searchsorted(crossings, a + room, side="right")) - 1
+            if k > i and crossings[k] - a >= self.min_period:
+                p = int(crossings[k] - a)
+                if best is None or p > best[1]:
+                    best = (int(a), p)
+                    if p == wanted:
+                        break
+        return best
+
+    def _crossfade(self, out, src, dst):
+        # Fade from the samples at `src` to the (phase-aligned) ones at `dst`
+        n = len(out)
+        mix = self._mix[:n]
+        mix[:] = self._fifo[dst:dst + n]
+        mix -= self._fifo[src:src + n]
+        mix *= self._ramp[n - 1][:n]
+        mix += self._fifo[src:src + n]
+        np.copyto(out, mix, casting="unsafe")
+
+    def _consume(self, count):
+        rest = self._n - count
+        self._fifo[:rest] = self._fifo[count:self._n]
+        self._n = rest
+        blocks = self._blocks
+        self._ends[:blocks] -= count
+        done = int(np.count_nonzero(self._ends[:blocks] <= 0))
+        if done:
+            keep = blocks - done
+            self._ends[:keep] = self._ends[done:blocks]
+            self._t0[:keep] = self._t0[done:blocks]
+            self._t_commit[:keep] = self._t_commit[done:blocks]
+            self._blocks = keep
+
+    def stats(self):
+        ms = 1000.0 / self.rate
+        return {
+            "depth_ms": self._n * ms,
+            "target_ms": self.target * ms,
+            "jitter_ms": self.jitter_ms,
+            "underruns": self.underruns,
+            "overflows": self.overflows,
+            "dropped_ms": self.dropped * ms,
+            "inserted_ms": self.inserted * ms,
+        }
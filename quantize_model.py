@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""Build int8 variants of a voice conversion model, calibrated on recorded audio.
+
+Recorded device audio (16-bit WAV files at ``audio.sample_rate``) is run
+through the same conversion stage as the device, speech gate included, to
+collect the magnitudes the model actually sees. Next to the model it then
+writes:
+
+- ``<stem>.int8dyn.onnx``: dynamic quantization (int8 weights, activation
+  scales computed on every call);
+- ``<stem>.int8.onnx``: static QDQ quantization (uint8 activations, int8
+  weights) with activation ranges calibrated on the recorded features;
+- ``<stem>.calib.npy``: held-out feature blocks that SessionManager uses to
+  A/B the variants against the fp32 model at load time.
+
+For a streaming (stateful) model only the new frames of each block are
+recorded, in runs of consecutive blocks, and the state inputs are carried
+through each run from a reset by the fp32 model while calibrating. The
+probe features are one such run, which the A/B check streams through.
+
+Finally it runs that A/B check itself and prints speed and error per
+variant. Run it on the target device so the timings are meaningful:
+
+    python3 quantize_model.py recordings/ --language ES
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from conversion import ConversionStage
+from convert_offline import find_wavs, wav_memmap
+from inference import QUANTIZED_SUFFIXES, ModelStream, SessionManager, probe_path, variant_path
+
+
+class FeatureRecorder:
+    """Stands in for the SessionManager and samples the model inputs it is given.
+
+    Every block is returned an all-ones mask. Blocks are recorded in runs of
+    consecutive blocks: single blocks for a stateless model, and up to
+    ``run_blocks`` blocks of one stream (ended early when the stage resets
+    it) for a ``streaming`` model, which the stage drives through a
+    RecordingStream that sees only each block's new frames. At most about
+    ``2 * limit`` blocks are kept: when full, every other run is dropped and
+    only every ``stride``-th new run is recorded, so the sample stays evenly
+    spread over all the audio while each run stays contiguous.
+    """
+
+    def __init__(self, limit, streaming=False, run_blocks=32):
+        self.limit = max(1, limit)
+        self.streaming = streaming
+        self.run_blocks = max(1, run_blocks) if streaming else 1
+        self.runs = []
+        self.stride = 1
+        self.seen = 0
+        self._run = None  # the run being recorded (None while one is skipped)
+        self._open = False
+        self._length = 0
+        self.session = object()
+
+    def get(self, language):
+        return self.session
+
+    def load(self, language):
+        return self.session
+
+    def stream(self, session, features):
+        if not self.streaming:
+            return None
+        self.end_run()
+        return RecordingStream(self, features)
+
+    def end_run(self):
+        self._open = False
+
+    def record(self, block):
+        if not self._open:
+            if sum(len(run) for run in self.runs) >= 2 * self.limit:
+                del self.runs[1::2]
+                self.stride *= 2
+            self._run = [] if self.seen % self.stride == 0 else None
+            if self._run is not None:
+                self.runs.append(self._run)
+            self.seen += 1
+            self._open = True
+            self._length = 0
+        if self._run is not None:
+            self._run.append(block.copy())
+        self._length += 1
+        if self._length >= self.run_blocks:
+            self._open = False
+
+    def run(self, session, features):
+        for block in features:
+            self.record(block)
+        return np.ones_like(features)
+
+
+class RecordingStream:
+    """ModelStream stand-in that records the frames bound to it on every call."""
+
+    def __init__(self, recorder, features):
+        self.recorder = recorder
+        self.features = features
+        self.mask = np.ones(features.shape, dtype=np.float32)
+
+    def reset(self):
+        self.recorder.end_run()  # the state starts over: so does the run
+
+    def run(self):
+        self.recorder.record(self.features[0])
+        return self.mask
+
+
+class FeatureReader:
+    """Calibration data reader feeding recorded blocks to the quantizer one at a time.
+
+    For a streaming model ``stream`` is a ModelStream over the fp32 model:
+    every block is fed with the state the fp32 model carried to it from the
+    start of its run, and the stream is then run on the block to advance it.
+    The stream is reset at every index in ``starts``.
+    """
+
+    def __init__(self, input_name, features, stream=None, starts=(0,)):
+        self.input_name = input_name
+        self.features = features
+        self.stream = stream
+        self.starts = set(int(start) for start in starts)
+        self.state_names = [] if stream is None else [inp.name for inp in stream.session.get_inputs()[1:]]
+        self.index = 0
+
+    def get_next(self):
+        if self.index >= len(self.features):
+            return None
+        block = self.features[self.index]
+        feeds = {self.input_name: block[np.newaxis]}
+        if self.stream is not None:
+            if self.index in self.starts:
+                self.stream.reset()
+            for name, pair in zip(self.state_names, self.stream.states):
+                feeds[name] = pair[self.stream.turn].copy()
+            self.stream.features[0] = block
+            self.stream.run()
+        self.index += 1
+        return feeds
+
+
+def is_streaming(model):
+    """True when the model takes state inputs besides the magnitudes."""
+    import onnxruntime as ort
+    return len(ort.InferenceSession(model, providers=["CPUExecutionProvider"]).get_inputs()) > 1
+
+
+def collect_features(cfg, language, paths, limit, channel=0, streaming=False, run_blocks=32):
+    """Run WAV files through the conversion stage; returns a list of runs of
+    consecutive (blocks, frames, bins) magnitudes.
+
+    Blocks hold what the model is fed: the new frames plus the lookahead
+    context, or only the new frames for a ``streaming`` model.
+    """
+    recorder = FeatureRecorder(limit, streaming, run_blocks)
+    stage = ConversionStage(cfg, recorder)
+    if stage.stft is None:
+        raise ValueError("the model runs inside the STFT stage; enable stft in the config")
+    rate = cfg["audio"]["sample_rate"]
+    frames = cfg["audio"]["frames_per_buffer"]
+    pcm = np.zeros(frames, dtype=np.int16)
+    snap = {"mode": "convert", "language": language, "ptt": True}
+    for path in paths:
+        file_rate, data = wav_memmap(path)
+        if file_rate != rate:
+            raise ValueError(f"{path}: sample rate {file_rate} does not match audio.sample_rate {rate}")
+        x = data[:, min(channel, data.shape[1] - 1)]
+        stage.reset(adaptive=True)
+        for start in range(0, len(x) - frames + 1, frames):
+            pcm[:] = x[start:start + frames]
+            stage.process_block(pcm, snap)
+    if not recorder.runs:
+        raise ValueError("no speech found in the calibration audio")
+    return [np.stack(run) for run in recorder.runs]
+
+
+def split_probe(runs, probe_blocks):
+    """Hold out blocks for the A/B check; the rest calibrates.
+
+    Returns ``(calibration, starts, probe)``, ``starts`` being where each
+    run begins in ``calibration``. Single-block runs (a stateless model)
+    are held out evenly spaced. For a streaming model the longest run is
+    held out whole (at most ``probe_blocks`` blocks), so the A/B check can
+    carry the state through it from a reset, as on the device.
+    """
+    if max(len(run) for run in runs) == 1:
+        features = np.concatenate(runs)
+        count = min(probe_blocks, len(features) // 2)
+        held = np.zeros(len(features), dtype=bool)
+        held[np.linspace(0, len(features) - 1, count).round().astype(int)] = True
+        return features[~held], np.arange(int((~held).sum())), features[held]
+    if len(runs) < 2:
+        raise ValueError("a streaming model needs at least two runs of speech to calibrate and check; "
+                         "record more audio")
+    middle = (len(runs) - 1) / 2
+    pick = max(range(len(runs)), key=lambda i: (len(runs[i]), -abs(i - middle)))
+    rest = runs[:pick] + runs[pick + 1:]
+    starts = np.cumsum([0] + [len(run) for run in rest[:-1]])
+    return np.concatenate(rest), starts, runs[pick][:probe_blocks]
+
+
+def quantize(model, variant, calibration, per_channel=False, method="minmax", starts=(0,)):
+    """Write one quantized variant of ``model``; returns its path.
+
+    ``starts`` marks where the runs of a streaming model's calibration begin.
+    """
+    from onnxruntime.quantization import (
+        CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static)
+
+    out = variant_path(model, variant)
+    if variant == "int8_dynamic":
+        quantize_dynamic(model, out, per_channel=per_channel, weight_type=QuantType.QInt8)
+    else:
+        import onnxruntime as ort
+        session = ort.InferenceSession(model, providers=["CPUExecutionProvider"])
+        stream = None
+        if len(session.get_inputs()) > 1:
+            stream = ModelStream(session, np.zeros((1,) + calibration.shape[1:], dtype=np.float32))
+        methods = {
+            "minmax": CalibrationMethod.MinMax,
+            "entropy": CalibrationMethod.Entropy,
+            "percentile": CalibrationMethod.Percentile,
+        }
+        quantize_static(model, out, FeatureReader(session.get_inputs()[0].name, calibration, stream, starts), quant_format=QuantFormat.QDQ,
+                        per_channel=per_channel, activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8, calibrate_method=methods[method])
+    return out
+
+
+def main(argv=None):
+    from main import load_config, validate_config
+
+    parser = argparse.ArgumentParser(description="Quantize the IntelliVoice model to int8, calibrated on recorded audio")
+    parser.add_argument("inputs", nargs="+", help="Calibration WAV files or directories (recorded on the device)")
+    parser.add_argument("-c", "--config", help="Config file (default: config.json)")
+    parser.add_argument("-l", "--language", help="Language whose model to quantize (default: first configured language)")
+    parser.add_argument("--model", help="Model file (default: the language's model from the config)")
+    parser.add_argument("--variants", nargs="+", choices=sorted(QUANTIZED_SUFFIXES),
+                        default=sorted(QUANTIZED_SUFFIXES), help="Variants to build")
+    parser.add_argument("--method", choices=("minmax", "entropy", "percentile"), default="minmax",
+                        help="Activation range calibration for int8_static")
+    parser.add_argument("--per-channel", action="store_true", help="Quantize weights per output channel")
+    parser.add_argument("--calib-blocks", type=int, default=500, help="Blocks kept for calibration")
+    parser.add_argument("--probe-blocks", type=int, default=32, help="Blocks held out for the A/B check")
+    parser.add_argument("--channel", type=int, default=0, help="Input channel for multi-channel files")
+    parser.add_argument("--json", help="Write the A/B results to this JSON file")
+    args = parser.parse_args(argv)
+
+    cfg = load_config(args.config)
+    errors, _ = validate_config(cfg)
+    if errors:
+        for error in errors:
+            print(f"  ERROR: {error}")
+        return 1
+    inference = cfg.setdefault("inference", {})
+    inference["engine"] = "model"
+    inference["batch_max_blocks"] = 1
+    cfg.setdefault("scheduler", {})["enabled"] = False
+    language = args.language or cfg["modes"].get("languages", ["EN"])[0]
+    model = args.model or SessionManager(cfg).model_path(language)
+    if model is None or not os.path.exists(model):
+        print(f"No model found for {language}")
+        return 1
+
+    paths = [src for src, _ in find_wavs(args.inputs)]
+    if not paths:
+        print("No WAV files found")
+        return 1
+    try:
+        runs = collect_features(cfg, language, paths, args.calib_blocks + args.probe_blocks, args.channel,
+                                streaming=is_streaming(model), run_blocks=args.probe_blocks)
+        calibration, starts, probe = split_probe(runs, args.probe_blocks)
+    except ValueError as e:
+        print(f"✗ {e}")
+        return 1
+    print(f"{len(calibration)} calibration + {len(probe)} probe blocks from {len(paths)} file(s)")
+
+    for variant in args.variants:
+        out = quantize(model, variant, calibration, args.per_channel, args.method, starts)
+        print(f"✓ {variant}: {out} ({os.path.getsize(out) / 1e6:.2f} MB)")
+    np.save(probe_path(model), probe)
+
+    # The same A/B check SessionManager runs at load time
+    inference["quantized_variants"] = args.variants
+    manager = SessionManager(cfg)
+    results, _ = manager.evaluate(model, probe)
+    if not results:
+        print(f"✗ {model} failed to load")
+        return 1
+    fp32 = results[0]["ms"]
+    for result in results:
+        verdict = "ok" if result["ok"] else f"rejected (> {manager.quant_max_error_db:.1f} dB)"
+        print(f"  {result['variant']:<13} {result['ms']:8.3f} ms/block  x{fp32 / result['ms']:.2f}  "
+              f"error {result['error_db']:7.1f} dB  {verdict}")
+    best = min((r for r in results if r["ok"]), key=lambda r: r["ms"])
+    print(f"Load would pick: {best['variant']} ({best['path']})")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"model": model, "language": language, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
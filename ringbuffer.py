@@ -0,0 +1,267 @@
+"""Single-producer/single-consumer ring buffer for audio blocks."""
+import time
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class AudioRingBuffer:
+    """Fixed-size ring of int16 audio blocks with parallel timestamp arrays.
+
+    Storage is allocated once. The producer fills the next free slot in place
+    and commits it; the consumer reads a view of the oldest slot and releases
+    it when done. Only the producer advances ``head`` and only the consumer
+    advances ``tail``, so no lock is needed: under the GIL each counter update
+    is a single atomic store, and a slot is never visible to the consumer
+    before its samples and timestamp have been written.
+
+    Timestamps are ``time.perf_counter_ns()`` values. Each slot carries the
+    producer's timestamp (capture time, propagated through the pipeline) and
+    the time it was committed to this ring.
+
+    A consumer waiting for data sleeps on an event set by every commit. An
+    underrun is counted only when a block arrives after (or not before) the
+    deadline the consumer passed, e.g. when the output device would drain,
+    not when the ring is merely empty or an idle wait times out.
+    """
+
+    def __init__(self, slots, frames, channels=1, dtype=np.int16):
+        if slots < 2:
+            raise ValueError("ring buffer needs at least 2 slots")
+        self.slots = slots
+        self.frames = frames
+        self.channels = channels
+        self.samples = np.zeros((slots, frames * channels), dtype=dtype)
+        self.timestamps = np.zeros(slots, dtype=np.int64)
+        self.commit_ns = np.zeros(slots, dtype=np.int64)
+        self.head = 0  # total blocks committed (producer only)
+        self.tail = 0  # total blocks released (consumer only)
+        self.overruns = 0
+        self.underruns = 0
+        self._ready = threading.Event()
+
+    def __len__(self):
+        return self.head - self.tail
+
+    def readable(self):
+        return self.head - self.tail
+
+    def writable(self):
+        return self.slots - (self.head - self.tail)
+
+    # Producer side
+
+    def write_slot(self):
+        """Return a writable view of the next free slot, or None if full."""
+        if self.head - self.tail >= self.slots:
+            self.overruns += 1
+            return None
+        return self.samples[self.head % self.slots]
+
+    def commit_write(self, timestamp):
+        idx = self.head % self.slots
+        self.timestamps[idx] = timestamp
+        self.commit_ns[idx] = time.perf_counter_ns()
+        self.head += 1
+        self._ready.set()
+
+    def push(self, data, timestamp):
+        """Copy one block (bytes or array) into the ring. Returns False on overrun."""
+        slot = self.write_slot()
+        if slot is None:
+            return False
+        if isinstance(data, np.ndarray):
+            np.copyto(slot, data.reshape(-1), casting="unsafe")
+        else:
+            slot[:] = np.frombuffer(data, dtype=slot.dtype)
+        self.commit_write(timestamp)
+        return True
+
+    # Consumer side
+
+    def wait_readable(self, timeout, deadline=None):
+        """Sleep until a block is available or ``timeout`` passes.
+
+        ``deadline`` is the ``perf_counter_ns()`` by which the consumer needs
+        the next block; a wait that ends after it, with or without a block,
+        counts as an underrun.
+        """
+        if self.head != self.tail:
+            return True
+        end = time.monotonic() + timeout
+        ready = True
+        while self.head == self.tail:
+            # Clear, then re-check: a commit in between leaves the event set
+            self._ready.clear()
+            if self.head != self.tail:
+                break
+            remaining = end - time.monotonic()
+            if remaining <= 0 or not self._ready.wait(remaining):
+                ready = self.head != self.tail
+                break
+        self._check_deadline(deadline)
+        return ready
+
+    def _check_deadline(self, deadline):
+        if deadline is not None and time.perf_counter_ns() > deadline:
+            self.underruns += 1
+
+    def read_view(self, offset=0):
+        """Return ``(timestamp, view)`` of the oldest block (or ``offset`` blocks
+        after it), or None if that block has not been written yet."""
+        if self.head - self.tail <= offset:
+            return None
+        idx = (self.tail + offset) % self.slots
+        return int(self.timestamps[idx]), self.samples[idx]
+
+    def commit_time(self, offset=0):
+        """perf_counter_ns() at which the block was committed to this ring."""
+        return int(self.commit_ns[(self.tail + offset) % self.slots])
+
+    def release_read(self, count=1):
+        self.tail += count
+
+    def stats(self):
+        return {
+            "depth": self.head - self.tail,
+            "overruns": self.overruns,
+            "underruns": self.underruns,
+        }
+
+
+class SharedAudioRing(AudioRingBuffer):
+    """AudioRingBuffer living in ``multiprocessing.shared_memory``.
+
+    Instances pickle by segment name, so they can be passed straight to a
+    child process. Two semaphores carry the handoff: ``doorbell`` counts
+    committed blocks and ``free`` counts empty slots. The producer writes a
+    slot's samples and timestamps and only then releases a doorbell token;
+    the consumer acquires one token per block before it looks at the slot,
+    and releases one free token per block once it is done with it. A
+    semaphore release/acquire pair is a full memory barrier between the
+    processes, so a slot is never read before its data is visible, nor
+    overwritten while it is still being read, on weakly ordered CPUs (the
+    Pi's aarch64 cores) too. Each side counts the tokens it holds locally;
+    head/tail and the overrun/underrun counters in the shared int64 header
+    are for monitoring (``len()``, ``stats()``).
+    """
+
+    HEADER = 4  # head, tail, overruns, underruns
+
+    def __init__(self, slots, frames, channels=1, ctx=None, name=None, doorbell=None, free=None):
+        if slots < 2:
+            raise ValueError("ring buffer needs at least 2 slots")
+        self.slots = slots
+        self.frames = frames
+        self.channels = channels
+        size = 8 * (self.HEADER + 2 * slots) + 2 * slots * frames * channels
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        ctx = ctx or mp.get_context()
+        self.doorbell = doorbell if doorbell is not None else ctx.Semaphore(0)
+        self.free = free if free is not None else ctx.Semaphore(slots)
+        self._filled = 0  # doorbell tokens taken by the consumer, not yet released
+        self._reserved = 0  # free tokens taken by the producer, not yet committed
+        self._map()
+        if self.owner:
+            self._ctrl.fill(0)
+
+    def _map(self):
+        buf = self.shm.buf
+        self._ctrl = np.ndarray(self.HEADER, dtype=np.int64, buffer=buf)
+        self.timestamps = np.ndarray(self.slots, dtype=np.int64, buffer=buf, offset=8 * self.HEADER)
+        self.commit_ns = np.ndarray(
+            self.slots, dtype=np.int64, buffer=buf, offset=8 * (self.HEADER + self.slots))
+        self.samples = np.ndarray(
+            (self.slots, self.frames * self.channels), dtype=np.int16,
+            buffer=buf, offset=8 * (self.HEADER + 2 * self.slots))
+
+    def __getstate__(self):
+        return {
+            "slots": self.slots, "frames": self.frames, "channels": self.channels,
+            "name": self.shm.name, "doorbell": self.doorbell, "free": self.free,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["slots"], state["frames"], state["channels"],
+                      name=state["name"], doorbell=state["doorbell"], free=state["free"])
+
+    head = property(lambda self: int(self._ctrl[0]), lambda self, v: self._ctrl.__setitem__(0, v))
+    tail = property(lambda self: int(self._ctrl[1]), lambda self, v: self._ctrl.__setitem__(1, v))
+    overruns = property(lambda self: int(self._ctrl[2]), lambda self, v: self._ctrl.__setitem__(2, v))
+    underruns = property(lambda self: int(self._ctrl[3]), lambda self, v: self._ctrl.__setitem__(3, v))
+
+    # Producer side
+
+    def writable(self):
+        while self.free.acquire(False):
+            self._reserved += 1
+        return self._reserved
+
+    def write_slot(self):
+        """Return a writable view of the next free slot, or None if full."""
+        if self._reserved == 0:
+            if not self.free.acquire(False):
+                self.overruns += 1
+                return None
+            self._reserved += 1
+        return self.samples[self.head % self.slots]
+
+    def commit_write(self, timestamp):
+        idx = self.head % self.slots
+        self.timestamps[idx] = timestamp
+        self.commit_ns[idx] = time.perf_counter_ns()
+        self.head += 1
+        self._reserved -= 1
+        self.doorbell.release()
+
+    # Consumer side
+
+    def readable(self):
+        while self.doorbell.acquire(False):
+            self._filled += 1
+        return self._filled
+
+    def wait_readable(self, timeout, deadline=None):
+        """Sleep on the doorbell until a block is available or ``timeout`` passes.
+
+        A wait that ends after ``deadline`` (``perf_counter_ns()``) counts as
+        an underrun.
+        """
+        if self.readable():
+            return True
+        ready = self.doorbell.acquire(timeout=timeout)
+        if ready:
+            self._filled += 1
+        self._check_deadline(deadline)
+        return ready
+
+    def read_view(self, offset=0):
+        if self.readable() <= offset:
+            return None
+        idx = (self.tail + offset) % self.slots
+        return int(self.timestamps[idx]), self.samples[idx]
+
+    def release_read(self, count=1):
+        self.tail += count
+        self._filled -= count
+        for _ in range(count):
+            self.free.release()
+
+    def close(self):
+        # Drop the numpy views first; the segment cannot close while exported
+        self._ctrl = self.timestamps = self.commit_ns = self.samples = None
+        self.shm.close()
+
+    def unlink(self):
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,129 @@
+"""Deadline-aware degradation of the conversion stage under CPU pressure."""
+
+# Degradation levels, cheapest last
+FULL, LIGHT, BYPASS = range(3)
+LEVELS = ("full", "light", "bypass")
+
+
+class DegradationScheduler:
+    """Picks how much work each block gets so it finishes before its deadline.
+
+    A block's deadline is its capture stamp plus ``deadline_ns`` (blocks
+    that were not queued, as in the duplex callback, get ``block_ns`` from
+    the start of processing). The cost of every level is tracked with a
+    fast-attack / slow-release average of the measured processing time.
+    ``begin()`` escalates (full -> light -> bypass) while the current
+    level's cost exceeds ``headroom`` of the time left, so a backed-up input
+    queue or an inference spike degrades the next block instead of dropping
+    one.
+
+    Recovery is probed one level at a time: after ``recover_blocks`` blocks
+    that finished within ``recover_load`` of their remaining time the
+    scheduler steps down and re-measures that level. A level that has to be
+    left again within ``recover_blocks`` doubles the wait before the next
+    probe (up to ``max_backoff``); one that holds resets it.
+    """
+
+    def __init__(self, block_ns, deadline_ns, headroom=0.8, recover_load=0.5, recover_blocks=50,
+                 max_backoff=16, attack=0.5, release=0.05):
+        self.block_ns = block_ns
+        self.deadline_ns = deadline_ns
+        self.headroom = headroom
+        self.recover_load = recover_load
+        self.recover_blocks = max(1, recover_blocks)
+        self.max_backoff = max(1, max_backoff)
+        self.attack = attack
+        self.release = release
+        self.level = FULL
+        self.cost_ns = [0.0] * len(LEVELS)
+        self._fresh = [True] * len(LEVELS)  # no valid estimate yet
+        self.backoff = 1
+        self._calm = 0
+        self._probe = None  # blocks run since the last step down
+        self._t_start = 0
+        self._deadline = 0
+        self._remaining = 0
+        self.blocks = [0] * len(LEVELS)
+        self.misses = 0
+        self.escalations = 0
+        self.recoveries = 0
+
+    @property
+    def name(self):
+        return LEVELS[self.level]
+
+    def begin(self, t_now, t0=None):
+        """Start one block (``t0``: its capture stamp) and return the level to run."""
+        deadline = t_now + self.block_ns if t0 is None else t0 + self.deadline_ns
+        remaining = deadline - t_now
+        level = self.level
+        while level < BYPASS and not self._fresh[level] and self.cost_ns[level] > self.headroom * remaining:
+            level += 1
+        if level > self.level:
+            self._escalate(level)
+        self._t_start = t_now
+        self._deadline = deadline
+        self._remaining = remaining
+        return self.level
+
+    def end(self, t_now, blocks=1):
+        """Finish the block started by ``begin()`` and update the estimates.
+
+        A batch of ``blocks`` consecutive blocks converted in one call counts
+        as that many blocks of an equal share of the time, the first one due
+        at the deadline ``begin()`` computed and each later one a block
+        period after it.
+        """
+        level = self.level
+        cost = (t_now - self._t_start) / blocks
+        if self._fresh[level]:
+            self.cost_ns[level] = float(cost)
+            self._fresh[level] = False
+        else:
+            previous = self.cost_ns[level]
+            alpha = self.attack if cost > previous else self.release
+            self.cost_ns[level] = previous + alpha * (cost - previous)
+        self.blocks[level] += blocks
+        if t_now > self._deadline:
+            self.misses += min(blocks, 1 + int((t_now - self._deadline) // self.block_ns))
+
+        if self._probe is not None:
+            self._probe += blocks
+            if self._probe >= self.recover_blocks:
+                # The probed level held up
+                self._probe = None
+                self.backoff = 1
+        if level > FULL and cost <= self.recover_load * self._remaining:
+            self._calm += blocks
+            if self._calm >= self.recover_blocks * self.backoff:
+                self._step_down()
+        else:
+            self._calm = 0
+
+    def _escalate(self, level):
+        if self._probe is not None:
+            # Recovered too early: wait longer before the next probe
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            self._probe = None
+        self.level = level
+        self._calm = 0
+        self.escalations += 1
+
+    def _step_down(self):
+        self.level -= 1
+        # The old estimate for this level is what made us leave it
+        self._fresh[self.level] = True
+        self._calm = 0
+        self._probe = 0
+        self.recoveries += 1
+
+    def stats(self):
+        return {
+            "level": self.name,
+            "blocks": dict(zip(LEVELS, self.blocks)),
+            "cost_ms": dict(zip(LEVELS, (c / 1e6 for c in self.cost_ns))),
+            "misses": self.misses,
+            "escalations": self.escalations,
+            "recoveries": self.recoveries,
+            "backoff": self.backoff,
+        }
@@ -0,0 +1,465 @@
+"""ADS1256 / DAC8532 audio over SPI (High-Precision AD/DA board)."""
+import os
+import math
+import time
+import logging
+import threading
+
+import numpy as np
+
+from ringbuffer import AudioRingBuffer
+
+# ADS1256 commands
+ADS_WAKEUP = 0x00
+ADS_RDATAC = 0x03
+ADS_SDATAC = 0x0F
+ADS_WREG = 0x50
+ADS_SELFCAL = 0xF0
+ADS_RESET = 0xFE
+
+# ADS1256 registers (written in one WREG starting at STATUS)
+ADS_REG_STATUS = 0x00
+
+# Output data rate (samples/s) -> DRATE register value
+ADS1256_DATA_RATES = {
+    30000: 0xF0, 15000: 0xE0, 7500: 0xD0, 3750: 0xC0, 2000: 0xB0, 1000: 0xA1,
+    500: 0x92, 100: 0x82, 60: 0x72, 50: 0x63, 30: 0x53, 25: 0x43, 15: 0x33,
+    10: 0x23, 5: 0x13,
+}
+
+# PGA gain -> ADCON register bits
+ADS1256_GAINS = {1: 0, 2: 1, 4: 2, 8: 3, 16: 4, 32: 5, 64: 6}
+
+# DAC8532 control byte: write the channel's buffer and load its DAC register
+DAC8532_COMMANDS = {"A": 0x10, "B": 0x24}
+DAC8532_MAX_SPEED_HZ = 30000000  # SCLK limit from the datasheet
+
+
+def open_spi(bus, device, speed_hz, mode=1):
+    import spidev
+
+    spi = spidev.SpiDev()
+    spi.open(bus, device)
+    spi.max_speed_hz = speed_hz
+    spi.mode = mode
+    return spi
+
+
+class DRDYLine:
+    """ADS1256 DRDY input: calling it is True while DRDY is low (data ready);
+    ``wait()`` sleeps until it goes low, woken by the GPIO edge."""
+
+    def __init__(self, pin):
+        from gpiozero import DigitalInputDevice
+
+        self.device = DigitalInputDevice(pin, pull_up=True)  # active while low
+
+    def __call__(self):
+        return self.device.is_active
+
+    def wait(self, timeout):
+        return self.device.wait_for_active(timeout)
+
+
+def open_drdy(pin):
+    return DRDYLine(pin)
+
+
+def set_realtime(priority):
+    """Move the calling thread to SCHED_FIFO; returns False if not permitted."""
+    if not priority:
+        return False
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        return True
+    except (AttributeError, OSError) as e:
+        print(f"Warning: cannot set real-time priority {priority}: {e}")
+        return False
+
+
+def decode_ads1256(raw, out):
+    """Take the top 16 bits of (n, 3) big-endian 24-bit ADS1256 codes into int16 `out`."""
+    np.copyto(out, raw[:, :2].view(">i2")[:, 0], casting="same_kind")
+    return out
+
+
+def encode_dac8532(pcm, out, command=DAC8532_COMMANDS["A"]):
+    """Encode int16 samples as DAC8532 frames (command, MSB, LSB) into (n, 3) uint8 `out`.
+
+    The DAC is offset binary, so the sign bit is flipped: -32768 -> 0x0000,
+    0 -> 0x8000 (mid-scale), 32767 -> 0xFFFF.
+    """
+    n = len(pcm)
+    out[:n, 0] = command
+    codes = out[:n, 1:].view(">u2")[:, 0]
+    np.bitwise_xor(pcm.view(np.uint16), np.uint16(0x8000), out=codes)
+    return out[:n]
+
+
+# struct spi_ioc_transfer from <linux/spi/spidev.h>
+SPI_IOC_TRANSFER = np.dtype([
+    ("tx_buf", "<u8"), ("rx_buf", "<u8"), ("len", "<u4"), ("speed_hz", "<u4"),
+    ("delay_usecs", "<u2"), ("bits_per_word", "u1"), ("cs_change", "u1"),
+    ("tx_nbits", "u1"), ("rx_nbits", "u1"), ("word_delay_usecs", "u1"), ("pad", "u1"),
+])
+SPI_IOC_MAX_TRANSFERS = (1 << 14) // SPI_IOC_TRANSFER.itemsize - 1
+
+
+def spi_ioc_message(count):
+    """ioctl request number of SPI_IOC_MESSAGE(count)."""
+    return (1 << 30) | ((count * SPI_IOC_TRANSFER.itemsize) << 16) | (ord("k") << 8)
+
+
+class ADS1256Input:
+    """ADS1256 capture in continuous-read (RDATAC) mode.
+
+    A real-time thread sleeps until DRDY goes low (a GPIO edge wait, so it
+    does not hold the GIL) and then reads ``adc_batch_frames`` conversions
+    as a single ``SPI_IOC_MESSAGE`` ioctl: one 3-byte transfer per
+    conversion straight into a preallocated (frames, 3) byte buffer, with
+    kernel delays spacing the transfers at the data rate. The ADS1256 has
+    no FIFO, so each batch re-synchronizes on DRDY and the delay is trimmed
+    after every batch like the DAC's. Once a block is full it is decoded in
+    one vectorized pass into an internal ring. Where the ioctl is
+    unavailable conversions are read one by one, yielding the GIL between
+    DRDY polls. ``read()`` mirrors a PyAudio input stream.
+    """
+
+    def __init__(self, cfg, spi=None, drdy=None):
+        spi_cfg = cfg.get("spi", {})
+        self.rate = cfg["audio"]["sample_rate"]
+        self.frames = cfg["audio"]["frames_per_buffer"]
+        self.speed_hz = spi_cfg.get("adc_speed_hz", 1800000)
+        self.spi = spi if spi is not None else open_spi(
+            spi_cfg.get("adc_bus", 0), spi_cfg.get("adc_device", 0), self.speed_hz)
+        self.drdy = drdy if drdy is not None else open_drdy(spi_cfg.get("drdy_pin", 5))
+        self.rt_priority = spi_cfg.get("rt_priority", 80)
+        self.drdy_timeout_ns = int(spi_cfg.get("drdy_timeout_ms", 50) * 1e6)
+        self.batch_frames = max(1, min(spi_cfg.get("adc_batch_frames", 64),
+                                       self.frames, SPI_IOC_MAX_TRANSFERS))
+        self.ring = AudioRingBuffer(cfg["audio"].get("ring_slots", 8), self.frames)
+        self._raw = np.zeros((self.frames, 3), dtype=np.uint8)
+        self._block = np.zeros(self.frames, dtype=np.int16)
+
+        # Receive descriptors for the whole block, pointing into _raw; chip
+        # select stays low for the whole message
+        self._xfers = np.zeros(self.frames, dtype=SPI_IOC_TRANSFER)
+        self._xfers["rx_buf"] = self._raw.ctypes.data + 3 * np.arange(self.frames)
+        self._xfers["len"] = 3
+        self._ioctl = None
+        if self.batch_frames > 1 and hasattr(self.spi, "fileno"):
+            import fcntl
+            self._ioctl = fcntl.ioctl
+        # Gap after each transfer in microseconds, trimmed from the measured rate
+        self.frame_gap_us = max(0.0, 1e6 / self.rate - 24e6 / self.speed_hz)
+        self._set_delays()
+
+        self.drdy_timeouts = 0
+        self.running = False
+        self._thread = None
+        self.configure(
+            channel=spi_cfg.get("adc_channel", 0),
+            gain=spi_cfg.get("pga_gain", 1),
+            input_buffer=spi_cfg.get("input_buffer", False),
+        )
+
+    def _set_delays(self):
+        edges = np.round(np.arange(self.frames + 1) * self.frame_gap_us)
+        np.copyto(self._xfers["delay_usecs"], np.diff(edges), casting="unsafe")
+
+    def _wait_drdy(self):
+        ready = self.drdy
+        if ready():
+            return True
+        wait = getattr(ready, "wait", None)
+        if wait is not None:
+            if wait(self.drdy_timeout_ns / 1e9):
+                return True
+        else:
+            deadline = time.perf_counter_ns() + self.drdy_timeout_ns
+            while time.perf_counter_ns() < deadline:
+                time.sleep(0)  # let other threads have the GIL between polls
+                if ready():
+                    return True
+        self.drdy_timeouts += 1
+        return False
+
+    def configure(self, channel=0, gain=1, input_buffer=False):
+        """Reset, program STATUS/MUX/ADCON/DRATE and self-calibrate."""
+        self.spi.writebytes([ADS_RESET])
+        self._wait_drdy()
+        status = 0x04 | (0x02 if input_buffer else 0x00)  # auto-calibration, MSB first
+        mux = (channel << 4) | 0x08  # AINx against AINCOM
+        adcon = ADS1256_GAINS[gain]  # clock out and sensor detect off
+        self.spi.writebytes([ADS_WREG | ADS_REG_STATUS, 3, status, mux, adcon,
+                             ADS1256_DATA_RATES[self.rate]])
+        self.spi.writebytes([ADS_SELFCAL])
+        self._wait_drdy()
+
+    def start_stream(self):
+        if self.running:
+            return
+        self.running = True
+        self._wait_drdy()
+        self.spi.writebytes([ADS_RDATAC])
+        self._thread = threading.Thread(target=self._run, name="ads1256-capture", daemon=True)
+        self._thread.start()
+
+    def is_active(self):
+        return self.running
+
+    def _run(self):
+        set_realtime(self.rt_priority)
+        raw = self._raw
+        read = self.spi.readbytes
+        while self.running:
+            i = 0
+            while i < self.frames:
+                if not self._wait_drdy():
+                    if not self.running:
+                        return
+                    continue
+                count = min(self.batch_frames, self.frames - i)
+                if self._ioctl is not None and self._read_message(i, count):
+                    i += count
+                else:
+                    raw[i] = read(3)
+                    i += 1
+            t_capture = time.perf_counter_ns()
+            slot = self.ring.write_slot()
+            if slot is None:
+                continue  # engine fell behind (counted as overrun)
+            decode_ads1256(raw, slot)
+            self.ring.commit_write(t_capture)
+
+    def _read_message(self, start, count):
+        """Read ``count`` conversions into _raw in one ioctl; False if it failed."""
+        xfers = self._xfers[start:start + count]
+        delays = xfers["delay_usecs"]
+        last = delays[-1]
+        delays[-1] = 0  # return in time to catch the next DRDY
+        t0 = time.perf_counter_ns()
+        try:
+            self._ioctl(self.spi.fileno(), spi_ioc_message(count), memoryview(xfers.view(np.uint8)))
+        except OSError as e:
+            print(f"Warning: batched ADC transfer failed, reading conversion by conversion: {e}")
+            self._ioctl = None
+            return False
+        finally:
+            delays[-1] = last
+        self._trim(count, time.perf_counter_ns() - t0)
+        return True
+
+    def _trim(self, count, elapsed_ns):
+        # Conversions were read (elapsed - one transfer) / (count - 1) apart;
+        # move the kernel delay half of the way towards the data period
+        if count < 2:
+            return
+        interval_us = (elapsed_ns / 1e3 - 24e6 / self.speed_hz) / (count - 1)
+        gap = max(0.0, self.frame_gap_us - 0.5 * (interval_us - 1e6 / self.rate))
+        if abs(gap - self.frame_gap_us) >= 0.05:
+            self.frame_gap_us = gap
+            self._set_delays()
+
+    def read(self, num_frames, exception_on_overflow=False):
+        """Return the next captured block (valid until the next call)."""
+        if not self.ring.wait_readable(timeout=1.0):
+            raise IOError("ADS1256 capture timed out")
+        _, pcm = self.ring.read_view()
+        np.copyto(self._block, pcm)
+        self.ring.release_read()
+        return self._block
+
+    def get_input_latency(self):
+        return self.frames / self.rate
+
+    def stop_stream(self):
+        if not self.running:
+            return
+        self.running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        self._wait_drdy()
+        self.spi.writebytes([ADS_SDATAC])
+
+    def close(self):
+        self.stop_stream()
+        self.spi.close()
+
+
+def dac_speed_for(rate, duty=0.5, minimum=4000000):
+    """Lowest SPI clock (at least ``minimum``) at which a 24-bit DAC8532 frame
+    takes no more than ``duty`` of the frame period at ``rate``."""
+    speed = max(minimum, math.ceil(24 * rate / duty))
+    if speed > DAC8532_MAX_SPEED_HZ:
+        raise ValueError(f"the DAC8532 cannot reach {rate} Hz (needs a {speed / 1e6:.1f} MHz SPI clock)")
+    return speed
+
+
+class DAC8532Output:
+    """DAC8532 playback paced from a ring buffer by a real-time thread.
+
+    ``write()`` queues a block (blocking while the ring is full, like a
+    PyAudio output stream). The output thread encodes each block into DAC
+    frames in one vectorized pass and sends them ``batch_frames`` at a time
+    as a single ``SPI_IOC_MESSAGE`` ioctl: one 3-byte transfer per frame with
+    chip select toggled in between (the DAC8532 latches on SYNC, so frames
+    cannot simply be concatenated into one long ``writebytes2``) and kernel
+    delays pacing the frames. The delay is trimmed after every batch so the
+    measured rate tracks ``sample_rate``. With ``batch_frames`` 1, or where
+    the ioctl is unavailable, frames are written one by one, yielding the
+    GIL while waiting for each frame's slot. When no block is ready the DAC holds its last value and an
+    underrun is counted.
+    """
+
+    def __init__(self, cfg, spi=None):
+        spi_cfg = cfg.get("spi", {})
+        self.rate = cfg["audio"]["sample_rate"]
+        self.frames = cfg["audio"]["frames_per_buffer"]
+        self.speed_hz = spi_cfg.get("dac_speed_hz", 4000000)
+        if 24e6 / self.speed_hz >= 1e6 / self.rate:
+            raise ValueError(f"spi.dac_speed_hz {self.speed_hz} cannot reach {self.rate} Hz: a 24-bit frame takes "
+                             f"{24e6 / self.speed_hz:.1f} us of a {1e6 / self.rate:.1f} us frame period")
+        self.spi = spi if spi is not None else open_spi(
+            spi_cfg.get("dac_bus", 0), spi_cfg.get("dac_device", 1), self.speed_hz)
+        self.command = DAC8532_COMMANDS[spi_cfg.get("dac_channel", "A")]
+        self.rt_priority = spi_cfg.get("rt_priority", 80)
+        self.batch_frames = max(1, min(spi_cfg.get("dac_batch_frames", 256),
+                                       self.frames, SPI_IOC_MAX_TRANSFERS))
+        self.ring = AudioRingBuffer(cfg["audio"].get("ring_slots", 8), self.frames)
+        self._frames = np.zeros((self.frames, 3), dtype=np.uint8)
+        # One reusable buffer view per DAC frame, so the loop allocates nothing
+        self._rows = [memoryview(row) for row in self._frames]
+
+        # Transfer descriptors for the whole block, pointing into _frames
+        self._xfers = np.zeros(self.frames, dtype=SPI_IOC_TRANSFER)
+        self._xfers["tx_buf"] = self._frames.ctypes.data + 3 * np.arange(self.frames)
+        self._xfers["len"] = 3
+        self._xfers["cs_change"] = 1
+        self._ioctl = None
+        if self.batch_frames > 1 and hasattr(self.spi, "fileno"):
+            import fcntl
+            self._ioctl = fcntl.ioctl
+        # Inter-frame gap in microseconds, trimmed from the measured rate
+        self.frame_gap_us = max(0.0, 1e6 / self.rate - 24e6 / self.speed_hz)
+        self._set_delays()
+
+        self.underruns = 0
+        self.samples_written = 0
+        self.achieved_rate = 0.0  # smoothed samples/s while playing
+        self._busy_ns = 0
+        self.running = False
+        self._thread = None
+
+    def _set_delays(self):
+        # Integer microsecond delays whose running sum follows frame_gap_us
+        edges = np.round(np.arange(self.frames + 1) * self.frame_gap_us)
+        np.copyto(self._xfers["delay_usecs"], np.diff(edges), casting="unsafe")
+
+    def start_stream(self):
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="dac8532-playback", daemon=True)
+        self._thread.start()
+
+    def is_active(self):
+        return self.running
+
+    def write(self, data, num_frames=None, exception_on_underflow=False):
+        while self.ring.writable() == 0:
+            if not self.running:
+                return
+            time.sleep(0.0005)
+        self.ring.push(np.frombuffer(data, dtype=np.int16), time.perf_counter_ns())
+
+    def _run(self):
+        set_realtime(self.rt_priority)
+        self._next_ns = time.perf_counter_ns()
+        while self.running:
+            if not self.ring.readable():
+                self.underruns += 1
+                self.ring.wait_readable(timeout=0.1)
+                self._next_ns = time.perf_counter_ns()
+                continue
+            _, pcm = self.ring.read_view()
+            n = len(pcm)
+            encode_dac8532(pcm, self._frames, self.command)
+            self.ring.release_read()
+            for start in range(0, n, self.batch_frames):
+                count = min(self.batch_frames, n - start)
+                t0 = time.perf_counter_ns()
+                if self._ioctl is not None:
+                    self._send_message(start, count)
+                else:
+                    self._send_frames(start, count)
+                self._account(count, time.perf_counter_ns() - t0)
+
+    def _send_message(self, start, count):
+        xfers = self._xfers[start:start + count]
+        xfers["cs_change"][-1] = 0  # release SYNC after the last frame
+        try:
+            self._ioctl(self.spi.fileno(), spi_ioc_message(count), memoryview(xfers.view(np.uint8)))
+        except OSError as e:
+            print(f"Warning: batched DAC transfer failed, writing frame by frame: {e}")
+            self._ioctl = None
+            self._next_ns = time.perf_counter_ns()
+            self._send_frames(start, count)
+        finally:
+            xfers["cs_change"][-1] = 1
+
+    def _send_frames(self, start, count):
+        period_ns = 1e9 / self.rate
+        write = self.spi.writebytes2
+        next_ns = self._next_ns
+        for row in self._rows[start:start + count]:
+            while time.perf_counter_ns() < next_ns:
+                time.sleep(0)  # let other threads have the GIL while waiting
+            write(row)
+            next_ns += period_ns
+        self._next_ns = next_ns
+
+    def _account(self, count, elapsed_ns):
+        self.samples_written += count
+        if elapsed_ns <= 0:
+            return
+        rate = count * 1e9 / elapsed_ns
+        self.achieved_rate = rate if not self.achieved_rate else 0.9 * self.achieved_rate + 0.1 * rate
+        if self._ioctl is not None:
+            # Frames took (elapsed / count) each; move the kernel delay half
+            # of the way towards the sample period
+            error_us = elapsed_ns / count / 1e3 - 1e6 / self.rate
+            gap = max(0.0, self.frame_gap_us - 0.5 * error_us)
+            if abs(gap - self.frame_gap_us) >= 0.05:
+                self.frame_gap_us = gap
+                self._set_delays()
+
+    def stats(self):
+        return {
+            "samples_written": self.samples_written,
+            "achieved_rate": self.achieved_rate,
+            "underruns": self.underruns,
+            "overruns": self.ring.overruns,
+        }
+
+    def get_output_latency(self):
+        return self.frames / self.rate
+
+    def stop_stream(self):
+        if not self.running:
+            return
+        self.running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        # Park the output at mid-scale
+        self.spi.writebytes([self.command, 0x80, 0x00])
+        logging.info(
+            f"DAC8532: {self.samples_written} samples at {self.achieved_rate:.0f}/s "
+            f"(target {self.rate}), {self.underruns} underruns"
+        )
+
+    def close(self):
+        self.stop_stream()
+        self.spi.close()
@@ -0,0 +1,270 @@
+"""Latency tracing and metrics for the audio pipeline."""
+import os
+import csv
+import time
+import logging
+import threading
+from bisect import bisect_right
+from datetime import datetime
+
+import numpy as np
+
+# Per-block stages, in pipeline order. Each is the time between two of the
+# capture / dequeue / pre-inference / post-inference / enqueue / write stamps;
+# "total" runs from capture to the end of the device write.
+STAGES = ("queue_in", "pre", "inference", "post", "queue_out", "write", "total")
+STAGE_INDEX = {name: i for i, name in enumerate(STAGES)}
+
+
+def _bucket_edges(min_us=20.0, max_ms=5000.0, ratio=1.1):
+    """Geometric bucket upper edges in nanoseconds (~10% resolution)."""
+    edges = []
+    edge = min_us * 1000.0
+    while edge < max_ms * 1e6:
+        edges.append(int(edge))
+        edge *= ratio
+    edges.append(int(max_ms * 1e6))
+    return edges
+
+
+BUCKET_EDGES_NS = _bucket_edges()
+N_BUCKETS = len(BUCKET_EDGES_NS) + 1  # last bucket catches everything slower
+
+
+class LatencyTracer:
+    """Fixed-bucket latency histograms, one per pipeline stage.
+
+    ``record`` is a bisect plus two integer stores, cheap enough to call
+    several times per block from the audio threads. Counts and maxima live in
+    one int64 array which can be supplied by the caller (e.g. a
+    ``multiprocessing.RawArray``) so a worker process records into the same
+    histograms. Percentiles are recomputed at most every ``refresh_s`` seconds
+    by ``summary()``.
+    """
+
+    def __init__(self, buffer=None, refresh_s=0.5):
+        size = self.storage_size()
+        if buffer is None:
+            self._data = np.zeros(size, dtype=np.int64)
+        else:
+            self._data = np.frombuffer(buffer, dtype=np.int64, count=size)
+        n = len(STAGES)
+        self.counts = self._data[:n * N_BUCKETS].reshape(n, N_BUCKETS)
+        self.maxima = self._data[n * N_BUCKETS:]
+        self.refresh_ns = int(refresh_s * 1e9)
+        self._summary = {}
+        self._summary_ns = 0
+
+    @staticmethod
+    def storage_size():
+        """Number of int64 values needed for the shared storage."""
+        return len(STAGES) * (N_BUCKETS + 1)
+
+    def record(self, stage, duration_ns):
+        if duration_ns < 0:
+            duration_ns = 0
+        self.counts[stage, bisect_right(BUCKET_EDGES_NS, duration_ns)] += 1
+        if duration_ns > self.maxima[stage]:
+            self.maxima[stage] = duration_ns
+
+    def reset(self):
+        self._data.fill(0)
+        self._summary = {}
+        self._summary_ns = 0
+
+    def percentiles(self, stage):
+        """Return count, p50/p95/p99 (bucket upper edge) and max in ms for a stage."""
+        counts = self.counts[stage]
+        total = int(counts.sum())
+        peak = int(self.maxima[stage])
+        result = {"count": total, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": peak / 1e6}
+        if total == 0:
+            return result
+        cumulative = np.cumsum(counts)
+        for key, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            idx = int(np.searchsorted(cumulative, q * total))
+            edge = BUCKET_EDGES_NS[idx] if idx < len(BUCKET_EDGES_NS) else peak
+            result[key] = min(edge, peak) / 1e6
+        return result
+
+    def summary(self):
+        """Per-stage percentiles, cached for ``refresh_s``."""
+        now = time.perf_counter_ns()
+        if now - self._summary_ns >= self.refresh_ns:
+            self._summary = {
+                name: self.percentiles(i)
+                for i, name in enumerate(STAGES)
+                if self.counts[i].any()
+            }
+            self._summary_ns = now
+        return self._summary
+
+
+def read_cpu_temp(path="/sys/class/thermal/thermal_zone0/temp"):
+    """CPU temperature in degrees C, or None if unavailable."""
+    try:
+        with open(path) as f:
+            return int(f.read().strip()) / 1000.0
+    except (OSError, ValueError):
+        return None
+
+
+def read_cpu_times(path="/proc/stat"):
+    """(busy, total) jiffies from the aggregate cpu line, or None."""
+    try:
+        with open(path) as f:
+            fields = [int(v) for v in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle + iowait
+    total = sum(fields)
+    return total - idle, total
+
+
+class MetricsWriter:
+    """Background sampler that writes device metrics to ``logging.metrics_csv``.
+
+    A daemon thread samples the state snapshot, CPU temperature and load, ring
+    depths and latency percentiles every ``metrics_interval_s``. Rows are kept
+    in memory and appended to the CSV in one write every ``metrics_flush_s``;
+    the file is rotated once it exceeds ``metrics_max_mb``. The audio threads
+    never touch this class, so they never wait on the SD card.
+    """
+
+    COLUMNS = [
+        "timestamp", "mode", "language", "degradation", "level_rms", "level_dbfs", "level_vu",
+        "clip_count", "latency_ms", "cpu_temp_c", "cpu_percent", "load_1m",
+        "ring_in_depth", "ring_out_depth", "ring_in_overruns", "ring_out_overruns",
+        "ring_out_underruns", "total_p50_ms", "total_p95_ms", "total_p99_ms",
+        "total_max_ms", "inference_p50_ms", "inference_p95_ms", "inference_p99_ms",
+    ]
+
+    def __init__(self, cfg, state, rings=None):
+        log_cfg = cfg.get("logging", {})
+        self.path = log_cfg.get("metrics_csv")
+        self.interval = log_cfg.get("metrics_interval_s", 1.0)
+        self.flush_interval = log_cfg.get("metrics_flush_s", 30.0)
+        self.max_bytes = int(log_cfg.get("metrics_max_mb", 5) * 1024 * 1024)
+        self.backups = log_cfg.get("metrics_backups", 3)
+        # Bound memory if the disk stays unavailable
+        self.max_rows = max(1, int(log_cfg.get("metrics_max_buffered_rows", 3600)))
+        self.state = state
+        self.rings = rings or {}
+        self.rows = []
+        self.dropped_rows = 0
+        self._cpu_prev = read_cpu_times()
+        self._stop = threading.Event()
+        self._thread = None
+        self._warned = False
+
+    def start(self):
+        if not self.path:
+            return
+        self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while not self._stop.wait(self.interval):
+            self.sample()
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def _cpu_percent(self):
+        current = read_cpu_times()
+        previous, self._cpu_prev = self._cpu_prev, current
+        if current is None or previous is None or current[1] == previous[1]:
+            return None
+        return 100.0 * (current[0] - previous[0]) / (current[1] - previous[1])
+
+    def _ring_stats(self, name):
+        ring = self.rings.get(name)
+        if ring is None:
+            return None, None, None
+        try:
+            # len() only reads the counters; readable() is the consumer's (it takes tokens)
+            return len(ring), ring.overruns, ring.underruns
+        except Exception:
+            return None, None, None  # ring already torn down during shutdown
+
+    def sample(self):
+        """Take one metrics sample into the in-memory buffer."""
+        snap = self.state.get_snapshot()
+        stages = snap.get("latency_stages", {})
+        total = stages.get("total", {})
+        inference = stages.get("inference", {})
+        in_depth, in_over, _ = self._ring_stats("in")
+        out_depth, out_over, out_under = self._ring_stats("out")
+        try:
+            load_1m = os.getloadavg()[0]
+        except OSError:
+            load_1m = None
+        row = [
+            datetime.now().isoformat(timespec="seconds"),
+            snap["mode"], snap["language"], snap.get("degradation"),
+            _fmt(snap.get("level_rms")), _fmt(snap.get("level_dbfs"), 1), _fmt(snap.get("level_vu")),
+            snap.get("clip_count"), _fmt(snap.get("latency_ms"), 2),
+            _fmt(read_cpu_temp(), 1), _fmt(self._cpu_percent(), 1), _fmt(load_1m, 2),
+            in_depth, out_depth, in_over, out_over, out_under,
+            _fmt(total.get("p50"), 2), _fmt(total.get("p95"), 2),
+            _fmt(total.get("p99"), 2), _fmt(total.get("max"), 2),
+            _fmt(inference.get("p50"), 2), _fmt(inference.get("p95"), 2),
+            _fmt(inference.get("p99"), 2),
+        ]
+        if len(self.rows) >= self.max_rows:
+            del self.rows[0]
+            self.dropped_rows += 1
+        self.rows.append(row)
+        return row
+
+    def flush(self):
+        """Append all buffered rows to the CSV in a single write."""
+        if not self.path or not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        try:
+            self._rotate_if_needed()
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, "a", newline="") as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(self.COLUMNS)
+                writer.writerows(rows)
+        except OSError as e:
+            # Keep the rows for the next attempt (bounded by max_rows)
+            self.rows = (rows + self.rows)[-self.max_rows:]
+            if not self._warned:
+                logging.warning(f"Cannot write metrics to {self.path}: {e}")
+                self._warned = True
+            return
+        last = dict(zip(self.COLUMNS, rows[-1]))
+        logging.info(
+            f"Mode={last['mode']} | Latency={last['latency_ms']}ms | Temp={last['cpu_temp_c']}°C | "
+            f"Lang={last['language']}"
+        )
+
+    def _rotate_if_needed(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < self.max_bytes:
+            return
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+def _fmt(value, digits=4):
+    if value is None:
+        return ""
+    return round(float(value), digits)
@@ -1,40 +1,65 @@
 #!/usr/bin/env python3
 """Generate test tone and output to DAC8532."""
-import spidev
+import json
 import math
 import time
 import sys
 
-def generate_sine_wave(frequency, sample_rate, duration, amplitude=0.5):
-    """Generate sine wave samples."""
-    samples = []
-    num_samples = int(sample_rate * duration)
-    
-    for i in range(num_samples):
-        # Generate sine wave
-        t = i / sample_rate
-        value = math.sin(2 * math.pi * frequency * t)
-        
-        # Scale to 0-1 range with amplitude control
-        scaled = (value * amplitude + 1.0) / 2.0
-        
-        # Convert to 16-bit DAC value (0-65535)
-        dac_value = int(scaled * 65535)
-        
-        # Clamp to valid range
-        dac_value = max(0, min(65535, dac_value))
-        
-        samples.append(dac_value)
-    
-    return samples
+import numpy as np
+
+from spi_audio import DAC8532Output, dac_speed_for
+
+BLOCK_FRAMES = 1024
 
-def send_to_dac(spi, value):
-    """Send 16-bit value to DAC8532 channel A."""
-    # DAC8532 command format: [Command] [MSB] [LSB]
-    # Command 0x00 = Write to DAC A
-    msb = (value >> 8) & 0xFF
-    lsb = value & 0xFF
-    spi.writebytes([0x00, msb, lsb])
+def generate_sine_wave(frequency, sample_rate, duration, amplitude=0.5, start=0):
+    """Generate int16 sine samples (the DAC writer maps 0 to mid-scale)."""
+    num_samples = int(round(sample_rate * duration))
+    t = (np.arange(num_samples) + start) / sample_rate
+    return (np.sin(2 * math.pi * frequency * t) * amplitude * 32767).astype(np.int16)
+
+def load_spi_config(path="config.json"):
+    """The ``spi`` section of config.json (empty if it cannot be read)."""
+    try:
+        with open(path) as f:
+            return json.load(f).get("spi", {})
+    except (OSError, ValueError):
+        return {}
+
+def open_dac(sample_rate, spi_cfg=None, speed_hz=None):
+    """Start a batched DAC8532 writer on the SPI bus, chip select and channel
+    from ``spi_cfg`` (default: config.json's ``spi`` section, as main.py
+    configures it).
+
+    The SPI clock defaults to the lowest one (at least 4 MHz) that leaves
+    half of every frame period free at ``sample_rate``.
+    """
+    spi_cfg = dict(load_spi_config() if spi_cfg is None else spi_cfg)
+    spi_cfg.setdefault("dac_bus", 10)
+    spi_cfg.setdefault("dac_device", 1)
+    spi_cfg["dac_speed_hz"] = speed_hz or dac_speed_for(sample_rate)
+    cfg = {
+        "audio": {"sample_rate": sample_rate, "frames_per_buffer": BLOCK_FRAMES, "ring_slots": 8},
+        "spi": spi_cfg,
+    }
+    dac = DAC8532Output(cfg)
+    dac.start_stream()
+    print(f"DAC8532 on SPI bus {spi_cfg['dac_bus']}, device {spi_cfg['dac_device']} "
+          f"at {spi_cfg['dac_speed_hz'] / 1e6:.1f} MHz")
+    return dac
+
+def write_samples(dac, samples):
+    """Queue samples block by block (blocks while the DAC ring is full)."""
+    for start in range(0, len(samples), BLOCK_FRAMES):
+        block = np.zeros(BLOCK_FRAMES, dtype=np.int16)
+        chunk = samples[start:start + BLOCK_FRAMES]
+        block[:len(chunk)] = chunk
+        dac.write(block.tobytes())
+
+def print_stats(dac):
+    stats = dac.stats()
+    print(f"  Samples written: {stats['samples_written']}")
+    print(f"  Achieved rate:   {stats['achieved_rate']:.0f} Hz (target {dac.rate} Hz)")
+    print(f"  Underruns:       {stats['underruns']}")
 
 def test_tone(frequency=440, duration=3, amplitude=0.5, sample_rate=44100):
     """Generate and play test tone through DAC."""
@@ -50,17 +75,12 @@ def test_tone(frequency=440, duration=3, amplitude=0.5, sample_rate=44100):
     print()
     
     try:
-        # Open SPI
-        spi = spidev.SpiDev()
-        spi.open(10, 0)  # Bus 10, device 0
-        spi.max_speed_hz = 1000000  # 1 MHz
-        spi.mode = 1
+        dac = open_dac(sample_rate)
         
         print("✓ SPI opened successfully")
         print()
         print("Generating sine wave...")
         
-        # Generate samples
         samples = generate_sine_wave(frequency, sample_rate, duration, amplitude)
         
         print(f"Generated {len(samples)} samples")
@@ -68,22 +88,12 @@ def test_tone(frequency=440, duration=3, amplitude=0.5, sample_rate=44100):
         print("Playing tone... (Press Ctrl+C to stop early)")
         print()
         
-        # Send samples to DAC
         start_time = time.time()
-        samples_sent = 0
         
         try:
-            for sample in samples:
-                send_to_dac(spi, sample)
-                
-                # Maintain sample rate timing
-                samples_sent += 1
-                if samples_sent % 1000 == 0:
-                    elapsed = time.time() - start_time
-                    expected = samples_sent / sample_rate
-                    if elapsed < expected:
-                        time.sleep(expected - elapsed)
-                
+            write_samples(dac, samples)
+            while dac.ring.readable():
+                time.sleep(0.01)
             elapsed = time.time() - start_time
             print(f"✓ Tone playback complete ({elapsed:.2f} seconds)")
             
@@ -91,12 +101,11 @@ def test_tone(frequency=440, duration=3, amplitude=0.5, sample_rate=44100):
             print()
             print("Stopped by user")
         
-        # Return to mid-scale (quiet)
+        # Stopping returns the DAC to mid-scale (quiet)
         print()
         print("Returning DAC to mid-scale (0V)...")
-        send_to_dac(spi, 0x8000)  # Mid-scale = 0V
-        
-        spi.close()
+        dac.close()
+        print_stats(dac)
         
         print()
         print("=" * 60)
@@ -133,44 +142,28 @@ def continuous_tone(frequency=440, amplitude=0.5, sample_rate=44100):
     print()
     
     try:
-        spi = spidev.SpiDev()
-        spi.open(10, 0)
-        spi.max_speed_hz = 1000000
-        spi.mode = 1
+        dac = open_dac(sample_rate)
         
         print("✓ SPI opened, starting tone...")
         
-        sample_period = 1.0 / sample_rate
-        start_time = time.time()
         sample_count = 0
         
         try:
             while True:
-                t = sample_count / sample_rate
-                value = math.sin(2 * math.pi * frequency * t)
-                scaled = (value * amplitude + 1.0) / 2.0
-                dac_value = int(scaled * 65535)
-                dac_value = max(0, min(65535, dac_value))
-                
-                send_to_dac(spi, dac_value)
-                
-                sample_count += 1
-                
-                # Maintain timing
-                expected_time = start_time + (sample_count * sample_period)
-                current_time = time.time()
-                if current_time < expected_time:
-                    time.sleep(expected_time - current_time)
+                block = generate_sine_wave(frequency, sample_rate, BLOCK_FRAMES / sample_rate,
+                                           amplitude, start=sample_count)
+                dac.write(block.tobytes())
+                sample_count += len(block)
                     
         except KeyboardInterrupt:
             print()
             print("Stopping...")
         
-        # Return to mid-scale
-        send_to_dac(spi, 0x8000)
-        spi.close()
+        # Stopping returns the DAC to mid-scale
+        dac.close()
         
         print("✓ Stopped, DAC set to mid-scale")
+        print_stats(dac)
         return True
         
     except Exception as e:
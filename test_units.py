@@ -2,11 +2,34 @@
 """Unit tests for IntelliVoice Device core components."""
 import unittest
 import json
+import os
+import csv
+import tempfile
+import ctypes
+import multiprocessing
 import time
 import threading
 
 # Import our modules
+import numpy as np
+
+import hal
 import main
+from dsp import (LevelMeter, LevelReading, ModelRateBridge, SpeechGate, StreamResampler, StreamingSTFT,
+                 SILENCE_DBFS)
+from inference import ModelStream, SessionManager, probe_path, variant_path
+from normalizer import DynamicsProcessor, SpectralCleaner
+from playout import AdaptivePlayout
+from scheduler import BYPASS, FULL, LIGHT, DegradationScheduler
+from conversion import ConversionStage, ConversionWorker
+from convert_offline import OfflineConverter, find_wavs, wav_memmap
+import benchmark
+from ringbuffer import AudioRingBuffer, SharedAudioRing
+from spi_audio import (ADS1256Input, DAC8532Output, dac_speed_for, decode_ads1256, encode_dac8532, spi_ioc_message,
+                       ADS_RDATAC, ADS_SDATAC, SPI_IOC_TRANSFER)
+from telemetry import LatencyTracer, MetricsWriter, STAGE_INDEX
+from quantize_model import FeatureReader, FeatureRecorder, split_probe
+from luma.oled.device import ssd1306
 
 
 class TestStateManager(unittest.TestCase):
@@ -73,6 +96,149 @@ class TestStateManager(unittest.TestCase):
         
         thread.join()
 
+    def test_snapshot_is_shared_until_changed(self):
+        """Test readers get the same immutable snapshot until a writer publishes."""
+        snap = self.state.get_snapshot()
+        self.assertIs(self.state.get_snapshot(), snap)
+        self.state.publish_levels(LevelReading(0.5, 0.6, -6.0, 0, 0.4))
+        self.state.toggle_mode()
+        new = self.state.get_snapshot()
+        self.assertIsNot(new, snap)
+        self.assertEqual(new.seq, snap.seq + 2)
+        self.assertEqual(snap["mode"], "convert")
+        self.assertEqual(snap["level_rms"], 0.0)
+        self.assertEqual(new["mode"], "bypass")
+        self.assertEqual(new.level_rms, 0.5)
+        self.assertEqual(new.get("unknown", 1), 1)
+        with self.assertRaises(KeyError):
+            new["unknown"]
+
+    def test_ptt_published_in_snapshot(self):
+        """Test PTT changes publish a new snapshot and wake the display."""
+        version = self.state.version
+        self.state.set_ptt(True)
+        self.assertTrue(self.state.get_snapshot()["ptt"])
+        self.assertEqual(self.state.version, version + 1)
+        self.state.set_ptt(True)
+        self.assertEqual(self.state.version, version + 1)
+
+    def test_degradation_published_in_snapshot(self):
+        """Test degradation level changes are published once per change."""
+        self.assertEqual(self.state.get_snapshot()["degradation"], "full")
+        version = self.state.version
+        self.state.set_degradation("bypass")
+        self.state.set_degradation("bypass")
+        self.assertEqual(self.state.get_snapshot()["degradation"], "bypass")
+        self.assertEqual(self.state.version, version + 1)
+
+    def test_snapshot_levels_consistent(self):
+        """Test concurrent readers never see a mix of two level publishes."""
+        def publish():
+            for i in range(2000):
+                value = float(i)
+                self.state.publish_levels(LevelReading(value, value, value, i, value))
+                self.state.publish_latency(value)
+
+        thread = threading.Thread(target=publish)
+        thread.start()
+        while thread.is_alive():
+            snap = self.state.get_snapshot()
+            self.assertEqual(snap.level_rms, snap.level_peak)
+            self.assertEqual(snap.level_vu, snap.clip_count)
+        thread.join()
+        self.assertEqual(self.state.latency_ms, 1999.0)
+
+    def test_control_changes_bump_version(self):
+        """Test mode and language changes notify waiters."""
+        version = self.state.version
+        self.state.toggle_mode()
+        self.state.next_language()
+        self.assertEqual(self.state.version, version + 2)
+        self.assertEqual(self.state.control_version, 2)
+        self.assertEqual(self.state.wait_for_change(version, timeout=0.01), version + 2)
+
+    def test_small_level_changes_do_not_notify(self):
+        """Test level updates below the visible step leave the version alone."""
+        version = self.state.version
+        self.state.publish_levels(LevelReading(0.001, 0.002, SILENCE_DBFS, 0, 0.001))
+        self.state.publish_latency(0.2)
+        self.assertEqual(self.state.version, version)
+        self.assertEqual(self.state.get_snapshot()["level_vu"], 0.001)
+        self.state.publish_levels(LevelReading(0.1, 0.2, -20.0, 0, 0.1))
+        self.assertEqual(self.state.version, version + 1)
+        self.state.publish_latency(25.0)
+        self.assertEqual(self.state.version, version + 2)
+        self.assertEqual(self.state.control_version, 0)
+
+    def test_wait_for_change(self):
+        """Test waiting wakes on a change and times out otherwise."""
+        version = self.state.version
+        start = time.monotonic()
+        self.assertEqual(self.state.wait_for_change(version, timeout=0.05), version)
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+        timer = threading.Timer(0.05, self.state.next_language)
+        timer.start()
+        self.assertEqual(self.state.wait_for_change(version, timeout=2.0), version + 1)
+        timer.join()
+
+    def test_stop_wakes_waiters(self):
+        """Test stop() releases a waiting consumer."""
+        timer = threading.Timer(0.05, self.state.stop)
+        timer.start()
+        start = time.monotonic()
+        self.state.wait_for_change(self.state.version, timeout=2.0)
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertFalse(self.state.running)
+        timer.join()
+
+
+class TestLevelMeter(unittest.TestCase):
+    """Test block level metering."""
+    
+    def setUp(self):
+        self.meter = LevelMeter(1024, 16000, vu_time_ms=300.0)
+    
+    def test_sine_levels(self):
+        """Test RMS, peak and dBFS of a sine just below full scale."""
+        t = np.arange(1024)
+        pcm = (np.sin(2 * np.pi * 500 * t / 16000) * 16384).astype(np.int16)
+        reading = self.meter.process(pcm)
+        self.assertAlmostEqual(reading.rms, 0.5 / np.sqrt(2), places=3)
+        self.assertAlmostEqual(reading.peak, 0.5, places=3)
+        self.assertAlmostEqual(reading.dbfs, -9.03, places=1)
+        self.assertEqual(reading.clips, 0)
+    
+    def test_silence_and_clip_accumulation(self):
+        """Test silence floor and cumulative clip counting."""
+        reading = self.meter.process(np.zeros(1024, dtype=np.int16))
+        self.assertEqual(reading.dbfs, SILENCE_DBFS)
+        clipped = np.zeros(1024, dtype=np.int16)
+        clipped[:5] = 32767
+        clipped[5:8] = -32768
+        self.meter.process(clipped)
+        reading = self.meter.process(clipped)
+        self.assertEqual(reading.clips, 16)
+    
+    def test_vu_ballistic_rises_gradually(self):
+        """Test VU follows RMS with a ~300 ms time constant."""
+        pcm = np.full(1024, 16384, dtype=np.int16)
+        first = self.meter.process(pcm).vu
+        self.assertLess(first, 0.5 * 0.25)
+        for _ in range(50):
+            reading = self.meter.process(pcm)
+        self.assertAlmostEqual(reading.vu, 0.5, places=2)
+    
+    def test_published_to_state(self):
+        """Test levels reach StateManager snapshots together."""
+        state = main.StateManager({"modes": {"default_mode": "convert", "languages": ["EN"]}})
+        state.publish_levels(self.meter.process(np.full(1024, 8192, dtype=np.int16)))
+        snap = state.get_snapshot()
+        self.assertAlmostEqual(snap["level_rms"], 0.25, places=3)
+        self.assertAlmostEqual(snap["level_peak"], 0.25, places=3)
+        self.assertIn("level_vu", snap)
+        self.assertIn("clip_count", snap)
+
 
 class TestConfigurationValidation(unittest.TestCase):
     """Test configuration validation."""
@@ -174,6 +340,1232 @@ class TestConfigurationValidation(unittest.TestCase):
         self.assertGreater(len(errors), 0)
 
 
+    def test_invalid_pipeline(self):
+        """Test with unknown audio pipeline."""
+        config = main.load_config()
+        config["audio"]["pipeline"] = "blocking"
+        errors, warnings = main.validate_config(config)
+        self.assertTrue(any("audio.pipeline" in err for err in errors))
+
+
+    def test_invalid_stft_hop(self):
+        """Test STFT hop must divide the audio block."""
+        config = main.load_config()
+        config["stft"]["hop_size"] = 100
+        errors, warnings = main.validate_config(config)
+        self.assertTrue(any("stft.hop_size" in err for err in errors))
+
+
+    def test_spi_backend_sample_rate(self):
+        """Test the SPI backend only accepts ADS1256 data rates."""
+        config = main.load_config()
+        config["audio"]["backend"] = "spi"
+        config["audio"]["pipeline"] = "threaded"
+        config["audio"]["device_channels"] = 1
+        errors, warnings = main.validate_config(config)
+        self.assertTrue(any("audio.sample_rate" in err for err in errors))
+        config["audio"]["sample_rate"] = 15000
+        errors, warnings = main.validate_config(config)
+        self.assertEqual(errors, [])
+
+    def test_invalid_refresh_rate(self):
+        """Test display refresh rate must be positive."""
+        config = main.load_config()
+        config["display"]["max_refresh_hz"] = 0
+        errors, warnings = main.validate_config(config)
+        self.assertTrue(any("display.max_refresh_hz" in err for err in errors))
+
+
+class TestAudioEngine(unittest.TestCase):
+    """Test AudioEngine processing without audio hardware."""
+    
+    def setUp(self):
+        self.config = main.load_config()
+        self.config["audio"]["pipeline"] = "duplex"
+        self.config["audio"]["device_channels"] = 1
+        self.state = main.StateManager(self.config)
+        self.engine = main.AudioEngine(self.config, self.state)
+    
+    def test_duplex_callback_passthrough(self):
+        """Test duplex callback returns a full block and keeps running."""
+        self.state.toggle_mode()  # bypass
+        frames = self.config["audio"]["frames_per_buffer"]
+        data = bytes(range(256)) * (frames * 2 // 256)
+        time_info = {"input_buffer_adc_time": 1.0, "output_buffer_dac_time": 1.08}
+        out, flag = self.engine._duplex_callback(data, frames, time_info, 0)
+        self.assertEqual(out, data)
+        self.assertEqual(flag, hal.PA_CONTINUE)
+        self.assertAlmostEqual(self.state.latency_ms, 80.0, places=3)
+    
+    def test_duplex_callback_returns_preallocated_view(self):
+        """Test converted blocks are returned as a read-only view of the preallocated output buffer."""
+        frames = self.config["audio"]["frames_per_buffer"]
+        block = (4000 * np.sin(np.arange(frames) / 3.0)).astype(np.int16)
+        out, _ = self.engine._duplex_callback(block.tobytes(), frames, {}, 0)
+        self.assertIsInstance(out, memoryview)
+        self.assertTrue(out.readonly)
+        self.assertTrue(np.shares_memory(np.frombuffer(out, dtype=np.int16), self.engine._mono))
+        self.assertEqual(out.nbytes, frames * 2)
+    
+    def test_duplex_callback_completes_on_shutdown(self):
+        """Test duplex callback stops the stream once shutdown starts."""
+        frames = self.config["audio"]["frames_per_buffer"]
+        self.state.running = False
+        _, flag = self.engine._duplex_callback(bytes(frames * 2), frames, {}, 0)
+        self.assertEqual(flag, hal.PA_COMPLETE)
+    
+    def test_stereo_card_right_channel(self):
+        """Test a stereo card is read from the right channel and played on both."""
+        self.config["audio"].update({"device_channels": 2, "input_channel": "right"})
+        engine = main.AudioEngine(self.config, main.StateManager(self.config))
+        engine.state.toggle_mode()  # bypass
+        frames = self.config["audio"]["frames_per_buffer"]
+        stereo = np.zeros((frames, 2), dtype=np.int16)
+        stereo[:, 1] = np.arange(frames)
+        pcm = engine._select_input(stereo.tobytes())
+        self.assertEqual(pcm.tolist(), list(range(frames)))
+        self.assertFalse(pcm.flags.owndata)  # strided view, not a copy
+        out, _ = engine._duplex_callback(stereo.tobytes(), frames, {}, 0)
+        played = np.frombuffer(out, dtype=np.int16).reshape(frames, 2)
+        self.assertEqual(played[:, 0].tolist(), list(range(frames)))
+        self.assertEqual(played[:, 1].tolist(), list(range(frames)))
+    
+    def test_threaded_only_options_warn_with_duplex(self):
+        """Test the shipped config is threaded and threaded-only options are flagged under duplex."""
+        shipped = main.load_config()
+        self.assertEqual(shipped["audio"]["pipeline"], "threaded")
+        _, warnings = main.validate_config(shipped)
+        self.assertFalse(any("duplex" in w for w in warnings))
+        self.config["playout"]["enabled"] = False
+        self.config["inference"]["batch_max_blocks"] = 1
+        _, warnings = main.validate_config(self.config)
+        self.assertFalse(any("duplex" in w for w in warnings))
+        self.config["playout"]["enabled"] = True
+        self.config["inference"]["batch_max_blocks"] = 4
+        _, warnings = main.validate_config(self.config)
+        self.assertIn("playout only applies to the threaded pipeline; it is ignored with audio.pipeline 'duplex'", warnings)
+        self.assertIn("inference.batch_max_blocks only applies to the threaded pipeline; "
+                      "the duplex callback converts one block at a time", warnings)
+        self.assertIsNone(main.AudioEngine(self.config, self.state).playout)
+        self.config["inference"]["isolation"] = "process"
+        errors, _ = main.validate_config(self.config)
+        self.assertIn("inference.isolation 'process' requires audio.pipeline 'threaded'", errors)
+    
+    def test_input_channel_validation(self):
+        """Test input_channel must name a channel the card has."""
+        self.config["audio"].update({"device_channels": 2, "input_channel": "center"})
+        errors, _ = main.validate_config(self.config)
+        self.assertTrue(any("audio.input_channel" in err for err in errors))
+        self.config["audio"].update({"input_channel": 1})
+        errors, _ = main.validate_config(self.config)
+        self.assertFalse(any("audio.input_channel" in err for err in errors))
+
+
+class TestAudioRingBuffer(unittest.TestCase):
+    """Test the SPSC audio ring buffer."""
+    
+    def test_fifo_order_and_timestamps(self):
+        """Test blocks come out in order with their timestamps."""
+        ring = AudioRingBuffer(4, 8)
+        for i in range(3):
+            self.assertTrue(ring.push(np.full(8, i, dtype=np.int16), float(i)))
+        for i in range(3):
+            t0, view = ring.read_view()
+            self.assertEqual(t0, float(i))
+            self.assertTrue(np.all(view == i))
+            ring.release_read()
+        self.assertIsNone(ring.read_view())
+    
+    def test_views_share_storage(self):
+        """Test slots are views into the preallocated array."""
+        ring = AudioRingBuffer(2, 4)
+        slot = ring.write_slot()
+        slot[:] = [1, 2, 3, 4]
+        ring.commit_write(0.0)
+        _, view = ring.read_view()
+        self.assertTrue(np.shares_memory(view, ring.samples))
+        self.assertEqual(view.tolist(), [1, 2, 3, 4])
+    
+    def test_overrun_and_underrun_counters(self):
+        """Test full and empty conditions are counted."""
+        ring = AudioRingBuffer(2, 4)
+        block = bytes(8)
+        self.assertTrue(ring.push(block, 0.0))
+        self.assertTrue(ring.push(block, 0.0))
+        self.assertFalse(ring.push(block, 0.0))
+        self.assertEqual(ring.overruns, 1)
+        ring.release_read()
+        ring.release_read()
+        self.assertFalse(ring.wait_readable(timeout=0.005))
+        self.assertEqual(ring.underruns, 0)  # an idle wait is not an underrun
+        self.assertFalse(ring.wait_readable(timeout=0.005, deadline=time.perf_counter_ns()))
+        self.assertEqual(ring.underruns, 1)
+    
+    def test_paced_producer_is_not_an_underrun(self):
+        """Test a consumer that empties the ring every block counts no underruns while the producer keeps pace."""
+        ring = AudioRingBuffer(4, 16)
+        period_ns = 20_000_000
+        
+        def produce():
+            for _ in range(10):
+                time.sleep(0.005)
+                ring.push(bytes(32), time.perf_counter_ns())
+        
+        producer = threading.Thread(target=produce)
+        producer.start()
+        deadline = None
+        received = 0
+        while received < 10 and ring.wait_readable(timeout=1.0, deadline=deadline):
+            ring.release_read()
+            received += 1
+            deadline = time.perf_counter_ns() + period_ns
+        producer.join()
+        self.assertEqual(received, 10)
+        self.assertEqual(ring.underruns, 0)
+        self.assertFalse(ring.wait_readable(timeout=0.005, deadline=deadline))
+        self.assertEqual(ring.underruns, 0)  # the deadline has not passed yet
+        self.assertFalse(ring.wait_readable(timeout=0.03, deadline=deadline))
+        self.assertEqual(ring.underruns, 1)  # the producer stopped: now it starves
+    
+    def test_commit_wakes_waiting_consumer(self):
+        """Test a waiting consumer wakes on commit rather than at its timeout."""
+        ring = AudioRingBuffer(2, 4)
+        timer = threading.Timer(0.02, ring.push, args=(bytes(8), 0))
+        timer.start()
+        start = time.monotonic()
+        self.assertTrue(ring.wait_readable(timeout=5.0))
+        self.assertLess(time.monotonic() - start, 1.0)
+        timer.join()
+    
+    def test_threaded_handoff(self):
+        """Test a producer and consumer thread exchange every block."""
+        ring = AudioRingBuffer(4, 16)
+        received = []
+        
+        def consume():
+            while len(received) < 200:
+                if ring.wait_readable(timeout=1.0):
+                    _, view = ring.read_view()
+                    received.append(int(view[0]))
+                    ring.release_read()
+        
+        thread = threading.Thread(target=consume)
+        thread.start()
+        i = 0
+        while i < 200:
+            slot = ring.write_slot()
+            if slot is None:
+                time.sleep(0.0005)
+                continue
+            slot[:] = i
+            ring.commit_write(time.perf_counter_ns())
+            i += 1
+        thread.join()
+        self.assertEqual(received, list(range(200)))
+
+
+def _double_blocks(ring_in, ring_out, count):
+    """Child process: read `count` blocks, write them back doubled."""
+    done = 0
+    while done < count:
+        if not ring_in.wait_readable(timeout=5.0):
+            return
+        t0, view = ring_in.read_view()
+        slot = ring_out.write_slot()
+        while slot is None:
+            time.sleep(0.001)
+            slot = ring_out.write_slot()
+        np.multiply(view, 2, out=slot)
+        ring_out.commit_write(t0)
+        ring_in.release_read()
+        done += 1
+
+
+class TestSharedAudioRing(unittest.TestCase):
+    """Test the shared-memory ring across processes."""
+    
+    def test_one_token_per_block(self):
+        """Test each block is handed over by exactly one doorbell token and one free slot."""
+        ring = SharedAudioRing(2, 4)
+        try:
+            self.assertTrue(ring.push(np.full(4, 1, dtype=np.int16), 1))
+            self.assertTrue(ring.push(np.full(4, 2, dtype=np.int16), 2))
+            self.assertFalse(ring.push(np.zeros(4, dtype=np.int16), 3))
+            self.assertEqual((ring.overruns, len(ring), ring.writable()), (1, 2, 0))
+            for expected in (1, 2):
+                self.assertTrue(ring.wait_readable(timeout=0.1))
+                t0, view = ring.read_view()
+                self.assertEqual((t0, int(view[0])), (expected, expected))
+                ring.release_read()
+            # No leftover tokens: an empty ring does not report data
+            self.assertFalse(ring.wait_readable(timeout=0.01))
+            self.assertIsNone(ring.read_view())
+            self.assertEqual(ring.writable(), 2)
+        finally:
+            ring.close()
+            ring.unlink()
+    
+    def test_cross_process_roundtrip(self):
+        """Test blocks and timestamps survive a trip through a child process."""
+        ctx = multiprocessing.get_context("spawn")
+        ring_in = SharedAudioRing(4, 32, ctx=ctx)
+        ring_out = SharedAudioRing(4, 32, ctx=ctx)
+        child = ctx.Process(target=_double_blocks, args=(ring_in, ring_out, 20))
+        child.start()
+        try:
+            sent = 0
+            received = []
+            while len(received) < 20:
+                if sent < 20 and ring_in.push(np.full(32, sent, dtype=np.int16), float(sent)):
+                    sent += 1
+                if ring_out.wait_readable(timeout=0.001):
+                    t0, view = ring_out.read_view()
+                    self.assertEqual(t0, float(len(received)))
+                    received.append(int(view[0]))
+                    ring_out.release_read()
+            self.assertEqual(received, [2 * i for i in range(20)])
+        finally:
+            child.join(timeout=5.0)
+            for ring in (ring_in, ring_out):
+                ring.close()
+                ring.unlink()
+
+
+class TestConversionWorker(unittest.TestCase):
+    """Test the process-isolated conversion worker."""
+    
+    def test_bypass_passthrough(self):
+        """Test blocks pass through the worker process unchanged in bypass."""
+        config = main.load_config()
+        config["audio"]["pipeline"] = "threaded"
+        config["inference"]["model_dir"] = tempfile.gettempdir()
+        config["inference"]["worker_cpus"] = []
+        frames = config["audio"]["frames_per_buffer"]
+        worker = ConversionWorker(config)
+        worker.update({"mode": "bypass", "language": "EN"})
+        worker.start(timeout=30.0)
+        try:
+            block = np.arange(frames, dtype=np.int16)
+            self.assertTrue(worker.ring_in.push(block, 15))
+            self.assertTrue(worker.ring_out.wait_readable(timeout=5.0))
+            t0, out = worker.ring_out.read_view()
+            self.assertEqual(t0, 15)
+            np.testing.assert_array_equal(out, block)
+        finally:
+            worker.stop()
+
+
+class TestStreamingSTFT(unittest.TestCase):
+    """Test streaming STFT analysis / overlap-add synthesis."""
+    
+    def _run(self, stft, x, spectral_fn=None):
+        size = stft.block_size
+        return np.concatenate([
+            stft.process(x[i:i + size], spectral_fn).copy()
+            for i in range(0, len(x), size)
+        ])
+    
+    def test_perfect_reconstruction(self):
+        """Test unmodified spectra reproduce the input after the STFT delay."""
+        x = np.random.default_rng(0).standard_normal(1024 * 8).astype(np.float32)
+        for window, hop in (("hann", 128), ("sqrt_hann", 256), ("hamming", 64)):
+            stft = StreamingSTFT(1024, fft_size=512, hop_size=hop, window=window)
+            y = self._run(stft, x)
+            d = stft.latency_samples
+            np.testing.assert_allclose(y[d + 512:], x[512:len(x) - d], atol=1e-5)
+    
+    def test_lookahead_context(self):
+        """Test lookahead frames are passed to the model and add latency."""
+        stft = StreamingSTFT(1024, fft_size=512, hop_size=128, lookahead=2)
+        seen = []
+        
+        def spectral_fn(spectra, n_out):
+            seen.append(spectra.shape[0])
+            return spectra[:n_out]
+        
+        x = np.random.default_rng(1).standard_normal(1024 * 6).astype(np.float32)
+        y = self._run(stft, x, spectral_fn)
+        self.assertEqual(seen[0], stft.n_frames + 2)
+        self.assertEqual(stft.latency_samples, 384 + 256)
+        d = stft.latency_samples
+        np.testing.assert_allclose(y[d + 512:], x[512:len(x) - d], atol=1e-5)
+    
+    def test_invalid_hop(self):
+        """Test block size must be a multiple of the hop."""
+        with self.assertRaises(ValueError):
+            StreamingSTFT(1000, fft_size=512, hop_size=128)
+
+
+class FakeIO:
+    def __init__(self, name, shape=None, type="tensor(float)"):
+        self.name = name
+        self.shape = shape
+        self.type = type
+
+
+class FakeSession:
+    """Stand-in for an InferenceSession that applies a constant gain mask."""
+    
+    def __init__(self, path, gain=0.5):
+        self.path = path
+        self.gain = gain
+        self.warm = False
+        self.batches = []
+    
+    def get_inputs(self):
+        return [FakeIO("magnitude")]
+    
+    def get_outputs(self):
+        return [FakeIO("mask")]
+    
+    def run(self, output_names, feeds):
+        features = feeds["magnitude"]
+        self.batches.append(features.shape[0])
+        return [np.full(features.shape, self.gain, dtype=np.float32)]
+
+
+class FakeSessionManager(SessionManager):
+    """SessionManager that builds placeholder sessions instead of ONNX ones."""
+    
+    def _create_session(self, path):
+        return FakeSession(path), path
+    
+    def warm_up(self, session):
+        session.warm = True
+
+
+class FakeBinding:
+    """Stand-in for an IOBinding: bound inputs are arrays, outputs raw pointers."""
+    
+    def __init__(self):
+        self.inputs = {}
+        self.outputs = {}
+    
+    def bind_cpu_input(self, name, array):
+        self.inputs[name] = array
+    
+    def bind_output(self, name, device_type, device_id, element_type, shape, buffer_ptr):
+        size = int(np.prod(shape)) * np.dtype(element_type).itemsize
+        buffer = (ctypes.c_char * size).from_address(buffer_ptr)
+        self.outputs[name] = np.frombuffer(buffer, dtype=element_type).reshape(shape)
+
+
+class FakeStreamingSession(FakeSession):
+    """Streaming stand-in: the state accumulates the mean of every call's features."""
+    
+    def __init__(self, path, gain=0.5, state_shape=("batch", 4)):
+        super().__init__(path, gain)
+        self.state_shape = list(state_shape)
+        self.frames = []
+    
+    def get_inputs(self):
+        return [FakeIO("magnitude"), FakeIO("state", self.state_shape)]
+    
+    def get_outputs(self):
+        return [FakeIO("mask"), FakeIO("state_out")]
+    
+    def io_binding(self):
+        return FakeBinding()
+    
+    def run_with_iobinding(self, binding):
+        features = binding.inputs["magnitude"]
+        self.frames.append(features.shape[1])
+        binding.outputs["state_out"][:] = binding.inputs["state"] + features.mean()
+        binding.outputs["mask"][:] = self.gain
+
+
+def write_fake_models(directory):
+    for name, size in (("voice_converter.onnx", 300 * 1024), ("voice_converter_ES.onnx", 600 * 1024)):
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(bytes(size))
+
+
+class TestStreamResampler(unittest.TestCase):
+    """Test the streaming polyphase resampler and the model-rate bridge."""
+    
+    def _tone(self, freq, rate, seconds=0.5, amplitude=0.5):
+        t = np.arange(int(rate * seconds)) / rate
+        return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+    
+    def test_blocks_match_one_shot(self):
+        """Test filter state and phase carry across block boundaries."""
+        x = self._tone(440, 44100)[:4096]
+        whole = StreamResampler(44100, 16000, 4096).process(x).copy()
+        chunked = StreamResampler(44100, 16000, 4096)
+        parts = [chunked.process(x[a:b]).copy() for a, b in ((0, 1000), (1000, 1001), (1001, 3000), (3000, 4096))]
+        np.testing.assert_array_equal(np.concatenate(parts), whole)
+        self.assertEqual(len(whole), -(-4096 * 160 // 441))
+    
+    def test_filter_banks_are_cached(self):
+        """Test rate pairs share one read-only polyphase bank."""
+        a = StreamResampler(48000, 16000, 512)
+        b = StreamResampler(16000, 48000, 512)
+        self.assertIs(StreamResampler(48000, 16000, 1024).bank, a.bank)
+        self.assertEqual(b.bank.shape, (3, 32))
+        self.assertFalse(a.bank.flags.writeable)
+    
+    def test_passband_and_alias_rejection(self):
+        """Test speech-band tones pass and tones above the new Nyquist are removed."""
+        resampler = StreamResampler(44100, 16000, 44100)
+        y = resampler.process(self._tone(1000, 44100, 1.0))[200:-200]
+        self.assertAlmostEqual(np.sqrt(2 * np.mean(y ** 2)), 0.5, delta=0.01)
+        resampler.reset()
+        y = resampler.process(self._tone(12000, 44100, 1.0))[200:-200]
+        self.assertLess(np.sqrt(2 * np.mean(y ** 2)), 0.005)
+    
+    def test_bridge_round_trip(self):
+        """Test the device/model rate bridge keeps its reported delay without underruns."""
+        bridge = ModelRateBridge(512, 44100, 16000, 256)
+        x = self._tone(300, 44100, 1.0)
+        calls = []
+        
+        def model(block):
+            calls.append(len(block))
+            return block
+        
+        y = np.concatenate([bridge.process(x[i:i + 512], model).copy() for i in range(0, len(x) - 511, 512)])
+        self.assertEqual(bridge.underruns, 0)
+        self.assertEqual(set(calls), {256})
+        d = round(bridge.latency_samples)
+        err = y[d + 1000:len(y)] - x[1000:len(y) - d]
+        self.assertLess(np.abs(err).max(), 0.01)
+    
+    def test_stage_runs_model_at_model_rate(self):
+        """Test the conversion stage resamples to audio.model_rate for the STFT."""
+        config = main.load_config()
+        config["audio"].update({"sample_rate": 48000, "model_rate": 16000, "frames_per_buffer": 480})
+        stage = ConversionStage(config)
+        self.assertEqual(stage.stft.block_size, 256)  # 160 rounded up to the hop
+        x = (8000 * self._tone(300, 48000)).astype(np.int16)
+        y = np.concatenate([stage.convert(x[i:i + 480], None).copy() for i in range(0, len(x) - 479, 480)])
+        d = stage.latency_samples
+        self.assertLess(np.abs(y[d + 2000:].astype(int) - x[2000:len(y) - d]).max(), 80)
+
+
+class TestSessionManager(unittest.TestCase):
+    """Test per-language session caching."""
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        write_fake_models(self.tmp.name)
+        self.config = {
+            "modes": {"languages": ["EN", "ES", "FR"]},
+            "inference": {"model_dir": self.tmp.name, "cache_max_mb": 1},
+        }
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_language_fallback_to_default_model(self):
+        """Test languages without their own model share the default one."""
+        mgr = FakeSessionManager(self.config)
+        self.assertTrue(mgr.paths["ES"].endswith("voice_converter_ES.onnx"))
+        self.assertEqual(mgr.paths["EN"], mgr.paths["FR"])
+    
+    def test_preload_warms_sessions(self):
+        """Test preload builds and warms up every distinct model."""
+        mgr = FakeSessionManager(self.config)
+        mgr.preload()
+        self.assertEqual(len(mgr.cache), 2)
+        self.assertTrue(mgr.get("ES").warm)
+        self.assertIs(mgr.get("EN"), mgr.get("FR"))
+    
+    def test_lru_memory_cap(self):
+        """Test least recently used sessions are evicted over the cap."""
+        self.config["inference"]["cache_max_mb"] = 0.8
+        mgr = FakeSessionManager(self.config)
+        mgr.load("EN")
+        mgr.load("ES")
+        self.assertEqual(list(mgr.cache), [mgr.paths["ES"]])
+        self.assertLessEqual(mgr.memory_bytes(), mgr.cache_max_bytes)
+    
+    def test_get_does_not_block_on_miss(self):
+        """Test a cache miss returns None and loads in the background."""
+        mgr = FakeSessionManager(self.config)
+        self.assertIsNone(mgr.get("ES"))
+        for _ in range(100):
+            if mgr.get("ES") is not None:
+                break
+            time.sleep(0.01)
+        self.assertIsNotNone(mgr.get("ES"))
+    
+    def test_picks_fastest_accurate_quantized_variant(self):
+        """Test load A/Bs the int8 variants and keeps the fastest one within the error limit."""
+        # fp32: slow; int8_static: 4x faster, same mask; int8_dynamic: fastest, 14 dB off
+        behaviour = {"": (0.5, 0.004), ".int8": (0.5, 0.001), ".int8dyn": (0.6, 0.0)}
+        
+        class QuantizedSessionManager(FakeSessionManager):
+            def _create_session(self, path):
+                gain, delay = behaviour[os.path.splitext(os.path.splitext(path)[0])[1]]
+                session = FakeSession(path, gain)
+                run = session.run
+                session.run = lambda names, feeds: time.sleep(delay) or run(names, feeds)
+                return session, path
+        
+        self.config["inference"].update({"quantized_variants": ["int8_static", "int8_dynamic"], "quant_probe_runs": 2})
+        model = os.path.join(self.tmp.name, "voice_converter.onnx")
+        for variant in ("int8_static", "int8_dynamic"):
+            with open(variant_path(model, variant), "wb") as f:
+                f.write(bytes(100 * 1024))
+        mgr = QuantizedSessionManager(self.config)
+        self.assertEqual(mgr.load("EN").path, model)  # no calibration features: fp32
+        np.save(probe_path(model), np.ones((4, 6, 257), dtype=np.float32))
+        mgr = QuantizedSessionManager(self.config)
+        self.assertTrue(mgr.load("EN").path.endswith("voice_converter.int8.onnx"))
+        results = {r["variant"]: r for r in mgr.evaluate(model, np.load(probe_path(model)))[0]}
+        self.assertFalse(results["int8_dynamic"]["ok"])
+        self.assertAlmostEqual(results["int8_dynamic"]["error_db"], 20 * np.log10(0.1 / 0.5), places=3)
+        self.assertLess(results["int8_static"]["ms"], results["fp32"]["ms"])
+        self.assertEqual(mgr.memory_bytes(), 100 * 1024)
+        
+        self.config["inference"]["quantized_variants"] = ["bf16"]
+        errors, _ = main.validate_config(self.config)
+        self.assertIn("inference.quantized_variants must be a list of int8_static, int8_dynamic", errors)
+
+
+class TestMicroBatching(unittest.TestCase):
+    """Test batched inference in the threaded processing stage."""
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        write_fake_models(self.tmp.name)
+        self.config = main.load_config()
+        self.config["audio"]["pipeline"] = "threaded"
+        self.config["inference"]["model_dir"] = self.tmp.name
+        self.config["inference"]["batch_max_blocks"] = 4
+        self.config["inference"]["batch_max_latency_ms"] = 0
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def _engine(self):
+        state = main.StateManager(self.config)
+        sessions = FakeSessionManager(self.config)
+        sessions.preload()
+        return main.AudioEngine(self.config, state, sessions=sessions)
+    
+    def test_batch_matches_per_block_output(self):
+        """Test one batched call produces the same audio as per-block calls."""
+        frames = self.config["audio"]["frames_per_buffer"]
+        rng = np.random.default_rng(2)
+        blocks = [rng.integers(-8000, 8000, frames).astype(np.int16) for _ in range(4)]
+        
+        batched = self._engine()
+        for block in blocks:
+            batched.ring_in.push(block, time.perf_counter_ns())
+        converter = batched.converter
+        count = converter.batch_size(batched.ring_in)
+        self.assertEqual(count, 4)
+        converter.process_batch(batched.ring_in, batched.ring_out, count, batched.sessions.get("EN"))
+        self.assertEqual(converter.session.batches, [4])
+        
+        sequential = self._engine()
+        for i, block in enumerate(blocks):
+            expected = sequential._process_block(block).copy()
+            _, got = batched.ring_out.read_view()
+            np.testing.assert_array_equal(got, expected)
+            batched.ring_out.release_read()
+    
+    def test_batch_size_follows_queue_depth(self):
+        """Test batch size adapts to how many blocks are queued."""
+        engine = self._engine()
+        frames = self.config["audio"]["frames_per_buffer"]
+        for _ in range(2):
+            engine.ring_in.push(np.zeros(frames, dtype=np.int16), time.perf_counter_ns())
+        self.assertEqual(engine.converter.batch_size(engine.ring_in), 2)
+
+    def test_batch_keeps_light_mask_language(self):
+        """Test a scheduled batch learns the light mask for its own language and is timed as every block."""
+        self.config["gating"]["enabled"] = False
+        self.config["scheduler"].update({"enabled": True, "mask_alpha": 1.0})
+        engine = self._engine()
+        converter = engine.converter
+        frames = self.config["audio"]["frames_per_buffer"]
+        block = np.random.default_rng(3).integers(-8000, 8000, frames).astype(np.int16)
+        for _ in range(3):
+            engine.ring_in.push(block, time.perf_counter_ns())
+        snap = {"mode": "convert", "language": "ES", "ptt": True}
+        self.assertEqual(converter.process_next(engine.ring_in, engine.ring_out, snap), 3)
+        self.assertEqual(converter.scheduler.blocks[FULL], 3)
+        self.assertEqual(converter._held_language, "ES")
+        np.testing.assert_allclose(converter._held_mask, 0.5)
+        converter.convert_level(block, "ES", LIGHT)
+        np.testing.assert_allclose(converter._held_mask, 0.5)  # not reset by the light chain
+
+    def test_batch_stops_at_gated_block(self):
+        """Test a batch ends before the first block the speech gate closes on."""
+        self.config["gating"].update({"enabled": True, "use_ptt": False, "hangover_ms": 0})
+        engine = self._engine()
+        frames = self.config["audio"]["frames_per_buffer"]
+        voice = (8000 * np.sin(2 * np.pi * 200 * np.arange(frames) / 16000)).astype(np.int16)
+        silence = np.zeros(frames, dtype=np.int16)
+        for block in (voice, voice, silence, voice):
+            engine.ring_in.push(block, time.perf_counter_ns())
+        converter = engine.converter
+        snap = {"mode": "convert", "language": "EN", "ptt": False}
+        counts = []
+        while engine.ring_in.readable():
+            counts.append(converter.process_next(engine.ring_in, engine.ring_out, snap))
+            engine.ring_in.release_read(counts[-1])
+        self.assertEqual(counts, [2, 1, 1])
+        self.assertEqual(engine.sessions.get("EN").batches, [2, 1])
+        self.assertEqual(converter.gate.blocks_gated, 1)
+        self.assertEqual(engine.ring_out.readable(), 4)
+
+
+class TestStreamingModel(unittest.TestCase):
+    """Test stateful models run through bound, reused state buffers."""
+    
+    def test_state_carried_between_calls(self):
+        """Test state outputs feed the next call without copies or new buffers."""
+        session = FakeStreamingSession("model.onnx")
+        features = np.ones((1, 8, 257), dtype=np.float32)
+        stream = ModelStream(session, features)
+        buffers = [id(a) for pair in stream.states for a in pair]
+        for _ in range(3):
+            mask = stream.run()
+        self.assertIs(mask, stream.mask)
+        np.testing.assert_array_equal(mask, 0.5)
+        np.testing.assert_array_equal(stream.states[0][stream.turn], 3.0)  # the next call's input
+        self.assertEqual([id(a) for pair in stream.states for a in pair], buffers)
+        stream.reset()
+        stream.run()
+        np.testing.assert_array_equal(stream.states[0][stream.turn], 1.0)
+        with self.assertRaises(ValueError):
+            ModelStream(FakeStreamingSession("model.onnx", state_shape=("batch", "hidden")), features)
+    
+    def test_calibration_carries_state(self):
+        """Test calibration records contiguous runs of new frames and carries the fp32 state through each run."""
+        recorder = FeatureRecorder(8, streaming=True, run_blocks=2)
+        bound = np.zeros((1, 8, 257), dtype=np.float32)
+        recording = recorder.stream(recorder.session, bound)
+        for value in (1.0, 2.0, 3.0, None, 4.0, 5.0):
+            if value is None:
+                recording.reset()
+                continue
+            bound.fill(value)
+            np.testing.assert_array_equal(recording.run(), 1.0)
+        runs = [np.stack(run) for run in recorder.runs]
+        self.assertEqual([run[:, 0, 0].tolist() for run in runs], [[1.0, 2.0], [3.0], [4.0, 5.0]])
+        self.assertEqual(runs[0].shape, (2, 8, 257))
+        self.assertIsNone(FeatureRecorder(8).stream(recorder.session, bound))
+        calibration, starts, probe = split_probe(runs, 2)
+        self.assertEqual(probe[:, 0, 0].tolist(), [1.0, 2.0])
+        self.assertEqual(calibration[:, 0, 0].tolist(), [3.0, 4.0, 5.0])
+        self.assertEqual(list(starts), [0, 1])
+        stream = ModelStream(FakeStreamingSession("model.onnx"), np.zeros_like(bound))
+        reader = FeatureReader("magnitude", calibration, stream, starts)
+        feeds = list(iter(reader.get_next, None))
+        self.assertEqual([feed["magnitude"].shape for feed in feeds], [(1, 8, 257)] * 3)
+        self.assertEqual([float(feed["state"][0, 0]) for feed in feeds], [0.0, 0.0, 4.0])
+    
+    def test_calibration_decimates_whole_runs(self):
+        """Test a full recorder drops whole runs, so every kept run is still consecutive audio."""
+        recorder = FeatureRecorder(4, streaming=True, run_blocks=3)
+        for value in range(60):
+            recorder.record(np.full((8, 257), value, dtype=np.float32))
+        self.assertGreater(recorder.stride, 1)
+        for run in recorder.runs:
+            values = [block[0, 0] for block in run]
+            self.assertEqual(values, list(np.arange(values[0], values[0] + 3)))
+            self.assertEqual(values[0] % (3 * recorder.stride), 0)
+    
+    def test_stage_feeds_only_new_frames(self):
+        """Test the stage skips batching and lookahead for streaming models and resets their state."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        write_fake_models(tmp.name)
+        config = main.load_config()
+        config["inference"].update({"model_dir": tmp.name, "batch_max_blocks": 4, "batch_max_latency_ms": 0})
+        config["stft"]["lookahead"] = 2
+        
+        class StreamingSessionManager(FakeSessionManager):
+            def _create_session(self, path):
+                return FakeStreamingSession(path), path
+        
+        sessions = StreamingSessionManager(config)
+        sessions.preload()
+        stage = ConversionStage(config, sessions)
+        frames = config["audio"]["frames_per_buffer"]
+        ring_in = AudioRingBuffer(8, frames)
+        ring_out = AudioRingBuffer(8, frames)
+        block = (4000 * np.sin(np.arange(frames) / 5.0)).astype(np.int16)
+        for _ in range(4):
+            ring_in.push(block, time.perf_counter_ns())
+        snap = {"mode": "convert", "language": "EN", "ptt": True}
+        while ring_in.readable():
+            ring_in.release_read(stage.process_next(ring_in, ring_out, snap))
+        session = sessions.get("EN")
+        self.assertEqual(session.frames, [stage.stft.n_frames] * 4)
+        self.assertEqual(stage.batch_sizes[1], 4)
+        self.assertTrue(np.any(stage._stream.states[0][stage._stream.turn]))
+        stage.reset()
+        self.assertFalse(np.any(stage._stream.states[0][stage._stream.turn]))
+
+
+class TestSpeechGate(unittest.TestCase):
+    """Test VAD / PTT gating of the conversion stage."""
+    
+    def setUp(self):
+        self.frames = 256
+        t = np.arange(self.frames) / 16000
+        self.voice = (8000 * np.sin(2 * np.pi * 200 * t)).astype(np.int16)
+        self.hiss = np.random.default_rng(5).integers(-1000, 1000, self.frames).astype(np.int16)
+        self.silence = np.zeros(self.frames, dtype=np.int16)
+    
+    def _gate(self, **kwargs):
+        return SpeechGate(self.frames, 16000, hangover_ms=0, **kwargs)
+    
+    def test_vad_separates_voice_from_hiss(self):
+        """Test voiced audio opens the gate while silence and hiss do not."""
+        gate = self._gate()
+        self.assertTrue(gate.update(self.voice))
+        self.assertFalse(gate.update(self.silence))
+        self.assertFalse(gate.update(self.hiss))
+        self.assertGreater(gate.zcr, 0.35)
+        self.assertEqual((gate.blocks_open, gate.blocks_gated), (1, 2))
+    
+    def test_hangover_keeps_gate_open(self):
+        """Test the gate stays open for hangover_ms after speech."""
+        gate = SpeechGate(self.frames, 16000, hangover_ms=40)  # 2.5 blocks
+        gate.update(self.voice)
+        self.assertEqual([gate.update(self.silence) for _ in range(4)], [True, True, True, False])
+    
+    def test_ptt_required(self):
+        """Test with use_ptt the model only runs while PTT is keyed."""
+        gate = self._gate(use_ptt=True)
+        self.assertFalse(gate.update(self.voice, ptt=False))
+        self.assertTrue(gate.update(self.voice, ptt=True))
+        self.assertFalse(gate.update(self.silence, ptt=True))
+    
+    def test_fill_outputs(self):
+        """Test silence, comfort noise and passthrough fills."""
+        self.assertFalse(self._gate(fill="silence").fill(self.voice).any())
+        self.assertIs(self._gate(fill="passthrough").fill(self.voice), self.voice)
+        noise = self._gate(comfort_noise_dbfs=-60.0).fill(self.voice).astype(np.float64)
+        dbfs = 10 * np.log10(np.mean(noise ** 2) / 32768.0 ** 2)
+        self.assertAlmostEqual(dbfs, -60.0, delta=1.5)
+        with self.assertRaises(ValueError):
+            self._gate(fill="bogus")
+    
+    def test_stage_skips_model_when_gated(self):
+        """Test the processing stage runs no inference on gated blocks."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        write_fake_models(tmp.name)
+        config = main.load_config()
+        config["inference"]["model_dir"] = tmp.name
+        config["audio"]["frames_per_buffer"] = self.frames
+        config["gating"].update({"enabled": True, "use_ptt": False, "hangover_ms": 0})
+        sessions = FakeSessionManager(config)
+        sessions.preload()
+        stage = ConversionStage(config, sessions)
+        ring_in = AudioRingBuffer(4, self.frames)
+        ring_out = AudioRingBuffer(4, self.frames)
+        snap = {"mode": "convert", "language": "EN", "ptt": False}
+        for block in (self.silence, self.voice, self.hiss):
+            ring_in.push(block, time.perf_counter_ns())
+            ring_in.release_read(stage.process_next(ring_in, ring_out, snap))
+        self.assertEqual(sum(sessions.get("EN").batches), 1)
+        self.assertEqual(stage.gate.blocks_gated, 2)
+        self.assertEqual(ring_out.readable(), 3)
+
+
+class TestOfflineConversion(unittest.TestCase):
+    """Test faster-than-real-time conversion of WAV files."""
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        write_fake_models(self.tmp.name)
+        self.config = main.load_config()
+        self.config["inference"]["model_dir"] = self.tmp.name
+        self.src = os.path.join(self.tmp.name, "in", "clip.wav")
+        os.makedirs(os.path.dirname(self.src))
+        rng = np.random.default_rng(4)
+        self.samples = rng.integers(-8000, 8000, 5000).astype(np.int16)
+        write_wav(self.src, self.samples)
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def _convert(self, mode, sessions=None):
+        dst = os.path.join(self.tmp.name, "out", f"{mode}.wav")
+        result = OfflineConverter(self.config, "EN", mode, sessions=sessions).convert_file(self.src, dst)
+        _, out = wav_memmap(dst)
+        return result, out[:, 0]
+    
+    def test_memmap_reads_samples(self):
+        """Test WAV samples are memory-mapped with the right layout."""
+        rate, data = wav_memmap(self.src)
+        self.assertEqual(rate, 16000)
+        self.assertIsInstance(data, np.memmap)
+        self.assertEqual(data[:, 0].tolist(), self.samples.tolist())
+    
+    def test_output_is_aligned(self):
+        """Test STFT latency is trimmed so output lines up with the input."""
+        for mode in ("bypass", "convert"):
+            result, out = self._convert(mode)  # no session: STFT round trip
+            self.assertEqual(len(out), len(self.samples))
+            self.assertLessEqual(np.abs(out.astype(int) - self.samples).max(), 1)
+            self.assertAlmostEqual(result["duration_s"], 5000 / 16000)
+            self.assertGreater(result["rtf"], 0)
+    
+    def test_model_is_batched(self):
+        """Test the offline path uses the batched model call."""
+        sessions = FakeSessionManager(self.config)
+        result, out = self._convert("convert", sessions)
+        session = sessions.get("EN")
+        self.assertGreater(max(session.batches), 1)
+        self.assertLess(np.abs(out).max(), np.abs(self.samples).max())
+    
+    def test_find_wavs(self):
+        """Test directories are searched recursively for WAV files."""
+        found = find_wavs([self.tmp.name])
+        self.assertEqual(found, [(self.src, os.path.join("in", "clip.wav"))])
+
+
+class TestAdaptivePlayout(unittest.TestCase):
+    """Test the adaptive output jitter buffer."""
+    
+    def setUp(self):
+        self.frames = 256
+        t = np.arange(self.frames * 200) / 16000
+        self.tone = (8000 * np.sin(2 * np.pi * 180 * t)).astype(np.int16)
+        self.block_ns = int(self.frames / 16000 * 1e9)
+    
+    def _push(self, playout, k, delay_ms):
+        t0 = k * self.block_ns
+        playout.push(self.tone[k * self.frames:(k + 1) * self.frames], t0, t0 + int(delay_ms * 1e6))
+    
+    def test_buffers_to_target_then_plays_full_blocks(self):
+        """Test playback starts at the target depth with fixed-size blocks."""
+        playout = AdaptivePlayout(self.frames, 16000, initial_ms=20.0)  # 256 + 352 samples
+        for k in range(2):
+            self._push(playout, k, 1.0)
+        self.assertIsNone(playout.next_block())
+        self._push(playout, 2, 1.0)
+        block, t_capture, _ = playout.next_block()
+        self.assertEqual(len(block), self.frames)
+        self.assertLessEqual(t_capture, self.block_ns)
+    
+    def test_target_follows_jitter(self):
+        """Test processing spikes raise the target and calm periods shrink the buffer."""
+        playout = AdaptivePlayout(self.frames, 16000, initial_ms=0.0, margin_ms=1.0)
+        for k in range(20):
+            self._push(playout, k, 2.0)
+        calm = playout.target
+        self._push(playout, 20, 40.0)
+        self.assertGreater(playout.target, calm + 16000 * 0.03)
+        
+        # Drain at one block per arrival: the excess depth is dropped again
+        playout = AdaptivePlayout(self.frames, 16000, initial_ms=60.0)
+        for k in range(6):
+            self._push(playout, k, 2.0)
+        depths = []
+        for k in range(6, 150):
+            self._push(playout, k, 2.0)
+            self.assertIsNotNone(playout.next_block())
+            depths.append(playout.depth)
+        self.assertGreater(playout.dropped, 0)
+        self.assertLess(depths[-1], depths[0])
+        self.assertEqual(playout.underruns, 0)
+    
+    def test_splices_are_smooth(self):
+        """Test dropped and repeated periods leave no discontinuity."""
+        playout = AdaptivePlayout(self.frames, 16000, initial_ms=30.0)
+        out = []
+        for k in range(4):
+            self._push(playout, k, 1.0)
+        k = 4
+        for step in range(4, 120):
+            # Bursty arrivals (nothing, then two blocks) force drops and inserts
+            for _ in range(0 if step % 10 == 0 else 2 if step % 10 == 1 else 1):
+                self._push(playout, k, 1.0)
+                k += 1
+            block = playout.next_block()
+            if block is not None:
+                out.append(block[0].copy())
+        y = np.concatenate(out).astype(float)
+        self.assertGreater(playout.dropped + playout.inserted, 0)
+        # A clean 180 Hz tone never steps by more than ~2x its steepest slope
+        self.assertLess(np.abs(np.diff(y)).max(), 2 * 8000 * 2 * np.pi * 180 / 16000)
+    
+    def test_underrun_rebuffers(self):
+        """Test an empty buffer reports an underrun and waits for the target again."""
+        playout = AdaptivePlayout(self.frames, 16000, initial_ms=0.0, margin_ms=0.0)
+        self._push(playout, 0, 1.0)
+        self.assertIsNotNone(playout.next_block())
+        self.assertIsNone(playout.next_block())
+        self.assertEqual(playout.underruns, 1)
+        self.assertTrue(playout.buffering)
+
+
+class TestDegradationScheduler(unittest.TestCase):
+    """Test deadline-aware degradation of the conversion stage."""
+    
+    MS = 1000000
+    
+    def _run(self, sched, cost_ms, t0=0):
+        # One block captured at t0, processed immediately
+        level = sched.begin(t0, t0)
+        sched.end(t0 + int(cost_ms * self.MS))
+        return level
+    
+    def test_escalates_when_deadline_would_be_missed(self):
+        """Test a level too slow for the remaining budget is skipped."""
+        sched = DegradationScheduler(16 * self.MS, 32 * self.MS, recover_blocks=4)
+        self.assertEqual(self._run(sched, 5.0), FULL)
+        self.assertEqual(self._run(sched, 60.0), FULL)
+        self.assertEqual(self._run(sched, 1.0), LIGHT)
+        self.assertEqual(sched.misses, 1)
+        # A backed-up queue leaves too little time even for the light level
+        self.assertEqual(sched.begin(31 * self.MS, 0), BYPASS)
+    
+    def test_recovery_probes_with_backoff(self):
+        """Test recovery steps back down and backs off after a failed probe."""
+        sched = DegradationScheduler(16 * self.MS, 32 * self.MS, recover_blocks=4)
+        self._run(sched, 40.0)
+        self.assertEqual([self._run(sched, 1.0) for _ in range(4)], [LIGHT] * 4)
+        self.assertEqual(self._run(sched, 40.0), FULL)  # the probe is still too slow
+        self.assertEqual(self._run(sched, 1.0), LIGHT)
+        self.assertEqual(sched.backoff, 2)
+        self.assertEqual([self._run(sched, 1.0) for _ in range(7)], [LIGHT] * 7)
+        self.assertEqual(sched.level, FULL)
+        for _ in range(4):
+            self.assertEqual(self._run(sched, 5.0), FULL)
+        self.assertEqual(sched.backoff, 1)
+        self.assertEqual(sched.recoveries, 2)
+    
+    def test_stage_crossfades_to_delayed_bypass(self):
+        """Test bypass is the delayed dry input, reached and left without gaps."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        write_fake_models(tmp.name)
+        config = main.load_config()
+        config["inference"]["model_dir"] = tmp.name
+        config["audio"]["frames_per_buffer"] = 256
+        config["scheduler"].update({"enabled": True, "crossfade_ms": 10.0, "mask_alpha": 1.0})
+        sessions = FakeSessionManager(config)
+        sessions.preload()
+        stage = ConversionStage(config, sessions)
+        t = np.arange(256 * 40) / 16000
+        x = (8000 * np.sin(2 * np.pi * 180 * t)).astype(np.int16)
+        plan = [FULL] * 10 + [BYPASS] * 10 + [LIGHT] * 20
+        y = np.concatenate([stage.convert_level(x[i * 256:(i + 1) * 256], "EN", level).copy()
+                            for i, level in enumerate(plan)]).astype(float)
+        d = stage.latency_samples
+        # Bypass settles on the input delayed by the conversion latency
+        np.testing.assert_array_equal(y[19 * 256:20 * 256], x[19 * 256 - d:20 * 256 - d])
+        # The light chain holds the full model's mask (gain 0.5 here)
+        np.testing.assert_allclose(y[-256:], 0.5 * x[-256 - d:-d], atol=60)
+        # No gaps or clicks anywhere after the STFT has filled
+        self.assertLess(np.abs(np.diff(y[d + 1:])).max(), 1.5 * 8000 * 2 * np.pi * 180 / 16000)
+        rms = np.sqrt((y[2 * 256:].reshape(-1, 256) ** 2).mean(axis=1))
+        self.assertGreater(rms.min(), 0.4 * 8000 / np.sqrt(2))
+
+
+class TestVoiceNormalizer(unittest.TestCase):
+    """Test the pure-NumPy voice normalization engine."""
+    
+    def setUp(self):
+        self.t = np.arange(32768) / 16000
+        self.rng = np.random.default_rng(7)
+    
+    def _clean(self, x, **kwargs):
+        stft = StreamingSTFT(1024, fft_size=512, hop_size=128)
+        cleaner = SpectralCleaner(stft.n_frames, 512, 128, 16000, **kwargs)
+        out = np.zeros((stft.n_frames, stft.n_bins), dtype=np.complex64)
+        fn = lambda spectra, n: cleaner.process(spectra, n, out)
+        return np.concatenate([stft.process(x[i:i + 1024], fn).copy() for i in range(0, len(x), 1024)])
+    
+    def _band_rms(self, y, f0):
+        spectrum = np.abs(np.fft.rfft(y[-16384:] * np.hanning(16384)))
+        k = int(round(f0 * 16384 / 16000))
+        return spectrum[k - 3:k + 4].max()
+    
+    def test_highpass_removes_hum(self):
+        """Test mains hum is removed while the voice band passes."""
+        x = (0.3 * np.sin(2 * np.pi * 50 * self.t) + 0.3 * np.sin(2 * np.pi * 1000 * self.t)).astype(np.float32)
+        y = self._clean(x, noise_reduction_db=0.0, deess_threshold=1.0)
+        self.assertLess(self._band_rms(y, 50), 0.15 * self._band_rms(x, 50))
+        self.assertGreater(self._band_rms(y, 1000), 0.9 * self._band_rms(x, 1000))
+    
+    def test_noise_suppression_and_deesser(self):
+        """Test steady noise is pulled down and a dominant sibilant band is cut."""
+        noise = (0.01 * self.rng.standard_normal(len(self.t))).astype(np.float32)
+        y = self._clean(noise, deess_threshold=1.0)
+        reduction = 20 * np.log10(np.std(y[-8000:]) / np.std(noise[-8000:]))
+        self.assertLess(reduction, -9.0)
+        self.assertGreaterEqual(reduction, -12.5)
+        hiss = (0.1 * np.sin(2 * np.pi * 6000 * self.t) + 0.02 * np.sin(2 * np.pi * 500 * self.t)).astype(np.float32)
+        y = self._clean(hiss, noise_reduction_db=0.0, deess_threshold=0.1, deess_max_db=8.0)  # capped
+        cut = 20 * np.log10(self._band_rms(y, 6000) / self._band_rms(hiss, 6000))
+        self.assertAlmostEqual(cut, -8.0, delta=0.5)
+        self.assertGreater(self._band_rms(y, 500), 0.9 * self._band_rms(hiss, 500))
+    
+    def test_dynamics_levels_and_limits(self):
+        """Test the AGC lifts quiet speech, the gate closes on silence and peaks stay under the ceiling."""
+        dynamics = DynamicsProcessor(1024, 16000, agc_target_dbfs=-20.0, agc_time_ms=200.0)
+        quiet = (0.02 * np.sin(2 * np.pi * 200 * self.t)).astype(np.float32)  # -37 dBFS
+        y = np.concatenate([dynamics.process(quiet[i:i + 1024].copy()) for i in range(0, 16384, 1024)])
+        self.assertAlmostEqual(20 * np.log10(np.std(y[-2048:]) / np.std(quiet[-2048:])), 12.0, delta=0.5)
+        self.assertTrue(dynamics.gate_open)
+        for _ in range(20):
+            silent = dynamics.process(np.full(1024, 1e-4, dtype=np.float32))
+        self.assertFalse(dynamics.gate_open)
+        self.assertLess(np.abs(silent).max(), 1e-4 * dynamics.gate_floor * 4.0 * 1.01)
+        loud = np.clip(self.rng.standard_normal(16384) * 0.8, -1.0, 1.0).astype(np.float32)
+        y = np.concatenate([dynamics.process(loud[i:i + 1024].copy()) for i in range(0, 16384, 1024)])
+        self.assertLessEqual(np.abs(y).max(), dynamics.ceiling)
+    
+    def test_stage_dsp_engine_needs_no_model(self):
+        """Test CONVERT mode with the dsp engine runs without loading a model."""
+        config = main.load_config()
+        config["inference"]["engine"] = "dsp"
+        config["gating"]["enabled"] = False
+        frames = config["audio"]["frames_per_buffer"]
+        sessions = FakeSessionManager(config)
+        stage = ConversionStage(config, sessions)
+        stage.preload()
+        voice = (8000 * np.sin(2 * np.pi * 300 * np.arange(frames) / 16000)).astype(np.int16)
+        snap = {"mode": "convert", "language": "EN", "ptt": True}
+        out = [stage.process_block(voice, snap).copy() for _ in range(4)]
+        self.assertGreater(np.abs(out[-1]).max(), 1000)
+        self.assertEqual(sessions.cache, {})
+        self.assertEqual(sessions.loading, set())
+        config["stft"]["enabled"] = False
+        errors, _ = main.validate_config(config)
+        self.assertIn("inference.engine 'dsp' requires the STFT stage (stft.enabled)", errors)
+    
+    def test_dsp_light_level_skips_cleaner(self):
+        """Test the light level of the dsp engine keeps the dynamics but skips the spectral cleaner."""
+        config = main.load_config()
+        config["inference"]["engine"] = "dsp"
+        config["scheduler"]["enabled"] = True
+        stage = ConversionStage(config, FakeSessionManager(config))
+        frames = config["audio"]["frames_per_buffer"]
+        calls = {"cleaner": 0, "dynamics": 0}
+        
+        def counted(name, fn):
+            def wrapper(*args):
+                calls[name] += 1
+                return fn(*args)
+            return wrapper
+        
+        stage.cleaner.process = counted("cleaner", stage.cleaner.process)
+        stage.dynamics.process = counted("dynamics", stage.dynamics.process)
+        voice = (8000 * np.sin(2 * np.pi * 300 * np.arange(frames) / 16000)).astype(np.int16)
+        stage.convert_level(voice, "EN", FULL)
+        cleaned = calls["cleaner"]
+        self.assertGreater(cleaned, 0)
+        for _ in range(4):
+            stage.convert_level(voice, "EN", LIGHT)
+        self.assertEqual(calls["cleaner"], cleaned)
+        self.assertEqual(calls["dynamics"], 5)
+
+
+class TestLatencyTracer(unittest.TestCase):
+    """Test per-stage latency histograms."""
+    
+    def test_percentiles(self):
+        """Test percentiles land within one bucket of the true values."""
+        tracer = LatencyTracer()
+        stage = STAGE_INDEX["inference"]
+        for ms in range(1, 101):
+            tracer.record(stage, ms * 1_000_000)
+        stats = tracer.percentiles(stage)
+        self.assertEqual(stats["count"], 100)
+        self.assertAlmostEqual(stats["p50"], 50, delta=5)
+        self.assertAlmostEqual(stats["p95"], 95, delta=9.5)
+        self.assertEqual(stats["max"], 100.0)
+        self.assertLessEqual(stats["p99"], stats["max"])
+    
+    def test_summary_only_lists_recorded_stages(self):
+        """Test summary skips empty stages and is exposed by StateManager."""
+        state = main.StateManager({"modes": {"default_mode": "convert", "languages": ["EN"]}})
+        state.tracer.record(STAGE_INDEX["total"], 42_000_000)
+        stages = state.get_snapshot()["latency_stages"]
+        self.assertEqual(list(stages), ["total"])
+        self.assertEqual(stages["total"]["max"], 42.0)
+    
+    def test_processor_records_stages(self):
+        """Test the processing stage stamps queue and processing times."""
+        config = main.load_config()
+        config["audio"]["pipeline"] = "threaded"
+        state = main.StateManager(config)
+        engine = main.AudioEngine(config, state)
+        frames = config["audio"]["frames_per_buffer"]
+        engine.ring_in.push(np.zeros(frames, dtype=np.int16), time.perf_counter_ns())
+        count = engine.converter.process_next(engine.ring_in, engine.ring_out, state.get_snapshot())
+        engine.ring_in.release_read(count)
+        self.assertEqual(state.tracer.percentiles(STAGE_INDEX["queue_in"])["count"], 1)
+        self.assertEqual(state.tracer.percentiles(STAGE_INDEX["pre"])["count"], 1)
+        self.assertGreater(engine.ring_out.commit_time(), 0)
+
+
+class TestMetricsWriter(unittest.TestCase):
+    """Test the batched metrics CSV writer."""
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "metrics.csv")
+        self.config = {
+            "modes": {"default_mode": "convert", "languages": ["EN"]},
+            "logging": {"metrics_csv": self.path, "metrics_max_mb": 0.001, "metrics_backups": 2},
+        }
+        self.state = main.StateManager(self.config)
+        self.rings = {"in": AudioRingBuffer(4, 16), "out": AudioRingBuffer(4, 16)}
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_rows_buffered_until_flush(self):
+        """Test samples stay in memory until a batched flush."""
+        writer = MetricsWriter(self.config, self.state, rings=self.rings)
+        for _ in range(3):
+            writer.sample()
+        self.assertFalse(os.path.exists(self.path))
+        writer.flush()
+        with open(self.path, newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], MetricsWriter.COLUMNS)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][1], "convert")
+        self.assertEqual(writer.rows, [])
+    
+    def test_size_based_rotation(self):
+        """Test the CSV rotates once it exceeds the size limit."""
+        writer = MetricsWriter(self.config, self.state, rings=self.rings)
+        for _ in range(6):
+            for _ in range(10):
+                writer.sample()
+            writer.flush()
+        self.assertTrue(os.path.exists(self.path + ".1"))
+        self.assertTrue(os.path.exists(self.path + ".2"))
+        self.assertFalse(os.path.exists(self.path + ".3"))
+    
+    def test_unwritable_path_keeps_rows(self):
+        """Test rows are retained (bounded) when the disk is unavailable."""
+        self.config["logging"]["metrics_csv"] = os.path.join(self.tmp.name, "missing", "m.csv")
+        self.config["logging"]["metrics_max_buffered_rows"] = 5
+        writer = MetricsWriter(self.config, self.state, rings=self.rings)
+        for _ in range(8):
+            writer.sample()
+        writer.flush()
+        self.assertEqual(len(writer.rows), 5)
+        self.assertEqual(writer.dropped_rows, 3)
+    
+    def test_log_line_fields_match_columns(self):
+        """Test the flush log line reads its fields by column name."""
+        writer = MetricsWriter(self.config, self.state, rings=self.rings)
+        writer.sample()
+        writer.rows[-1] = [f"<{column}>" for column in MetricsWriter.COLUMNS]
+        with self.assertLogs(level="INFO") as logs:
+            writer.flush()
+        self.assertIn("Mode=<mode> | Latency=<latency_ms>ms | Temp=<cpu_temp_c>°C | Lang=<language>",
+                      logs.output[-1])
+
+
 class TestConfigurationLoading(unittest.TestCase):
     """Test configuration loading."""
     
@@ -186,6 +1578,367 @@ class TestConfigurationLoading(unittest.TestCase):
         self.assertIn("display", config)
 
 
+class CaptureSerial:
+    """Serial interface stand-in that records what luma sends to the panel."""
+    
+    def __init__(self):
+        self.commands = []
+        self.data_bytes = []
+    
+    def command(self, *cmd):
+        self.commands.append(cmd)
+    
+    def data(self, data):
+        self.data_bytes.extend(data)
+
+
+class TestOLEDDisplay(unittest.TestCase):
+    """Test dirty-region OLED rendering."""
+    
+    LINES = ["Mode: convert", "Lang: EN", "VU: 0.100", "Lat: 5.0 ms"]
+    
+    def setUp(self):
+        self.serial = CaptureSerial()
+        self.device = ssd1306(self.serial)
+        self.display = main.OLEDDisplay(main.load_config(), device=self.device)
+        self.serial.data_bytes = []
+    
+    def test_first_frame_matches_full_push(self):
+        """Test the page packing matches luma's own full-frame output."""
+        self.display.draw_text(self.LINES)
+        partial = list(self.serial.data_bytes)
+        self.serial.data_bytes = []
+        self.device.display(self.display.image)
+        self.assertEqual(partial, self.serial.data_bytes)
+    
+    def test_unchanged_frame_is_skipped(self):
+        """Test identical frames send nothing to the panel."""
+        self.display.draw_text(self.LINES)
+        sent = self.display.bytes_sent
+        self.display.draw_text(list(self.LINES))
+        self.assertEqual(self.display.bytes_sent, sent)
+        self.assertEqual(self.display.frames_skipped, 1)
+    
+    def test_only_changed_region_is_sent(self):
+        """Test a one-character change sends a few columns, not the frame."""
+        self.display.draw_text(self.LINES)
+        sent = self.display.bytes_sent
+        self.display.draw_text(["Mode: convert", "Lang: EN", "VU: 0.200", "Lat: 5.0 ms"])
+        self.assertGreater(self.display.bytes_sent, sent)
+        self.assertLess(self.display.bytes_sent - sent, 64)
+
+
+class FakeSPI:
+    """spidev stand-in: records writes and returns queued 24-bit ADC codes."""
+    
+    def __init__(self, codes=()):
+        self.codes = list(codes)
+        self.writes = []
+        self.frames = []
+    
+    def writebytes(self, data):
+        self.writes.append(list(data))
+    
+    def writebytes2(self, data):
+        self.frames.append(bytes(data))
+    
+    def readbytes(self, n):
+        code = self.codes.pop(0) if self.codes else 0
+        return [(code >> 16) & 0xFF, (code >> 8) & 0xFF, code & 0xFF]
+    
+    def close(self):
+        pass
+
+
+class TestSPIAudio(unittest.TestCase):
+    """Test the ADS1256/DAC8532 backend against a fake SPI bus."""
+    
+    def setUp(self):
+        self.config = main.load_config()
+        self.config["audio"]["sample_rate"] = 15000
+        self.config["audio"]["frames_per_buffer"] = 64
+    
+    def test_decode_and_encode(self):
+        """Test 24-bit ADC decoding and offset-binary DAC encoding."""
+        raw = np.array([[0x7F, 0xFF, 0x12], [0x80, 0x00, 0x00], [0xFF, 0xFF, 0xFF]], dtype=np.uint8)
+        pcm = decode_ads1256(raw, np.zeros(3, dtype=np.int16))
+        self.assertEqual(pcm.tolist(), [32767, -32768, -1])
+        frames = encode_dac8532(np.array([0, -32768, 32767], dtype=np.int16),
+                                np.zeros((3, 3), dtype=np.uint8), command=0x10)
+        self.assertEqual(frames.tolist(), [[0x10, 0x80, 0x00], [0x10, 0x00, 0x00], [0x10, 0xFF, 0xFF]])
+    
+    def test_continuous_capture(self):
+        """Test RDATAC capture fills blocks from successive conversions."""
+        codes = [(i * 256) << 8 for i in range(128)]
+        spi = FakeSPI(codes)
+        adc = ADS1256Input(self.config, spi=spi, drdy=lambda: True)
+        adc.rt_priority = 0
+        adc.start_stream()
+        block = adc.read(64)
+        self.assertEqual(block[:4].tolist(), [0, 256, 512, 768])
+        adc.stop_stream()
+        commands = [w[0] for w in spi.writes]
+        self.assertIn(ADS_RDATAC, commands)
+        self.assertEqual(commands[-1], ADS_SDATAC)
+    
+    def test_batched_capture(self):
+        """Test conversions are read as SPI messages straight into the preallocated buffer."""
+        self.config["spi"]["adc_batch_frames"] = 32
+        spi = FakeSPI()
+        spi.fileno = lambda: 3
+        adc = ADS1256Input(self.config, spi=spi, drdy=lambda: True)
+        adc.rt_priority = 0
+        messages = []
+
+        def ioctl(fd, request, buf):
+            xfers = np.frombuffer(bytes(buf), dtype=SPI_IOC_TRANSFER)
+            rows = (xfers["rx_buf"].astype(np.int64) - adc._raw.ctypes.data) // 3
+            adc._raw[rows, 0] = rows  # code (row << 16) decodes to row << 8
+            messages.append((request, xfers))
+
+        adc._ioctl = ioctl
+        adc.start_stream()
+        block = adc.read(64)
+        adc.stop_stream()
+        self.assertEqual(block[:3].tolist(), [0, 256, 512])
+        self.assertEqual(block[40], 40 << 8)
+        request, xfers = messages[1]
+        self.assertEqual(request, spi_ioc_message(32))
+        self.assertEqual(xfers["len"].tolist(), [3] * 32)
+        self.assertEqual(int(xfers["rx_buf"][0]), adc._raw.ctypes.data + 3 * 32)
+        self.assertEqual(int(xfers["delay_usecs"][-1]), 0)
+        self.assertGreater(int(xfers["delay_usecs"][0]), 0)
+
+    def test_playback_frames(self):
+        """Test queued blocks reach the DAC as one frame per sample."""
+        spi = FakeSPI()
+        dac = DAC8532Output(self.config, spi=spi)
+        dac.rt_priority = 0
+        dac.start_stream()
+        dac.write(np.arange(64, dtype=np.int16).tobytes())
+        deadline = time.monotonic() + 2.0
+        while dac.samples_written < 64 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        dac.stop_stream()
+        self.assertEqual(dac.samples_written, 64)
+        self.assertEqual(spi.frames[1], bytes([0x10, 0x80, 0x01]))
+        self.assertEqual(spi.writes[-1], [0x10, 0x80, 0x00])
+
+    def test_batched_playback(self):
+        """Test a block goes out as SPI messages of one chip-select framed transfer per sample."""
+        spi = FakeSPI()
+        spi.fileno = lambda: 3
+        self.config["spi"]["dac_batch_frames"] = 32
+        dac = DAC8532Output(self.config, spi=spi)
+        dac.rt_priority = 0
+        messages = []
+        dac._ioctl = lambda fd, request, buf: messages.append((request, np.frombuffer(bytes(buf), dtype=SPI_IOC_TRANSFER)))
+        dac.start_stream()
+        dac.write(np.arange(64, dtype=np.int16).tobytes())
+        deadline = time.monotonic() + 2.0
+        while dac.samples_written < 64 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        dac.stop_stream()
+        self.assertEqual(spi.frames, [])
+        self.assertEqual(len(messages), 2)
+        request, xfers = messages[1]
+        self.assertEqual(request, spi_ioc_message(32))
+        self.assertEqual(xfers["len"].tolist(), [3] * 32)
+        self.assertEqual(xfers["cs_change"].tolist(), [1] * 31 + [0])
+        self.assertEqual(int(xfers["tx_buf"][0]), dac._frames.ctypes.data + 3 * 32)
+        self.assertEqual(dac._frames[32].tolist(), [0x10, 0x80, 32])
+        self.assertGreater(dac.stats()["achieved_rate"], 0)
+    
+    def test_batch_delay_tracks_rate(self):
+        """Test the inter-frame delay shrinks when frames go out too slowly."""
+        self.config["spi"]["dac_batch_frames"] = 32
+        spi = FakeSPI()
+        spi.fileno = lambda: 3
+        dac = DAC8532Output(self.config, spi=spi)
+        gap = dac.frame_gap_us
+        self.assertAlmostEqual(float(dac._xfers["delay_usecs"].sum()), gap * dac.frames, delta=1.0)
+        period_ns = 1e9 / dac.rate
+        dac._account(32, int(32 * (period_ns + 10000)))  # 10 us late per frame
+        self.assertAlmostEqual(dac.frame_gap_us, gap - 5.0, places=3)
+    
+    def test_spi_clock_must_fit_frame_period(self):
+        """Test a DAC SPI clock too slow for the sample rate is rejected up front."""
+        self.config["audio"]["sample_rate"] = 44100
+        self.config["spi"]["dac_speed_hz"] = 1000000  # 24 us per frame > 22.7 us period
+        with self.assertRaises(ValueError):
+            DAC8532Output(self.config, spi=FakeSPI())
+        self.assertEqual(dac_speed_for(44100), 4000000)
+        self.assertEqual(dac_speed_for(400000), 19200000)
+        with self.assertRaises(ValueError):
+            dac_speed_for(1000000)
+
+
+def write_wav(path, samples, rate=16000):
+    import wave
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.asarray(samples, dtype=np.int16).tobytes())
+
+
+class TestSimulatedBackends(unittest.TestCase):
+    """Test the simulated HAL backends and a headless pipeline run."""
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.config = main.load_config("config.sim.json")
+        self.config["audio"]["frames_per_buffer"] = 256
+        self.config["simulation"]["wav_path"] = os.path.join(self.tmp.name, "in.wav")
+        self.config["simulation"]["gpio_script"] = []
+        write_wav(self.config["simulation"]["wav_path"], np.arange(1000) % 500)
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_sim_config_is_valid(self):
+        """Test the shipped simulation config passes validation."""
+        errors, warnings = main.validate_config(main.load_config("config.sim.json"))
+        self.assertEqual(errors, [])
+    
+    def test_unknown_backend(self):
+        """Test unknown backend names are rejected."""
+        with self.assertRaises(ValueError):
+            hal.create("display", "nope", self.config)
+        self.config["audio"]["sink"] = "nope"
+        errors, warnings = main.validate_config(self.config)
+        self.assertTrue(any("audio.sink" in err for err in errors))
+    
+    def test_wav_source_paces_and_pads(self):
+        """Test the WAV source is paced at the sample rate and pads with silence."""
+        self.config["simulation"]["loop"] = False
+        source = hal.create("source", "wav", self.config, None)
+        start = time.monotonic()
+        blocks = [source.read(256).copy() for _ in range(5)]
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 5 * 256 / 16000 - 0.005)
+        self.assertEqual(blocks[1][0], 256)
+        self.assertTrue(source.finished)
+        self.assertEqual(blocks[3][1000 - 768:].tolist(), [0] * (1024 - 1000))
+    
+    def test_wav_source_loops(self):
+        """Test the WAV source wraps around when looping."""
+        source = hal.WavSource(self.config, self.config["simulation"]["wav_path"], realtime=False, loop=True)
+        for _ in range(4):
+            block = source.read(256)
+        self.assertEqual(block[1000 - 768], 0)
+        self.assertEqual(block[1000 - 768 + 1], 1)
+        self.assertFalse(source.finished)
+    
+    def test_null_sink_records_arrivals(self):
+        """Test the null sink records block timing and drains at the sample rate."""
+        sink = hal.NullSink(self.config, realtime=True)
+        block = bytes(2 * 256)
+        start = time.monotonic()
+        for _ in range(5):
+            sink.write(block)
+        self.assertGreaterEqual(time.monotonic() - start, 4 * 256 / 16000 - 0.005)
+        self.assertEqual(sink.blocks, 5)
+        self.assertEqual(sink.samples, 5 * 256)
+        self.assertEqual(len(sink.intervals_ms()), 4)
+    
+    def test_virtual_oled_counts_bytes(self):
+        """Test the OLED renders to the virtual panel and counts bytes."""
+        display = main.OLEDDisplay(self.config)
+        display.draw_text(["Mode: convert", "Lang: EN"])
+        self.assertIsInstance(display.device, hal.VirtualOLED)
+        self.assertGreater(display.device.data_bytes, 0)
+        self.assertLessEqual(display.device.data_bytes, 128 * 64 // 8)
+    
+    def test_scripted_buttons(self):
+        """Test scripted presses drive the GPIO controller."""
+        self.config["simulation"]["gpio_script"] = [
+            {"at_s": 0.0, "button": "bypass_button"},
+            {"at_s": 0.05, "button": "language_button", "hold_s": 0.01},
+        ]
+        state = main.StateManager(self.config)
+        gpioctl = main.GPIOController(self.config, state)
+        gpioctl.pins._thread.join(timeout=2.0)
+        snap = state.get_snapshot()
+        self.assertEqual(snap["mode"], "bypass")
+        self.assertEqual(snap["language"], "ES")
+        gpioctl.update_leds()
+        self.assertEqual(gpioctl.led_bypass.value, 1)
+    
+    def test_headless_pipeline(self):
+        """Test the threaded pipeline runs end to end on simulated devices."""
+        self.config["simulation"]["loop"] = True
+        self.config["stft"]["enabled"] = False
+        self.config["inference"]["model_dir"] = self.tmp.name
+        state = main.StateManager(self.config)
+        engine = main.AudioEngine(self.config, state)
+        self.assertIsInstance(engine.stream_in, hal.WavSource)
+        engine.start()
+        time.sleep(0.3)
+        engine.stop()
+        self.assertGreater(engine.stream_out.blocks, 5)
+        self.assertEqual(engine.ring_in.overruns, 0)
+        self.assertIn("total", state.get_snapshot()["latency_stages"])
+    
+    def test_headless_stereo_device(self):
+        """Test a stereo device is reduced to mono and fanned back out."""
+        self.config["audio"]["device_channels"] = 2
+        self.config["simulation"]["loop"] = True
+        self.config["stft"]["enabled"] = False
+        engine = main.AudioEngine(self.config, main.StateManager(self.config))
+        self.assertEqual(engine.stream_in.channels, 2)
+        self.assertEqual(engine._fan.shape, (256, 2))
+        engine.start()
+        time.sleep(0.2)
+        engine.stop()
+        sink = engine.stream_out
+        self.assertGreater(sink.blocks, 3)
+        self.assertEqual(sink.samples, sink.blocks * 256)
+
+
+class TestBenchmark(unittest.TestCase):
+    """Test the pipeline benchmark suite."""
+    
+    def setUp(self):
+        self.config = main.load_config()
+        self.config["audio"].update({"frames_per_buffer": 256, "channels": 1})
+        self.signal = benchmark.synthetic_signal(16000, 1.0)
+    
+    def test_synthetic_signal_is_reproducible(self):
+        """Test the synthetic input is deterministic."""
+        again = benchmark.synthetic_signal(16000, 1.0)
+        self.assertEqual(len(self.signal), 16000)
+        self.assertTrue(np.array_equal(self.signal, again))
+    
+    def test_stage_metrics(self):
+        """Test the stage benchmark reports block times and allocations."""
+        result = benchmark.bench_stage(self.config, self.signal, "bypass", "EN", blocks=20)
+        self.assertEqual(result["blocks"], 20)
+        self.assertAlmostEqual(result["budget_ms"], 16.0)
+        self.assertGreater(result["block_ms"]["p50"], 0)
+        self.assertLessEqual(result["block_ms"]["p50"], result["block_ms"]["max"])
+        self.assertGreaterEqual(result["alloc_peak_bytes_per_block"], 0)
+    
+    def test_pipeline_metrics(self):
+        """Test the real-time pipeline run reports latency, drops and CPU."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "in.wav")
+            write_wav(path, self.signal)
+            result = benchmark.bench_pipeline(self.config, path, 0.3)
+        self.assertGreater(result["blocks_out"], 0)
+        self.assertGreater(result["latency_ms"]["total"]["count"], 0)
+        self.assertEqual(result["drops"]["capture_overruns"], 0)
+        self.assertGreaterEqual(result["cpu_percent"], 0)
+    
+    def test_compare_flags_regressions(self):
+        """Test --compare counts metrics that got worse beyond the threshold."""
+        def report(p50):
+            return {"results": [{"input": "synthetic", "mode": "bypass", "frames_per_buffer": 256,
+                                 "sample_rate": 16000, "stage": {"block_ms": {"p50": p50}}}]}
+        self.assertEqual(benchmark.compare(report(1.05), report(1.0)), 0)
+        self.assertEqual(benchmark.compare(report(1.5), report(1.0)), 1)
+
+
 class TestErrorHandling(unittest.TestCase):
     """Test error handling in components."""
     
@@ -226,8 +1979,29 @@ def run_tests():
     
     # Add all test classes
     suite.addTests(loader.loadTestsFromTestCase(TestStateManager))
+    suite.addTests(loader.loadTestsFromTestCase(TestLevelMeter))
     suite.addTests(loader.loadTestsFromTestCase(TestConfigurationValidation))
+    suite.addTests(loader.loadTestsFromTestCase(TestAudioEngine))
+    suite.addTests(loader.loadTestsFromTestCase(TestAudioRingBuffer))
+    suite.addTests(loader.loadTestsFromTestCase(TestSharedAudioRing))
+    suite.addTests(loader.loadTestsFromTestCase(TestConversionWorker))
+    suite.addTests(loader.loadTestsFromTestCase(TestStreamingSTFT))
+    suite.addTests(loader.loadTestsFromTestCase(TestStreamResampler))
+    suite.addTests(loader.loadTestsFromTestCase(TestSessionManager))
+    suite.addTests(loader.loadTestsFromTestCase(TestMicroBatching))
+    suite.addTests(loader.loadTestsFromTestCase(TestStreamingModel))
+    suite.addTests(loader.loadTestsFromTestCase(TestSpeechGate))
+    suite.addTests(loader.loadTestsFromTestCase(TestOfflineConversion))
+    suite.addTests(loader.loadTestsFromTestCase(TestAdaptivePlayout))
+    suite.addTests(loader.loadTestsFromTestCase(TestDegradationScheduler))
+    suite.addTests(loader.loadTestsFromTestCase(TestVoiceNormalizer))
+    suite.addTests(loader.loadTestsFromTestCase(TestLatencyTracer))
+    suite.addTests(loader.loadTestsFromTestCase(TestMetricsWriter))
     suite.addTests(loader.loadTestsFromTestCase(TestConfigurationLoading))
+    suite.addTests(loader.loadTestsFromTestCase(TestOLEDDisplay))
+    suite.addTests(loader.loadTestsFromTestCase(TestSPIAudio))
+    suite.addTests(loader.loadTestsFromTestCase(TestSimulatedBackends))
+    suite.addTests(loader.loadTestsFromTestCase(TestBenchmark))
     suite.addTests(loader.loadTestsFromTestCase(TestErrorHandling))
     
     # Run tests